@@ -0,0 +1,137 @@
+"""
+Compare the legacy, cell-by-cell Portfolio.normalizeTime() with the current
+vectorized one, for correctness and speed.
+
+    python benchmarks/normalize_time.py [rows]
+
+Rows default to 200000. Each implementation runs on a naive ledger-like time
+column, with many date-only entries and duplicates, and on the same column
+made timezone-aware.
+"""
+
+import sys
+import timeit
+import datetime
+import numpy
+import pandas
+
+from investorzilla import Portfolio
+
+
+
+def legacyNormalizeTime(time, naiveTimeShift=12*3600):
+    """
+    Portfolio.normalizeTime() as it was before vectorization.
+    """
+    def randomTimedeltas(index):
+        vec=(
+            pandas.to_timedelta(
+                pandas.concat(
+                    max(2,int(
+                        numpy.ceil(
+                            len(index) /
+                            len(Portfolio.twoSeconds)
+                        )
+                    )) *
+                    [Portfolio.twoSeconds]
+                )
+                .head(len(index)),
+                unit='ms'
+            )
+        )
+
+        vec.index=index
+
+        return vec
+
+    timeShift=pandas.to_timedelta(naiveTimeShift, unit='s')
+
+    currtz=(
+        datetime.datetime.now(datetime.timezone.utc)
+        .astimezone()
+        .tzinfo
+    )
+
+    instrumented=(
+        time
+        .apply(
+            lambda cell:
+                pandas.Timestamp(cell+timeShift)
+                if cell.time()==datetime.time(0)
+                else pandas.Timestamp(cell)
+        )
+        .apply(
+            lambda cell:
+                cell.tz_localize(currtz)
+                if cell.tzinfo is None
+                else cell.tz_convert(currtz)
+        )
+        .dt
+        .tz_convert('UTC')
+    )
+
+    dups=instrumented.duplicated()
+
+    instrumented=pandas.concat(
+        [
+            instrumented[~dups],
+            instrumented[dups]+randomTimedeltas(instrumented[dups].index)
+        ]
+    )
+
+    return instrumented
+
+
+
+def makeTime(rows):
+    """
+    A time column as found in ledgers: half of the entries are date-only and
+    a fraction repeats the same day.
+    """
+    rng=numpy.random.default_rng(42)
+
+    days=pandas.Timestamp('2010-01-01') + pandas.to_timedelta(
+        rng.integers(0, 5000, rows),
+        unit='D'
+    )
+
+    seconds=pandas.to_timedelta(
+        rng.integers(0, 86400, rows) * rng.integers(0, 2, rows),
+        unit='s'
+    )
+
+    return pandas.Series(days + seconds)
+
+
+
+def main():
+    rows=int(sys.argv[1]) if len(sys.argv)>1 else 200000
+
+    cases=dict(
+        naive = makeTime(rows),
+        aware = makeTime(rows).dt.tz_localize('America/Sao_Paulo', ambiguous='NaT', nonexistent='shift_forward').dropna(),
+    )
+
+    for name,time in cases.items():
+        legacy=legacyNormalizeTime(time)
+        current=Portfolio.normalizeTime(time)
+
+        pandas.testing.assert_series_equal(legacy, current)
+
+        timings=dict()
+        for label,function in [('legacy',legacyNormalizeTime),('vectorized',Portfolio.normalizeTime)]:
+            timings[label]=min(timeit.repeat(lambda: function(time), number=1, repeat=3))
+
+        print(
+            '{name:>6}: {rows} rows, legacy {legacy:.3f}s, vectorized {vectorized:.3f}s, {speedup:.0f}× faster, identical output'.format(
+                name       = name,
+                rows       = time.shape[0],
+                speedup    = timings['legacy']/timings['vectorized'],
+                **timings
+            )
+        )
+
+
+
+if __name__ == "__main__":
+    main()
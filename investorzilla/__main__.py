@@ -2,11 +2,13 @@ import os
 import subprocess
 import sys
 import time
+import logging
+import argparse
 import importlib
 import webbrowser
 import investorzilla
 
-def main():
+def ui(args):
     # Investorzilla deserves its own port
     port=8601
 
@@ -46,5 +48,105 @@ def main():
     proc.wait()
 
 
+
+def warm(args):
+    """
+    Load investorzilla.yaml through Investor, refreshing the requested
+    domains, which also makes the internal fund and saves processed
+    snapshots to the cache. Then precompute reports of all configured views,
+    so the UI finds everything ready. Meant to run from cron or at container
+    start.
+    """
+    logging.basicConfig(
+        level  = logging.DEBUG if args.verbose else logging.INFO,
+        format = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+    )
+
+    refresh=set(args.refresh)
+    if 'all' in refresh:
+        refresh=investorzilla.Investor.domains
+
+    start=time.perf_counter()
+
+    investor=investorzilla.Investor(
+        file       = args.config,
+        refreshMap = {
+            domain: domain in refresh
+            for domain in investorzilla.Investor.domains
+        }
+    )
+
+    for source,metric in investor.metrics.items():
+        print(
+            '{source}: {outcome} in {elapsed:.3f}s after {attempts} attempt(s)'.format(
+                source=source,
+                **metric
+            )
+        )
+
+    if not args.no_reports:
+        for view,seconds in investor.precompute().items():
+            print(f'view {view or "(default)"}: precomputed in {seconds:.3f}s')
+
+    print(f'Warm in {time.perf_counter()-start:.3f}s')
+
+    failed=[s for s,m in investor.metrics.items() if m['outcome'] in ['failed','stale']]
+    if failed:
+        print(f'Served from stale cache: {", ".join(failed)}')
+        return 1
+
+    return 0
+
+
+
+def main():
+    parser=argparse.ArgumentParser(
+        prog        = 'investorzilla',
+        description = 'Manage your investments like a data scientist'
+    )
+
+    commands=parser.add_subparsers(dest='command')
+
+    commands.add_parser(
+        'ui',
+        help = 'Run the web UI (default)'
+    )
+
+    warmParser=commands.add_parser(
+        'warm',
+        help = 'Load data, refresh caches and precompute reports without the UI'
+    )
+    warmParser.add_argument(
+        '--config',
+        default = 'investorzilla.yaml',
+        help    = 'YAML config file (default: %(default)s)'
+    )
+    warmParser.add_argument(
+        '--refresh',
+        nargs   = '*',
+        default = [],
+        choices = sorted(investorzilla.Investor.domains) + ['all'],
+        help    = 'Domains to update from their original sources; others are loaded from cache'
+    )
+    warmParser.add_argument(
+        '--no-reports',
+        action  = 'store_true',
+        help    = 'Don’t precompute reports of configured views'
+    )
+    warmParser.add_argument(
+        '--verbose',
+        action  = 'store_true',
+        help    = 'Log debug messages'
+    )
+
+    args=parser.parse_args()
+
+    if args.command=='warm':
+        sys.exit(warm(args))
+
+    ui(args)
+
+
+
 if "__main__" in __name__:
     main()
@@ -1,11 +1,11 @@
 import datetime
 import logging
 import urllib
-import requests
 import numpy
 import pandas
 
-from .. import CurrencyConverter
+from ..            import CurrencyConverter
+from ..fetch       import FetchEngine
 
 
 class BCBCurrencyConverter(CurrencyConverter):
@@ -53,12 +53,15 @@ class BCBCurrencyConverter(CurrencyConverter):
 
         ptaxParamsStr = urllib.parse.urlencode(ptaxParams, safe="@$', ")
 
-        response=requests.get(ptax,params=ptaxParamsStr)
+        response=FetchEngine.run(FetchEngine.get(ptax,params=ptaxParamsStr))
 
         self.data=pandas.DataFrame(response.json()['value'])
 
         self.data.rename(columns={'dataHoraCotacao': 'time'}, inplace=True)
 
+        # Parse once, before caching, so DataCache keeps it typed
+        self.data['time']=pandas.to_datetime(self.data.time)
+
 
 
     def processData(self):
@@ -1,9 +1,10 @@
+import time
 import datetime
-import urllib
-import requests
+import threading
 import pandas
 
-from .. import CurrencyConverter
+from ..            import CurrencyConverter
+from ..fetch       import FetchEngine
 
 
 class CryptoCompareCurrencyConverter(CurrencyConverter):
@@ -17,8 +18,14 @@ class CryptoCompareCurrencyConverter(CurrencyConverter):
     api='https://min-api.cryptocompare.com/data/v2/histoday?fsym={cfrom}&tsym={cto}&limit=2000&toTs={maxTime}&api_key={key}'
 
 
-    def __init__(self, currencyFrom, currencyTo='USD', apiKey=None, cache=None, refresh=False):
+    def __init__(self, currencyFrom, currencyTo='USD', apiKey=None, cache=None, refresh=False, prefetched=None):
+        """
+        prefetched is raw data already fetched by backfill(), used instead of
+        fetching again if data has to be refreshed. See
+        CryptoCompareCurrencyConverterGroup.
+        """
         self.apiKey=apiKey
+        self.prefetched=prefetched
 
         super().__init__(
             currencyFrom  = currencyFrom,
@@ -34,27 +41,50 @@ class CryptoCompareCurrencyConverter(CurrencyConverter):
 
 
     def refreshData(self):
-        self.data=None
+        if self.prefetched is not None:
+            (self.data,self.prefetched)=(self.prefetched,None)
+        else:
+            self.data=FetchEngine.run(
+                CryptoCompareCurrencyConverter.backfill(
+                    self.currencyFrom,
+                    self.currencyTo,
+                    self.apiKey
+                )
+            )
+
+
+
+    async def backfill(currencyFrom, currencyTo, apiKey):
+        """
+        Coroutine that pages back in time, 2000 days per request, through the
+        shared fetch engine, until closing price is zero. Returns the
+        concatenation of all pages.
+        """
+        pages=None
 
-        maxTime=datetime.datetime.utcnow().timestamp()+(24*3600)
+        # Start at next midnight UTC, not at now, so URLs are the same all day
+        # long and responses can be served by HTTPClient’s cache
+        maxTime=(datetime.datetime.utcnow().timestamp()//(24*3600)+1)*(24*3600)
 
         for t in range(10):
             # Go back in time until closing price equals zero
-            data=requests.get(
-                self.api.format(
-                    cfrom=self.currencyFrom,
-                    cto=self.currencyTo,
-                    key=self.apiKey,
-                    maxTime=round(maxTime)
+            data=(
+                await FetchEngine.get(
+                    CryptoCompareCurrencyConverter.api.format(
+                        cfrom=currencyFrom,
+                        cto=currencyTo,
+                        key=apiKey,
+                        maxTime=round(maxTime)
+                    )
                 )
             ).json()
 
             table=pandas.DataFrame(data['Data']['Data'])
 
-            if self.data is None:
-                self.data=table
+            if pages is None:
+                pages=table
             else:
-                self.data=pandas.concat([self.data,table])
+                pages=pandas.concat([pages,table])
 
             if table[table['time']==data['Data']['TimeFrom']]['close'][0]==0:
                 # First datapoint of iteration presents no closing price.
@@ -63,7 +93,7 @@ class CryptoCompareCurrencyConverter(CurrencyConverter):
             else:
                 maxTime=data['Data']['TimeFrom']
 
-        self.data = self.data[self.data.close != 0]
+        return pages[pages.close != 0]
 
 
 
@@ -82,3 +112,118 @@ class CryptoCompareCurrencyConverter(CurrencyConverter):
 
             .drop(columns="high low open volumefrom volumeto conversionType conversionSymbol ts".split())
         )
+
+
+
+
+
+
+
+class CryptoCompareCurrencyConverterGroup(object):
+    """
+    Many CryptoCompareCurrencyConverters loaded together.
+
+    CryptoCompare’s daily history API takes one coin per request, so instead
+    of each coin paging back in time on its own, one after the other, the
+    group backfills all coins that need fresh data at the same time, as
+    coroutines of the shared fetch engine, which also limits requests in
+    flight to CryptoCompare. Refresh time then grows with the number of pages
+    of the longest history, not with coins × pages.
+
+    Result is available in self.converters as one regular
+    CryptoCompareCurrencyConverter per coin, with its own cache entry.
+    Investor splits them into individual currency converters. If some coins
+    fail, the others are still cached and then the first error is raised.
+    When SourceRunner retries the group, coins cached by the failed attempt
+    are loaded from cache and only the ones that failed are fetched again.
+    Use it in the YAML config file as:
+
+        currency_converters:
+            - type: !!python/name:investorzilla.currency.cryptocompare.CryptoCompareCurrencyConverterGroup ''
+              params:
+                    apiKey: b1b...f7123
+                    currencies: [BTC, ETH, LTC]
+    """
+
+    # Coins cached by attempts that failed on other coins, as
+    # {(currencyTo, cache URL): {coin: monotonic time}}. The retry that comes
+    # right after loads them from cache instead of fetching them again.
+    refreshed        = dict()
+    refreshedLock    = threading.Lock()
+
+    # Seconds a failed attempt’s coins are good for its retry
+    retryWindow      = 600
+
+
+
+    def __init__(self, currencies, currencyTo='USD', apiKey=None, cache=None, refresh=False):
+        self.currencies=currencies
+        self.currencyTo=currencyTo
+
+        key=(currencyTo, None if cache is None else cache.url)
+
+        with CryptoCompareCurrencyConverterGroup.refreshedLock:
+            done={
+                c: t
+                for c,t in CryptoCompareCurrencyConverterGroup.refreshed.pop(key, dict()).items()
+                if time.monotonic()-t < CryptoCompareCurrencyConverterGroup.retryWindow
+            }
+
+        # Coins that will need data from the Internet
+        missing=[
+            c for c in currencies
+            if c not in done and (
+                refresh or
+                cache is None or
+                cache.current(kind='CryptoCompareCurrencyConverter', id=c) is None
+            )
+        ]
+
+        results=FetchEngine.gather(
+            *[
+                CryptoCompareCurrencyConverter.backfill(c, currencyTo, apiKey)
+                for c in missing
+            ]
+        )
+
+        prefetched=dict()
+        errors=dict()
+        for (c,result) in zip(missing,results):
+            if isinstance(result, Exception):
+                errors[c]=result
+            else:
+                prefetched[c]=result
+
+        # Coins that succeeded are cached even if others failed, so a retry
+        # doesn’t fetch them again
+        self.converters=[
+            CryptoCompareCurrencyConverter(
+                currencyFrom  = c,
+                currencyTo    = currencyTo,
+                apiKey        = apiKey,
+                cache         = cache,
+                refresh       = c in prefetched,
+                prefetched    = prefetched.get(c)
+            )
+            for c in currencies
+            if c not in errors
+        ]
+
+        if errors:
+            if cache is not None:
+                with CryptoCompareCurrencyConverterGroup.refreshedLock:
+                    CryptoCompareCurrencyConverterGroup.refreshed[key]=dict(
+                        done,
+                        **{c: time.monotonic() for c in prefetched}
+                    )
+
+            raise next(iter(errors.values()))
+
+
+
+    def __repr__(self):
+        return '{klass}(to={cto},currencies={currencies})'.format(
+            klass      = type(self).__name__,
+            cto        = self.currencyTo,
+            currencies = ','.join(self.currencies),
+        )
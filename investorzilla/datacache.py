@@ -1,5 +1,15 @@
+import time
+import json
+import pickle
+import atexit
 import logging
+import hashlib
+import tempfile
+import threading
+import collections
+import importlib.metadata
 import sqlalchemy
+import numpy
 import pandas
 
 
@@ -37,18 +47,95 @@ class DataCache(object):
     (max(__DataCache_time)). The maximum number of versions kept are defined by
     the __init__()’s recycle attribute. Older versions of data will be
     automatically deleted.
-    """
-
-    idCol       = '__datacache_id'
-    timeCol     = '__datacache_time'
-    typeTable   = 'datacache__{kind}'
-
 
+    Recently read versions are also kept in a bounded in-memory LRU (the hot
+    tier), shared by all DataCache objects of the process and keyed by
+    (url, kind, id, version time). So a rebuilt Investor gets unchanged
+    benchmarks, currencies and portfolios from memory instead of the
+    database. The hot tier holds up to hotSize versions and is invalidated
+    for a kind and id on every set(). See hotStats() for its counters.
+
+    Each version written by set() is registered in table `datacache_versions`
+    along with a hash of its content. When set() receives data identical to
+    the last version, nothing is written and the last version just gets its
+    __DataCache_time touched to current time. The registry also keeps the
+    schema of each version (dtypes, timezones, categorical columns), so
+    get() returns data with the exact dtypes it had on set(), and consumers
+    don’t have to parse strings into datetimes and numbers again.
+
+    Append-mostly datasets as market indexes and ledgers can be stored in
+    delta mode (delta=True). A new version is then kept in table
+    `datacache_delta__{kind}` only as the rows appended or modified in
+    relation to its parent version, which is the previous one. Versions are
+    reconstructed on get(). A chain of deltas is folded back into a full
+    snapshot when it reaches maxChain versions or when compact() is called.
+    This allows a higher recycle at a fraction of storage and write time.
+
+    Deletion of old versions doesn’t happen on the critical path of set().
+    Kinds and ids written are queued and a background maintenance thread,
+    one per database URL, cleans them every `maintenance` seconds, batching
+    deletions of all queued ids of a kind in one statement, and refreshing
+    planner statistics where the database benefits from it. Pending cleanups
+    are also run when the process exits. Use maintenance=None to clean
+    synchronously inside set(), as in the past. A full SQLite VACUUM locks
+    the whole database while it runs, so it is only done if vacuum is set,
+    after that many rows were deleted.
+
+    Consumers can also keep the result of their processing of a version in
+    table `datacache_processed`, as a pickled DataFrame, with
+    setProcessed(). It is keyed by the version time and by a fingerprint()
+    of the processing code and configuration, so getProcessed() lets warm
+    starts skip processing altogether. Only the last processed snapshot of
+    each kind and id is kept, and cleanProcessed() deletes those of a kind
+    made from older versions.
+
+    Small per kind and id attributes, such as HTTP validators of the source
+    of a dataset, can be kept in table `datacache_attributes` with
+    setAttributes() and read with getAttributes().
+    """
 
-    def __init__(self, url='sqlite:///cache.db?check_same_thread=False', recycle=5):
+    idCol           = '__datacache_id'
+    timeCol         = '__datacache_time'
+    kindCol         = '__datacache_kind'
+    hashCol         = '__datacache_hash'
+    parentCol       = '__datacache_parent'
+    rowsCol         = '__datacache_rows'
+    rowCol          = '__datacache_row'
+    storageCol      = '__datacache_storage'
+    schemaCol       = '__datacache_schema'
+    fingerprintCol  = '__datacache_fingerprint'
+    dataCol         = '__datacache_data'
+    attributesCol   = '__datacache_attributes'
+    typeTable       = 'datacache__{kind}'
+    deltaTable      = 'datacache_delta__{kind}'
+    versionsTable   = 'datacache_versions'
+    processedTable  = 'datacache_processed'
+    attributesTable = 'datacache_attributes'
+
+    # The process-wide hot tier, its lock and its counters
+    hot           = collections.OrderedDict()
+    hotLock       = threading.Lock()
+    hotHits       = 0
+    hotMisses     = 0
+
+    # Background maintenance: queued cleanups as {(url,kind,id): DataCache},
+    # one thread per URL and rows deleted since last VACUUM per URL
+    pending       = dict()
+    pendingLock   = threading.Lock()
+    maintainers   = dict()
+    deletedRows   = collections.Counter()
+
+
+
+    def __init__(self, url='sqlite:///cache.db?check_same_thread=False', recycle=5, hotSize=64, delta=False, maxChain=10, maintenance=300, vacuum=None):
         self.url=url
         self.db=None
         self.recycle=recycle
+        self.hotSize=hotSize
+        self.delta=delta
+        self.maxChain=maxChain
+        self.maintenance=maintenance
+        self.vacuum=vacuum
 
         # Setup logging
         self.getLogger()
@@ -58,9 +145,11 @@ class DataCache(object):
 
 
     def __repr__(self):
-        return 'DataCache(url={url},recycle={recycle})'.format(
+        return 'DataCache(url={url},recycle={recycle},hotSize={hotSize},delta={delta})'.format(
             url=self.url,
-            recycle=self.recycle
+            recycle=self.recycle,
+            hotSize=self.hotSize,
+            delta=self.delta
         )
 
 
@@ -211,10 +300,48 @@ class DataCache(object):
         recent up to time.
 
         Returns a tuple with table and time of cache data.
+
+        The version is first resolved with a lightweight query and then served
+        from the hot tier, if there, or read from the database and put in the
+        hot tier. Versions stored in delta mode are reconstructed from their
+        chain of parents.
         """
 
         table=self.typeTable.format(kind=kind).lower()
 
+        registry=self.versions(kind, id)
+        entry=self.pick(registry, time)
+
+        if entry is not None:
+            version=entry[self.timeCol]
+        else:
+            # Unregistered versions, written before datacache_versions existed
+            version=self.version(kind, id, time)
+
+        if version is not None:
+            df=self.hotGet(kind, id, version)
+            if df is not None:
+                age=pandas.Timestamp(version)
+                self.getLogger().info(f"Hot cache for kind={kind} and id={id} has {df.shape[0]} entries and was cached at {age}")
+                return (df,age)
+
+        if entry is not None and entry[self.storageCol] in ('snapshot','delta'):
+            try:
+                df=self.restore(
+                    self.reconstruct(kind, id, registry, version),
+                    entry[self.schemaCol]
+                )
+            except Exception as e:
+                self.getLogger().info(f"No cache for kind={kind} and id={id}")
+                self.getLogger().info(e)
+
+                return (None,None)
+
+            age=pandas.Timestamp(version)
+            self.getLogger().info(f"Cache for kind={kind} and id={id} has {df.shape[0]} entries and was cached at {age}")
+            self.hotPut(kind, id, version, df)
+            return (df.copy(),age)
+
         if time is None:
             pointInTime='''
             (
@@ -269,9 +396,16 @@ class DataCache(object):
                 df=pandas.read_sql(query,con=db)
 
             if df.shape[0]>0:
-                age=pandas.Timestamp(df[self.timeCol].max())
+                version=df[self.timeCol].max()
+                age=pandas.Timestamp(version)
                 self.getLogger().info(f"Cache for kind={kind} and id={id} has {df.shape[0]} entries and was cached at {age}")
-                return (df.drop(columns=[self.timeCol,self.idCol]),age)
+                df=df.drop(columns=[self.timeCol,self.idCol])
+
+                if entry is not None and str(entry[self.timeCol])==str(version):
+                    df=self.restore(df, entry[self.schemaCol])
+
+                self.hotPut(kind, id, version, df)
+                return (df.copy(),age)
             else:
                 self.getLogger().info(f"Cache empty for kind={kind} and id={id}")
                 return (None,None)
@@ -284,7 +418,120 @@ class DataCache(object):
 
 
 
+    def version(self, kind, id, time=None):
+        """
+        Return the raw value of __datacache_time of the version that get()
+        would read for kind, id and time, or None if there is no such version.
+
+        The value is returned as the database delivers it, without parsing,
+        so it can be used as a key for the hot tier.
+        """
+
+        q='''
+            SELECT max({timeCol}) AS version
+            FROM {typeTable}
+            WHERE {idCol} = '{id}'
+        '''
+
+        if time is not None:
+            q+=''' AND {timeCol} <= '{time}' '''
+
+        query=q.format(
+            typeTable     = self.typeTable.format(kind=kind).lower(),
+            idCol         = self.idCol,
+            timeCol       = self.timeCol,
+            id            = id,
+            time          = time
+        )
+
+        try:
+            with self.getDB().connect() as db:
+                df=pandas.read_sql(query,con=db)
+        except Exception as e:
+            self.getLogger().debug(f"No cache version for kind={kind} and id={id}")
+            self.getLogger().debug(e)
+            return None
+
+        if df.shape[0]>0 and not pandas.isna(df['version'][0]):
+            return df['version'][0]
+
+        return None
+
+
+
+    def hotGet(self, kind, id, version):
+        """
+        Return a copy of the DataFrame kept in the hot tier for this version
+        of kind and id, or None.
+        """
+
+        key=(self.url, kind.lower(), id, str(version))
+
+        with DataCache.hotLock:
+            df=DataCache.hot.get(key)
+
+            if df is None:
+                DataCache.hotMisses+=1
+                return None
+
+            DataCache.hotHits+=1
+            DataCache.hot.move_to_end(key)
+
+        return df.copy()
+
+
+
+    def hotPut(self, kind, id, version, data):
+        """
+        Keep data in the hot tier, evicting least recently used versions
+        beyond hotSize.
+        """
+
+        if not self.hotSize:
+            return
+
+        key=(self.url, kind.lower(), id, str(version))
+
+        with DataCache.hotLock:
+            DataCache.hot[key]=data
+            DataCache.hot.move_to_end(key)
+
+            while len(DataCache.hot)>self.hotSize:
+                DataCache.hot.popitem(last=False)
+
+
+
+    def hotInvalidate(self, kind, id):
+        """
+        Forget all hot tier versions of kind and id.
+        """
+
+        prefix=(self.url, kind.lower(), id)
+
+        with DataCache.hotLock:
+            for key in [k for k in DataCache.hot if k[:3]==prefix]:
+                del DataCache.hot[key]
+
+
+
+    def hotStats(self):
+        """
+        Return a dict with hits, misses and number of entries of the hot tier.
+        """
+
+        with DataCache.hotLock:
+            return dict(
+                hits      = DataCache.hotHits,
+                misses    = DataCache.hotMisses,
+                entries   = len(DataCache.hot),
+            )
+
+
+
     def cleanOld(self, kind, id):
+        if self.delta:
+            return self.cleanOldDeltas(kind, id)
+
         # Next query is overcomplicated because couldn’t make work its simplest version:
         # cleanQuery='''
         #     DELETE
@@ -333,6 +580,14 @@ class DataCache(object):
             AND {timeCol} <= '{deprecated}'
         '''
 
+        versionsCleaner='''
+            DELETE
+            FROM {versionsTable}
+            WHERE {kindCol} = '{kind}'
+            AND {idCol} = '{id}'
+            AND {timeCol} <= '{deprecated}'
+        '''
+
         if self.recycle is not None:
             with self.getDB().connect() as db:
                 deprecated=pandas.read_sql_query(
@@ -358,10 +613,269 @@ class DataCache(object):
 
                     self.getLogger().debug(f'Clean old cache entries as {cleanQuery}')
                     db.execute(sqlalchemy.text(cleanQuery))
+
+                    # Forget the deleted versions too
+                    db.execute(
+                        sqlalchemy.text(
+                            versionsCleaner.format(
+                                versionsTable = self.versionsTable,
+                                kindCol       = self.kindCol,
+                                idCol         = self.idCol,
+                                timeCol       = self.timeCol,
+                                kind          = kind.lower(),
+                                id            = id,
+                                deprecated    = deprecated.deprecated.iloc[0]
+                            )
+                        )
+                    )
+
                     db.commit()
 
 
 
+    ############################################################################
+    ##
+    ## Background maintenance
+    ##
+    ############################################################################
+
+    def scheduleClean(self, kind, id):
+        """
+        Queue kind and id for deletion of old versions by the background
+        maintenance thread, or clean right away if maintenance is disabled.
+        """
+
+        if not self.maintenance:
+            self.cleanOld(kind, id)
+            return
+
+        with DataCache.pendingLock:
+            DataCache.pending[(self.url, kind, id)]=self
+
+            if (
+                    self.url not in DataCache.maintainers or
+                    not DataCache.maintainers[self.url].is_alive()
+                ):
+                if len(DataCache.maintainers)==0:
+                    atexit.register(DataCache.maintainAll)
+
+                DataCache.maintainers[self.url]=threading.Thread(
+                    target  = self.maintenanceLoop,
+                    name    = 'datacache_maintenance',
+                    daemon  = True
+                )
+                DataCache.maintainers[self.url].start()
+
+
+
+    def maintenanceLoop(self):
+        self.getLogger().debug(f"Background maintenance of {self.url} every {self.maintenance}s")
+
+        while True:
+            time.sleep(self.maintenance)
+
+            try:
+                self.maintain()
+            except Exception as e:
+                self.getLogger().warning(f"Background maintenance of {self.url} failed")
+                self.getLogger().info(e)
+
+
+
+    @staticmethod
+    def maintainAll():
+        """
+        Run pending cleanups of all databases. Called when the process exits.
+        """
+
+        with DataCache.pendingLock:
+            caches={c.url: c for c in DataCache.pending.values()}
+
+        for cache in caches.values():
+            cache.maintain(optimize=False)
+
+
+
+    def maintain(self, optimize=True):
+        """
+        Delete old versions of all kinds and ids queued for this database,
+        batching all ids of a kind, and then optimize storage of tables that
+        had rows deleted.
+        """
+
+        with DataCache.pendingLock:
+            queued=[
+                (key,cache)
+                for key,cache in DataCache.pending.items()
+                if key[0]==self.url
+            ]
+            for key,cache in queued:
+                del DataCache.pending[key]
+
+        # Group as {(cache, kind): [id, id, ...]}
+        batches=collections.defaultdict(list)
+        for (url,kind,id),cache in queued:
+            batches[(cache,kind)].append(id)
+
+        deleted=0
+        tables=set()
+        start=time.monotonic()
+
+        for (cache,kind),ids in batches.items():
+            try:
+                if cache.delta:
+                    for id in ids:
+                        deleted+=cache.cleanOldDeltas(kind, id)
+                    tables.add(cache.deltaTable.format(kind=kind).lower())
+                else:
+                    deleted+=cache.cleanOldBatch(kind, ids)
+                    tables.add(cache.typeTable.format(kind=kind).lower())
+            except Exception as e:
+                self.getLogger().warning(f"Failed to clean old versions of kind={kind}")
+                self.getLogger().info(e)
+
+        if len(queued)>0:
+            self.getLogger().info(
+                "Maintenance cleaned {n} kinds/ids and deleted {deleted} rows in {elapsed:.2f}s".format(
+                    n        = len(queued),
+                    deleted  = deleted,
+                    elapsed  = time.monotonic()-start
+                )
+            )
+
+        if optimize and deleted>0:
+            tables.add(self.versionsTable)
+            self.optimize(tables, deleted)
+
+
+
+    def cleanOldBatch(self, kind, ids):
+        """
+        Same as cleanOld() but for many ids of a kind at once: one SELECT to
+        find deprecated versions of all ids and one DELETE per table.
+
+        Returns the number of rows deleted.
+        """
+
+        if self.recycle is None or len(ids)==0:
+            return 0
+
+        table=self.typeTable.format(kind=kind).lower()
+
+        versionSelector='''
+            SELECT DISTINCT {idCol}, {timeCol}
+            FROM {typeTable}
+            WHERE {idCol} IN :ids
+        '''
+
+        with self.getDB().connect() as db:
+            versions=pandas.read_sql(
+                sqlalchemy.text(
+                    versionSelector.format(
+                        typeTable    = table,
+                        idCol        = self.idCol,
+                        timeCol      = self.timeCol,
+                    )
+                )
+                .bindparams(sqlalchemy.bindparam('ids', expanding=True)),
+                con=db,
+                params=dict(ids=list(ids))
+            )
+
+            # The newest deprecated version of each id, which is the one right
+            # after the recycle newest versions
+            deprecated=(
+                versions
+                .sort_values(self.timeCol, ascending=False)
+                .groupby(self.idCol)
+                .nth(self.recycle)
+            )
+
+            if deprecated.shape[0]==0:
+                return 0
+
+            conditions=' OR '.join(
+                [
+                    f"({self.idCol} = :id{i} AND {self.timeCol} <= :time{i})"
+                    for i in range(deprecated.shape[0])
+                ]
+            )
+
+            params=dict()
+            for i,(id,deprecatedTime) in enumerate(
+                        zip(deprecated[self.idCol],deprecated[self.timeCol])
+                    ):
+                params[f'id{i}']=id
+                params[f'time{i}']=deprecatedTime
+
+            cleaner='''
+                DELETE
+                FROM {table}
+                WHERE ({conditions}) {extra}
+            '''
+
+            deleted=0
+            for t,extra in [
+                        (table,              ''),
+                        (self.versionsTable, f"AND {self.kindCol} = :kind"),
+                    ]:
+                cleanQuery=cleaner.format(
+                    table       = t,
+                    conditions  = conditions,
+                    extra       = extra
+                )
+
+                self.getLogger().debug(f'Clean old cache entries as {cleanQuery}')
+
+                deleted+=db.execute(
+                    sqlalchemy.text(cleanQuery),
+                    dict(params, kind=kind.lower())
+                ).rowcount
+
+            db.commit()
+
+        return deleted
+
+
+
+    def optimize(self, tables, deleted):
+        """
+        Reclaim space and refresh planner statistics after deletion of rows
+        from tables, in the way each database likes it.
+        """
+
+        dialect=self.getDB().dialect.name
+
+        DataCache.deletedRows[self.url]+=deleted
+
+        statements=[]
+        if dialect=='postgresql':
+            statements=[f'VACUUM ANALYZE {t}' for t in tables]
+        elif dialect in ('mysql','mariadb'):
+            statements=[f'ANALYZE TABLE {t}' for t in tables]
+        elif dialect=='sqlite':
+            statements=[f'ANALYZE {t}' for t in tables]
+            if self.vacuum and DataCache.deletedRows[self.url]>=self.vacuum:
+                statements.append('VACUUM')
+
+        if len(statements)==0:
+            return
+
+        try:
+            # VACUUM can’t run inside a transaction
+            with self.getDB().connect().execution_options(isolation_level='AUTOCOMMIT') as db:
+                for statement in statements:
+                    self.getLogger().debug(f'Optimize cache database with {statement}')
+                    db.execute(sqlalchemy.text(statement))
+        except Exception as e:
+            self.getLogger().warning(f"Failed to optimize cache database")
+            self.getLogger().info(e)
+        else:
+            if 'VACUUM' in statements:
+                DataCache.deletedRows[self.url]=0
+
+
+
     def set(self, kind, id, data):
         """
         kind leads to table datacache__{kind}
@@ -371,19 +885,52 @@ class DataCache(object):
         Current time is written to column __datacache_time
 
         data is a DataFrame whose columns are the other columns of table datacache__{kind}
+
+        If data has the same content as the last version, no data is written
+        and the last version is just touched with current time.
+
+        data can also be an iterable of DataFrames with same columns, chunks of
+        a dataset too big to be held in memory at once. See setChunks().
+
+        Returns the time of the version, to be used with setProcessed().
         """
 
-        d=data.copy()
+        if not isinstance(data, pandas.DataFrame):
+            if self.delta:
+                # Deltas are computed against the whole parent version
+                data=pandas.concat(list(data), ignore_index=True)
+            else:
+                return self.setChunks(kind, id, data)
+
+        now=pandas.Timestamp.utcnow()
+
+        digest=self.digest(data)
+        previous=self.lastVersion(kind, id)
+
+        if digest is not None and previous is not None and previous[self.hashCol]==digest:
+            self.getLogger().info(f'Cache for kind={kind}, id={id} is unchanged; touching it with time={now}')
+            self.touch(kind, id, previous, now)
+            self.hotInvalidate(kind, id)
+            return now
+
+        if self.delta:
+            self.setDelta(kind, id, data, now, digest, previous)
+            self.hotInvalidate(kind, id)
+            self.scheduleClean(kind, id)
+            return now
+
+        d=self.prepare(data)
 
         columns=list(d.columns)
 
         d[self.idCol]=id
-        now=pandas.Timestamp.utcnow()
         d[self.timeCol]=now
 
 
         self.getLogger().info(f'Set cache to kind={kind}, id={id}, time={now}')
 
+        self.hotInvalidate(kind, id)
+
         with self.getDB().connect() as db:
             d[[self.idCol,self.timeCol] + columns].to_sql(
                 self.typeTable.format(kind=kind).lower(),
@@ -394,4 +941,1143 @@ class DataCache(object):
                 method      = 'multi'
             )
 
-        self.cleanOld(kind, id)
\ No newline at end of file
+        self.setVersion(kind, id, now, digest, schema=self.schema(data))
+
+        self.scheduleClean(kind, id)
+
+        return now
+
+
+
+    def setChunks(self, kind, id, chunks):
+        """
+        Write the DataFrames yielded by chunks as one new version of kind and
+        id, holding only one chunk in memory at a time. Chunks are consumed
+        only once.
+
+        Chunks are first staged in a local temporary file while the dtypes of
+        their concatenation are found. Content is then hashed with those
+        dtypes, giving the same digest as set() would for
+        pandas.concat(chunks). If it is the same as the last version, nothing
+        is written to the database and the last version is just touched.
+        Otherwise staged chunks are appended to the database.
+
+        Returns the time of the version, or None if there were no chunks.
+        """
+
+        now=pandas.Timestamp.utcnow()
+        table=self.typeTable.format(kind=kind).lower()
+
+        with tempfile.TemporaryFile() as staging:
+            # Empty frame with the columns and dtypes of all chunks together
+            head=None
+            count=0
+
+            for chunk in chunks:
+                pickle.dump(chunk, staging, protocol=pickle.HIGHEST_PROTOCOL)
+                count+=1
+
+                head=chunk.iloc[0:0] if head is None else pandas.concat([head,chunk.iloc[0:0]])
+
+            if head is None:
+                return None
+
+            dtypes=head.dtypes.to_dict()
+
+            def staged():
+                staging.seek(0)
+                for i in range(count):
+                    yield pickle.load(staging).astype(dtypes)
+
+            h=hashlib.sha256()
+            h.update(repr(list(zip(head.columns,head.dtypes.astype(str)))).encode())
+            for chunk in staged():
+                h.update(
+                    pandas.util.hash_pandas_object(chunk, index=False)
+                    .to_numpy()
+                    .tobytes()
+                )
+
+            digest=h.hexdigest()
+            previous=self.lastVersion(kind, id)
+
+            self.hotInvalidate(kind, id)
+
+            if previous is not None and previous[self.hashCol]==digest:
+                self.getLogger().info(f'Cache for kind={kind}, id={id} is unchanged; touching it with time={now}')
+                self.touch(kind, id, previous, now)
+                return now
+
+            rows=0
+            for chunk in staged():
+                d=self.prepare(chunk)
+
+                columns=list(d.columns)
+
+                d[self.idCol]=id
+                d[self.timeCol]=now
+
+                with self.getDB().connect() as db:
+                    d[[self.idCol,self.timeCol] + columns].to_sql(
+                        table,
+                        index       = False,
+                        if_exists   = 'append',
+                        chunksize   = 999,
+                        con         = db,
+                        method      = 'multi'
+                    )
+
+                rows+=d.shape[0]
+
+        self.getLogger().info(f'Set cache to kind={kind}, id={id}, time={now} with {rows} rows in chunks')
+
+        self.setVersion(kind, id, now, digest, schema=self.schema(head))
+
+        self.scheduleClean(kind, id)
+
+        return now
+
+
+
+    def append(self, kind, id, data, appended):
+        """
+        Write data as a new version of kind and id, as set() does, knowing
+        that it is the last version with appended rows added to its end, as
+        incremental sources make.
+
+        In delta mode, only the appended rows are written, as a delta of the
+        last version, without reading it back to find what changed. Otherwise,
+        or if the last version can’t be the parent of data, whole data is
+        written by set(), because each version in table storage is a full
+        copy.
+
+        Returns the time of the version.
+        """
+
+        previous=self.lastVersion(kind, id)
+
+        if (
+                self.delta and
+                appended>0 and
+                previous is not None and
+                previous[self.storageCol] in ('snapshot','delta') and
+                pandas.notna(previous[self.rowsCol]) and
+                int(previous[self.rowsCol])==data.shape[0]-appended
+            ):
+            try:
+                chain=self.chain(self.versions(kind, id), previous[self.timeCol])
+            except KeyError:
+                chain=None
+
+            if chain is not None and len(chain) < self.maxChain:
+                now=pandas.Timestamp.utcnow()
+
+                self.writeDelta(
+                    kind,
+                    id,
+                    data,
+                    now,
+                    self.digest(data),
+                    numpy.arange(data.shape[0]-appended, data.shape[0]),
+                    previous[self.timeCol]
+                )
+
+                self.hotInvalidate(kind, id)
+                self.scheduleClean(kind, id)
+
+                return now
+
+        return self.set(kind, id, data)
+
+
+
+    def digest(self, data):
+        """
+        Return a hash of the content of the data DataFrame: its column names,
+        dtypes and values. Or None if data can’t be hashed.
+        """
+
+        try:
+            h=hashlib.sha256()
+            h.update(repr(list(zip(data.columns,data.dtypes.astype(str)))).encode())
+            h.update(
+                pandas.util.hash_pandas_object(data, index=False)
+                .to_numpy()
+                .tobytes()
+            )
+            return h.hexdigest()
+        except Exception as e:
+            self.getLogger().debug(f"Can’t hash data: {e}")
+            return None
+
+
+
+    def versions(self, kind, id):
+        """
+        Return a DataFrame with all versions of kind and id registered in
+        datacache_versions, oldest first. It is empty if there are none.
+        """
+
+        q='''
+            SELECT *
+            FROM {versionsTable}
+            WHERE
+                {kindCol} = '{kind}' AND
+                {idCol}   = '{id}'
+            ORDER BY {timeCol}
+        '''
+
+        query=q.format(
+            versionsTable = self.versionsTable,
+            kindCol       = self.kindCol,
+            idCol         = self.idCol,
+            timeCol       = self.timeCol,
+            kind          = kind.lower(),
+            id            = id
+        )
+
+        try:
+            with self.getDB().connect() as db:
+                registry=pandas.read_sql(query,con=db)
+        except Exception as e:
+            # Table doesn’t exist yet
+            self.getLogger().debug(e)
+            return pandas.DataFrame()
+
+        # Registry might have been created by an older version of DataCache
+        for column in [self.parentCol, self.rowsCol, self.storageCol, self.schemaCol]:
+            if column not in registry.columns:
+                registry[column]=None
+
+        return registry
+
+
+
+    def pick(self, registry, time=None):
+        """
+        Return the registry entry of the most recent version up to time, or
+        None.
+        """
+
+        if registry is None or registry.shape[0]==0:
+            return None
+
+        if time is None:
+            return registry.iloc[-1]
+
+        time=pandas.Timestamp(time)
+        if time.tzinfo is None:
+            time=time.tz_localize('UTC')
+
+        times=pandas.to_datetime(
+            registry[self.timeCol].astype(str),
+            format='mixed',
+            utc=True
+        )
+
+        candidates=registry[(times<=time).to_numpy()]
+
+        if candidates.shape[0]==0:
+            return None
+
+        return candidates.iloc[-1]
+
+
+
+    def lastVersion(self, kind, id):
+        """
+        Return a dict with the registry entry (__datacache_time,
+        __datacache_hash etc) of the last version of kind and id, or None.
+        """
+
+        entry=self.pick(self.versions(kind, id))
+
+        if entry is None:
+            return None
+
+        return entry.to_dict()
+
+
+
+    def setVersion(self, kind, id, time, digest, parent=None, rows=None, storage='table', schema=None):
+        """
+        Register a new version of kind and id in table datacache_versions.
+
+        storage is 'table' for versions written in full in datacache__{kind},
+        'snapshot' for full versions in datacache_delta__{kind} and 'delta'
+        for versions that only have their differences to parent.
+
+        schema is the JSON text returned by schema().
+        """
+
+        entry=pandas.DataFrame(
+            {
+                self.kindCol:    [kind.lower()],
+                self.idCol:      [id],
+                self.timeCol:    [time],
+                self.hashCol:    [digest],
+                self.parentCol:  [None if parent is None else str(parent)],
+                self.rowsCol:    [rows],
+                self.storageCol: [storage],
+                self.schemaCol:  [schema],
+            }
+        )
+
+        try:
+            with self.getDB().connect() as db:
+                entry.to_sql(
+                    self.versionsTable,
+                    index       = False,
+                    if_exists   = 'append',
+                    con         = db
+                )
+        except sqlalchemy.exc.DBAPIError:
+            # Registry created by an older version of DataCache
+            self.upgradeRegistry(entry.columns)
+
+            with self.getDB().connect() as db:
+                entry.to_sql(
+                    self.versionsTable,
+                    index       = False,
+                    if_exists   = 'append',
+                    con         = db
+                )
+
+
+
+    def upgradeRegistry(self, columns):
+        """
+        Add to table datacache_versions the columns it lacks.
+        """
+
+        existing=[
+            c['name']
+            for c in sqlalchemy.inspect(self.getDB()).get_columns(self.versionsTable)
+        ]
+
+        with self.getDB().connect() as db:
+            for c in columns:
+                if c not in existing:
+                    self.getLogger().info(f"Adding column {c} to {self.versionsTable}")
+                    db.execute(
+                        sqlalchemy.text(
+                            f"ALTER TABLE {self.versionsTable} ADD COLUMN {c} "
+                            + ('INTEGER' if c==self.rowsCol else 'TEXT')
+                        )
+                    )
+
+            db.commit()
+
+
+
+    def schema(self, data):
+        """
+        Return a JSON text that describes dtype, timezone and categorical
+        nature of each column of data.
+        """
+
+        schema=dict()
+        for column,dtype in data.dtypes.items():
+            schema[column]=dict(dtype=str(dtype))
+            if isinstance(dtype, pandas.DatetimeTZDtype):
+                schema[column]['tz']=str(dtype.tz)
+
+        return json.dumps(schema)
+
+
+
+    def prepare(self, data):
+        """
+        Return a copy of data ready to be written: timezone-aware columns are
+        converted to UTC because most databases store just the wall time.
+        """
+
+        d=data.copy()
+
+        for column,dtype in d.dtypes.items():
+            if isinstance(dtype, pandas.DatetimeTZDtype):
+                d[column]=d[column].dt.tz_convert('UTC')
+
+        return d
+
+
+
+    def restore(self, data, schema):
+        """
+        Convert columns of data, as read from database, back to the dtypes
+        described by schema, as returned by schema().
+        """
+
+        if schema is None or pandas.isna(schema):
+            return data
+
+        for column,spec in json.loads(schema).items():
+            if column not in data.columns or str(data[column].dtype)==spec['dtype']:
+                continue
+
+            try:
+                if 'tz' in spec:
+                    data[column]=(
+                        pandas.to_datetime(data[column], format='ISO8601', utc=True)
+                        .dt.tz_convert(spec['tz'])
+                    )
+                elif spec['dtype'].startswith('datetime64'):
+                    data[column]=pandas.to_datetime(data[column], format='ISO8601')
+                else:
+                    data[column]=data[column].astype(spec['dtype'])
+            except (ValueError, TypeError) as e:
+                self.getLogger().debug(f"Can’t restore column {column} as {spec['dtype']}: {e}")
+
+        return data
+
+
+
+    def touch(self, kind, id, previous, time):
+        """
+        Move version previous (a registry entry) of kind and id to time, both
+        in the table that holds its data and in datacache_versions.
+        """
+
+        toucher='''
+            UPDATE {table}
+            SET {timeCol} = :time
+            WHERE
+                {idCol}   = :id AND
+                {timeCol} = :previous
+        '''
+
+        if previous[self.storageCol] in ('snapshot','delta'):
+            table=self.deltaTable.format(kind=kind).lower()
+        else:
+            table=self.typeTable.format(kind=kind).lower()
+
+        with self.getDB().connect() as db:
+            for table,condition in [
+                        (table,              ''),
+                        (self.versionsTable, f" AND {self.kindCol} = :kind"),
+                    ]:
+                db.execute(
+                    sqlalchemy.text(
+                        toucher.format(
+                            table   = table,
+                            idCol   = self.idCol,
+                            timeCol = self.timeCol,
+                        ) + condition
+                    )
+                    .bindparams(sqlalchemy.bindparam('time', type_=sqlalchemy.DateTime)),
+                    dict(
+                        time     = time.to_pydatetime(),
+                        previous = previous[self.timeCol],
+                        id       = id,
+                        kind     = kind.lower()
+                    )
+                )
+
+            db.commit()
+
+
+
+    ############################################################################
+    ##
+    ## Delta storage mode
+    ##
+    ############################################################################
+
+    def chain(self, registry, version):
+        """
+        Return the list of registry entries, from a full snapshot up to
+        version, needed to reconstruct version.
+        """
+
+        entries={
+            str(e[self.timeCol]): e
+            for e in registry.to_dict('records')
+        }
+
+        chain=[]
+        current=str(version)
+        while current is not None:
+            if current not in entries:
+                raise KeyError(f"Version {current} is missing from delta chain of {version}")
+
+            entry=entries[current]
+            chain.insert(0,entry)
+
+            current=(
+                entry[self.parentCol]
+                if entry[self.storageCol]=='delta'
+                else None
+            )
+
+        return chain
+
+
+
+    def reconstruct(self, kind, id, registry, version):
+        """
+        Read from datacache_delta__{kind} the full snapshot and all deltas
+        that lead to version and apply them in sequence.
+        """
+
+        chain=self.chain(registry, version)
+
+        query='''
+            SELECT *
+            FROM {deltaTable}
+            WHERE
+                {idCol}   = :id AND
+                {timeCol} IN :times
+        '''
+
+        query=query.format(
+            deltaTable   = self.deltaTable.format(kind=kind).lower(),
+            idCol        = self.idCol,
+            timeCol      = self.timeCol,
+        )
+
+        self.getLogger().debug(f'Reconstructing kind={kind} and id={id} from {len(chain)} versions')
+
+        with self.getDB().connect() as db:
+            df=pandas.read_sql(
+                sqlalchemy.text(query)
+                .bindparams(sqlalchemy.bindparam('times', expanding=True)),
+                con=db,
+                params=dict(
+                    id    = id,
+                    times = [e[self.timeCol] for e in chain]
+                )
+            )
+
+        parts={
+            str(time): part
+            for time,part in df.groupby(self.timeCol, sort=False)
+        }
+
+        data=None
+        for entry in chain:
+            part=parts.get(str(entry[self.timeCol]), df.iloc[0:0])
+
+            if data is None:
+                data=part
+            else:
+                data=data[data[self.rowCol] < int(entry[self.rowsCol])]
+                data=data[~data[self.rowCol].isin(part[self.rowCol])]
+                data=pandas.concat([data,part])
+
+        return (
+            data
+            .sort_values(self.rowCol)
+            .drop(columns=[self.idCol,self.timeCol,self.rowCol])
+            .reset_index(drop=True)
+        )
+
+
+
+    def changedRows(self, parent, data):
+        """
+        Return the positions of rows of data that are new or different from
+        the rows in same position in parent.
+        """
+
+        hp=pandas.util.hash_pandas_object(parent, index=False).to_numpy()
+        hd=pandas.util.hash_pandas_object(data, index=False).to_numpy()
+
+        common=min(len(hp),len(hd))
+
+        return numpy.concatenate(
+            [
+                numpy.flatnonzero(hp[:common]!=hd[:common]),
+                numpy.arange(common,len(hd))
+            ]
+        )
+
+
+
+    def setDelta(self, kind, id, data, time, digest, previous):
+        """
+        Write data as a new version in datacache_delta__{kind}: only rows
+        changed in relation to previous version, or a full snapshot if
+        previous is not in delta mode, its chain is already maxChain long or
+        if too many rows changed.
+        """
+
+        d=data.reset_index(drop=True)
+        columns=list(d.columns)
+
+        parent=None
+        if previous is not None and previous[self.storageCol] in ('snapshot','delta'):
+            try:
+                registry=self.versions(kind, id)
+                if len(self.chain(registry, previous[self.timeCol])) < self.maxChain:
+                    parentData=self.hotGet(kind, id, previous[self.timeCol])
+                    if parentData is None:
+                        parentData=self.restore(
+                            self.reconstruct(kind, id, registry, previous[self.timeCol]),
+                            previous[self.schemaCol]
+                        )
+
+                    if list(parentData.columns)==columns:
+                        changed=self.changedRows(parentData, d)
+
+                        # A delta bigger than half the data is not worth it
+                        if len(changed) <= d.shape[0]/2:
+                            parent=previous[self.timeCol]
+            except Exception as e:
+                self.getLogger().warning(f"Can’t compute delta for kind={kind}, id={id}; writing a full snapshot")
+                self.getLogger().info(e)
+
+        if parent is None:
+            changed=numpy.arange(d.shape[0])
+
+        self.writeDelta(kind, id, data, time, digest, changed, parent)
+
+
+
+    def writeDelta(self, kind, id, data, time, digest, changed, parent):
+        """
+        Write the rows of data in positions changed to
+        datacache_delta__{kind}, as a new version that is a delta of parent,
+        or a full snapshot if parent is None.
+        """
+
+        d=data.reset_index(drop=True)
+        columns=list(d.columns)
+
+        d=self.prepare(d.iloc[changed])
+        d[self.idCol]=id
+        d[self.timeCol]=time
+        d[self.rowCol]=changed
+
+        self.getLogger().info(
+            'Set cache to kind={kind}, id={id}, time={time} as {storage} with {n} rows'.format(
+                kind     = kind,
+                id       = id,
+                time     = time,
+                storage  = 'full snapshot' if parent is None else 'delta',
+                n        = d.shape[0]
+            )
+        )
+
+        with self.getDB().connect() as db:
+            d[[self.idCol,self.timeCol,self.rowCol] + columns].to_sql(
+                self.deltaTable.format(kind=kind).lower(),
+                index       = False,
+                if_exists   = 'append',
+                chunksize   = 999,
+                con         = db,
+                method      = 'multi'
+            )
+
+        self.setVersion(
+            kind,
+            id,
+            time,
+            digest,
+            parent   = parent,
+            rows     = data.shape[0],
+            storage  = 'snapshot' if parent is None else 'delta',
+            schema   = self.schema(data)
+        )
+
+
+
+    def cleanOldDeltas(self, kind, id):
+        """
+        Delete all versions of kind and id except the recycle most recent
+        and the versions they need to be reconstructed.
+        """
+
+        if self.recycle is None:
+            return 0
+
+        registry=self.versions(kind, id)
+
+        if registry.shape[0]<=self.recycle:
+            return 0
+
+        keep=set()
+        try:
+            for version in registry[self.timeCol].iloc[-self.recycle:]:
+                keep.update(
+                    str(e[self.timeCol])
+                    for e in self.chain(registry, version)
+                )
+        except KeyError as e:
+            self.getLogger().warning(f"Not cleaning kind={kind}, id={id}: {e}")
+            return 0
+
+        deprecated=registry[~registry[self.timeCol].astype(str).isin(keep)]
+
+        if deprecated.shape[0]==0:
+            return 0
+
+        cleaner='''
+            DELETE
+            FROM {table}
+            WHERE
+                {idCol}   = :id AND
+                {timeCol} IN :times
+        '''
+
+        self.getLogger().debug(f'Clean {deprecated.shape[0]} old cache versions of kind={kind}, id={id}')
+
+        deleted=0
+
+        with self.getDB().connect() as db:
+            inDeltaTable=deprecated[self.storageCol].isin(['snapshot','delta'])
+
+            for table,versions,condition in [
+                        (
+                            self.deltaTable.format(kind=kind).lower(),
+                            deprecated[inDeltaTable],
+                            ''
+                        ),
+                        (
+                            self.typeTable.format(kind=kind).lower(),
+                            deprecated[~inDeltaTable],
+                            ''
+                        ),
+                        (
+                            self.versionsTable,
+                            deprecated,
+                            f" AND {self.kindCol} = :kind"
+                        ),
+                    ]:
+                if versions.shape[0]==0:
+                    continue
+
+                deleted+=db.execute(
+                    sqlalchemy.text(
+                        cleaner.format(
+                            table   = table,
+                            idCol   = self.idCol,
+                            timeCol = self.timeCol,
+                        ) + condition
+                    )
+                    .bindparams(sqlalchemy.bindparam('times', expanding=True)),
+                    dict(
+                        id     = id,
+                        kind   = kind.lower(),
+                        times  = list(versions[self.timeCol])
+                    )
+                ).rowcount
+
+            db.commit()
+
+        return deleted
+
+
+
+    def compact(self, kind, id):
+        """
+        Fold the delta chain of the last version of kind and id into a full
+        snapshot, so it and its successors don’t depend on older versions
+        anymore. Versions freed from chains are deleted as per recycle.
+        """
+
+        registry=self.versions(kind, id)
+        entry=self.pick(registry)
+
+        if entry is None or entry[self.storageCol]!='delta':
+            return
+
+        version=entry[self.timeCol]
+        data=self.reconstruct(kind, id, registry, version)
+
+        columns=list(data.columns)
+
+        data[self.idCol]=id
+        data[self.timeCol]=version
+        data[self.rowCol]=numpy.arange(data.shape[0])
+
+        self.getLogger().info(f'Compacting cache of kind={kind}, id={id}, time={version} into a full snapshot')
+
+        with self.getDB().connect() as db:
+            db.execute(
+                sqlalchemy.text(
+                    '''
+                        DELETE
+                        FROM {deltaTable}
+                        WHERE
+                            {idCol}   = :id AND
+                            {timeCol} = :time
+                    '''.format(
+                        deltaTable = self.deltaTable.format(kind=kind).lower(),
+                        idCol      = self.idCol,
+                        timeCol    = self.timeCol,
+                    )
+                ),
+                dict(id=id, time=version)
+            )
+
+            data[[self.idCol,self.timeCol,self.rowCol] + columns].to_sql(
+                self.deltaTable.format(kind=kind).lower(),
+                index       = False,
+                if_exists   = 'append',
+                chunksize   = 999,
+                con         = db,
+                method      = 'multi'
+            )
+
+            db.execute(
+                sqlalchemy.text(
+                    '''
+                        UPDATE {versionsTable}
+                        SET
+                            {storageCol} = 'snapshot',
+                            {parentCol}  = NULL
+                        WHERE
+                            {kindCol} = :kind AND
+                            {idCol}   = :id AND
+                            {timeCol} = :time
+                    '''.format(
+                        versionsTable = self.versionsTable,
+                        storageCol    = self.storageCol,
+                        parentCol     = self.parentCol,
+                        kindCol       = self.kindCol,
+                        idCol         = self.idCol,
+                        timeCol       = self.timeCol,
+                    )
+                ),
+                dict(kind=kind.lower(), id=id, time=version)
+            )
+
+            db.commit()
+
+        self.scheduleClean(kind, id)
+
+
+
+    ############################################################################
+    ##
+    ## Processed data snapshots
+    ##
+    ############################################################################
+
+    def current(self, kind, id):
+        """
+        Return the raw __datacache_time of the version of kind and id that
+        get() would read now, or None if there is no such version.
+        """
+
+        entry=self.pick(self.versions(kind, id))
+
+        if entry is not None:
+            return entry[self.timeCol]
+
+        return self.version(kind, id)
+
+
+
+    @staticmethod
+    def versionKey(version):
+        """
+        Return a canonical text for a version time, be it the raw value read
+        from the database, the age returned by get() or the time returned by
+        set(). Naive times are UTC.
+        """
+
+        version=pandas.Timestamp(version)
+        if version.tzinfo is None:
+            version=version.tz_localize('UTC')
+
+        return version.tz_convert('UTC').isoformat()
+
+
+
+    @staticmethod
+    def fingerprint(functions, config=None):
+        """
+        Return a hash of the code of functions, of the investorzilla version
+        and of config, which must have a stable repr(). Used to tell if a
+        processed snapshot was made by the code and configuration currently
+        in use.
+        """
+
+        def feed(h, code):
+            h.update(code.co_code)
+            for const in code.co_consts:
+                if hasattr(const, 'co_code'):
+                    # Lambdas and nested functions
+                    feed(h, const)
+                else:
+                    h.update(repr(const).encode())
+
+        h=hashlib.sha256()
+        h.update(importlib.metadata.version('investorzilla').encode())
+
+        for function in functions:
+            h.update(function.__qualname__.encode())
+            feed(h, function.__code__)
+
+        h.update(repr(config).encode())
+
+        return h.hexdigest()
+
+
+
+    def getProcessed(self, kind, id, version, fingerprint):
+        """
+        Return the DataFrame saved with setProcessed() for this version of kind
+        and id by code with this fingerprint, or None.
+        """
+
+        if version is None:
+            return None
+
+        hotKind=f'{kind}__processed'
+        hotVersion='{}•{}'.format(DataCache.versionKey(version),fingerprint)
+
+        df=self.hotGet(hotKind, id, hotVersion)
+        if df is not None:
+            return df
+
+        q='''
+            SELECT {dataCol}
+            FROM {processedTable}
+            WHERE
+                {kindCol}        = :kind AND
+                {idCol}          = :id AND
+                {timeCol}        = :version AND
+                {fingerprintCol} = :fingerprint
+        '''
+
+        query=q.format(
+            processedTable = self.processedTable,
+            dataCol        = self.dataCol,
+            kindCol        = self.kindCol,
+            idCol          = self.idCol,
+            timeCol        = self.timeCol,
+            fingerprintCol = self.fingerprintCol,
+        )
+
+        try:
+            with self.getDB().connect() as db:
+                row=db.execute(
+                    sqlalchemy.text(query),
+                    dict(
+                        kind        = kind.lower(),
+                        id          = id,
+                        version     = DataCache.versionKey(version),
+                        fingerprint = fingerprint
+                    )
+                ).first()
+
+            if row is None:
+                self.getLogger().debug(f"No processed cache for kind={kind} and id={id}")
+                return None
+
+            df=pickle.loads(bytes(row[0]))
+        except Exception as e:
+            # Table doesn’t exist yet or snapshot is unreadable
+            self.getLogger().debug(f"No processed cache for kind={kind} and id={id}")
+            self.getLogger().debug(e)
+            return None
+
+        self.getLogger().info(f"Processed cache for kind={kind} and id={id} has {len(df)} entries")
+
+        self.hotPut(hotKind, id, hotVersion, df)
+
+        return df.copy()
+
+
+
+    def setProcessed(self, kind, id, version, fingerprint, data):
+        """
+        Save data, the result of processing version of kind and id by code
+        with fingerprint, replacing any previous snapshot of kind and id.
+        Usually a DataFrame, data can be any picklable object with a copy()
+        method, as a dict of DataFrames.
+        """
+
+        if version is None or data is None:
+            return
+
+        entry=pandas.DataFrame(
+            {
+                self.kindCol:        [kind.lower()],
+                self.idCol:          [id],
+                self.timeCol:        [DataCache.versionKey(version)],
+                self.fingerprintCol: [fingerprint],
+                self.dataCol:        [pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)],
+            }
+        )
+
+        self.getLogger().info(f'Set processed cache to kind={kind}, id={id}, version={entry[self.timeCol][0]}')
+
+        try:
+            with self.getDB().connect() as db:
+                if sqlalchemy.inspect(db).has_table(self.processedTable):
+                    db.execute(
+                        sqlalchemy.text(
+                            '''
+                                DELETE
+                                FROM {processedTable}
+                                WHERE
+                                    {kindCol} = :kind AND
+                                    {idCol}   = :id
+                            '''.format(
+                                processedTable = self.processedTable,
+                                kindCol        = self.kindCol,
+                                idCol          = self.idCol,
+                            )
+                        ),
+                        dict(kind=kind.lower(), id=id)
+                    )
+
+                entry.to_sql(
+                    self.processedTable,
+                    index       = False,
+                    if_exists   = 'append',
+                    con         = db,
+                    dtype       = {self.dataCol: sqlalchemy.LargeBinary}
+                )
+
+                db.commit()
+        except Exception as e:
+            # A processed snapshot is just an optimization
+            self.getLogger().warning(f"Failed to set processed cache for kind={kind} and id={id}")
+            self.getLogger().info(e)
+            return
+
+        self.hotPut(
+            f'{kind}__processed',
+            id,
+            '{}•{}'.format(DataCache.versionKey(version),fingerprint),
+            data.copy()
+        )
+
+
+
+    def cleanProcessed(self, kind, version):
+        """
+        Delete processed snapshots of kind, of any id, that were made from
+        versions older than version. For consumers that keep snapshots of
+        many ids derived from the same data, which setProcessed() alone never
+        replaces.
+        """
+
+        query='''
+            DELETE
+            FROM {processedTable}
+            WHERE
+                {kindCol} = :kind AND
+                {timeCol} < :version
+        '''.format(
+            processedTable = self.processedTable,
+            kindCol        = self.kindCol,
+            timeCol        = self.timeCol,
+        )
+
+        try:
+            with self.getDB().connect() as db:
+                if sqlalchemy.inspect(db).has_table(self.processedTable):
+                    deleted=db.execute(
+                        sqlalchemy.text(query),
+                        dict(
+                            kind    = kind.lower(),
+                            version = DataCache.versionKey(version)
+                        )
+                    ).rowcount
+
+                    db.commit()
+
+                    self.getLogger().info(f'Deleted {deleted} processed snapshots of kind={kind} older than {DataCache.versionKey(version)}')
+        except Exception as e:
+            # A processed snapshot is just an optimization
+            self.getLogger().warning(f"Failed to clean processed cache for kind={kind}")
+            self.getLogger().info(e)
+
+
+
+    ############################################################################
+    ##
+    ## Attributes
+    ##
+    ############################################################################
+
+    def getAttributes(self, kind, id):
+        """
+        Return a dict with arbitrary attributes that consumers saved for kind
+        and id with setAttributes(), as HTTP validators or watermarks. It is
+        empty if there are none.
+        """
+
+        q='''
+            SELECT {attributesCol}
+            FROM {attributesTable}
+            WHERE
+                {kindCol} = :kind AND
+                {idCol}   = :id
+        '''
+
+        query=q.format(
+            attributesTable = self.attributesTable,
+            attributesCol   = self.attributesCol,
+            kindCol         = self.kindCol,
+            idCol           = self.idCol,
+        )
+
+        try:
+            with self.getDB().connect() as db:
+                row=db.execute(
+                    sqlalchemy.text(query),
+                    dict(kind=kind.lower(), id=id)
+                ).first()
+        except Exception as e:
+            # Table doesn’t exist yet
+            self.getLogger().debug(e)
+            return dict()
+
+        if row is None or row[0] is None:
+            return dict()
+
+        return json.loads(row[0])
+
+
+
+    def setAttributes(self, kind, id, **attributes):
+        """
+        Update attributes of kind and id with the ones passed as keyword
+        arguments. Values must be serializable as JSON.
+        """
+
+        current=self.getAttributes(kind, id)
+        current.update(attributes)
+
+        entry=pandas.DataFrame(
+            {
+                self.kindCol:       [kind.lower()],
+                self.idCol:         [id],
+                self.timeCol:       [pandas.Timestamp.utcnow()],
+                self.attributesCol: [json.dumps(current)],
+            }
+        )
+
+        with self.getDB().connect() as db:
+            if sqlalchemy.inspect(db).has_table(self.attributesTable):
+                db.execute(
+                    sqlalchemy.text(
+                        '''
+                            DELETE
+                            FROM {attributesTable}
+                            WHERE
+                                {kindCol} = :kind AND
+                                {idCol}   = :id
+                        '''.format(
+                            attributesTable = self.attributesTable,
+                            kindCol         = self.kindCol,
+                            idCol           = self.idCol,
+                        )
+                    ),
+                    dict(kind=kind.lower(), id=id)
+                )
+
+            entry.to_sql(
+                self.attributesTable,
+                index       = False,
+                if_exists   = 'append',
+                con         = db
+            )
+
+            db.commit()
@@ -0,0 +1,227 @@
+import io
+import asyncio
+import logging
+import threading
+import functools
+import urllib.parse
+import concurrent.futures
+import pandas
+
+from .httpclient import HTTPClient
+
+
+
+class FetchEngine(object):
+    """
+    Process-wide asyncio engine that all data sources submit their HTTP
+    requests to.
+
+    A single event loop runs in a background thread. Sources write their
+    paged or multi-request fetching as coroutines that await
+    FetchEngine.get(), FetchEngine.readJSON() etc, and run them with
+    FetchEngine.run() or FetchEngine.gather() from their regular (threaded)
+    code:
+
+        async def page(url):
+            return await FetchEngine.readJSON(url)
+
+        pages=FetchEngine.gather(*[page(u) for u in urls])
+
+    No matter how many sources are refreshing at the same time, at most
+    self.concurrency requests are in flight, and at most self.perHost to the
+    same host, so thread count is bound and providers are not flooded.
+
+    Requests go through the shared HTTPClient (keep-alive pool, gzip,
+    timeouts), executed in a bounded thread pool because it is blocking.
+    """
+
+    # Maximum requests in flight, all hosts together
+    concurrency      = 16
+
+    # Maximum requests in flight to the same host
+    perHost          = 4
+
+    loop             = None
+    thread           = None
+    executor         = None
+    engineLock       = threading.Lock()
+
+    # Semaphores are made by the loop thread, on first use
+    globalSemaphore  = None
+    hostSemaphores   = dict()
+
+
+
+    def getLogger():
+        return logging.getLogger(__name__ + '.FetchEngine')
+
+
+
+    def configure(concurrency=None, per_host=None):
+        """
+        Change global and per-host limits of requests in flight. If they
+        change, the engine is restarted, so call it before loading.
+        """
+        with FetchEngine.engineLock:
+            changed=False
+
+            if concurrency is not None and concurrency!=FetchEngine.concurrency:
+                FetchEngine.concurrency=concurrency
+                changed=True
+
+            if per_host is not None and per_host!=FetchEngine.perHost:
+                FetchEngine.perHost=per_host
+                changed=True
+
+            if changed:
+                FetchEngine.stopLocked()
+
+
+
+    def getLoop():
+        """
+        Return the engine’s event loop, starting it and its thread on first
+        use.
+        """
+        with FetchEngine.engineLock:
+            if FetchEngine.loop is None:
+                FetchEngine.loop=asyncio.new_event_loop()
+
+                FetchEngine.executor=concurrent.futures.ThreadPoolExecutor(
+                    max_workers        = FetchEngine.concurrency,
+                    thread_name_prefix = 'fetch'
+                )
+
+                FetchEngine.globalSemaphore=None
+                FetchEngine.hostSemaphores=dict()
+
+                FetchEngine.thread=threading.Thread(
+                    target = FetchEngine.loop.run_forever,
+                    name   = 'fetch_engine',
+                    daemon = True
+                )
+                FetchEngine.thread.start()
+
+            return FetchEngine.loop
+
+
+
+    def stop():
+        """
+        Stop the engine loop and its thread pool. It is started again on
+        next use.
+        """
+        with FetchEngine.engineLock:
+            FetchEngine.stopLocked()
+
+
+
+    def stopLocked():
+        if FetchEngine.loop is not None:
+            FetchEngine.loop.call_soon_threadsafe(FetchEngine.loop.stop)
+            FetchEngine.thread.join()
+            FetchEngine.loop.close()
+            FetchEngine.executor.shutdown(wait=False)
+
+            FetchEngine.loop=None
+            FetchEngine.thread=None
+            FetchEngine.executor=None
+
+
+
+    def run(coroutine, timeout=None):
+        """
+        Run coroutine in the engine loop, wait for it and return its result.
+        To be called from regular code, not from coroutines running in the
+        engine, which should simply await.
+        """
+        loop=FetchEngine.getLoop()
+
+        if threading.current_thread() is FetchEngine.thread:
+            raise Exception('FetchEngine.run() can’t be called from the engine loop; use await')
+
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result(timeout)
+
+
+
+    def gather(*coroutines, timeout=None):
+        """
+        Run all coroutines concurrently in the engine loop and return a list of
+        their results, in order. A coroutine that raised has its exception in
+        place of its result.
+        """
+        async def together():
+            return await asyncio.gather(*coroutines, return_exceptions=True)
+
+        return FetchEngine.run(together(), timeout)
+
+
+
+    def limits(url):
+        """
+        Global and per-host semaphores for url. Runs only in the loop thread,
+        so no locking is needed.
+        """
+        if FetchEngine.globalSemaphore is None:
+            FetchEngine.globalSemaphore=asyncio.Semaphore(FetchEngine.concurrency)
+
+        host=urllib.parse.urlsplit(url).netloc
+
+        if host not in FetchEngine.hostSemaphores:
+            FetchEngine.hostSemaphores[host]=asyncio.Semaphore(FetchEngine.perHost)
+
+        return (FetchEngine.globalSemaphore, FetchEngine.hostSemaphores[host])
+
+
+
+    async def get(url, params=None, **kwargs):
+        """
+        GET url within global and per-host limits and return the
+        requests.Response. kwargs go to HTTPClient.get().
+        """
+        (everyone,host)=FetchEngine.limits(url)
+
+        async with host:
+            async with everyone:
+                return await asyncio.get_running_loop().run_in_executor(
+                    FetchEngine.executor,
+                    functools.partial(HTTPClient.get, url, params=params, **kwargs)
+                )
+
+
+
+    async def parse(function):
+        """
+        Run function, usually a parser of a response, in the engine’s thread
+        pool, so the loop is free to keep other requests going meanwhile.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            FetchEngine.executor,
+            function
+        )
+
+
+
+    async def readJSON(url, params=None, **kwargs):
+        """
+        Like pandas.read_json(url), within engine limits. kwargs go to
+        pandas.read_json().
+        """
+        response=await FetchEngine.get(url, params=params)
+
+        return await FetchEngine.parse(
+            lambda: pandas.read_json(io.StringIO(response.text), **kwargs)
+        )
+
+
+
+    async def readCSV(url, params=None, **kwargs):
+        """
+        Like pandas.read_csv(url), within engine limits. kwargs go to
+        pandas.read_csv().
+        """
+        response=await FetchEngine.get(url, params=params)
+
+        return await FetchEngine.parse(
+            lambda: pandas.read_csv(io.BytesIO(response.content), **kwargs)
+        )
@@ -0,0 +1,336 @@
+import io
+import os
+import time
+import pickle
+import hashlib
+import logging
+import pathlib
+import tempfile
+import threading
+import requests
+import pandas
+
+
+
+class HTTPClient(object):
+    """
+    Process-wide HTTP client shared by all data sources.
+
+    All requests go through a single requests.Session, so connections to the
+    same host (api.bcb.gov.br, min-api.cryptocompare.com etc) are kept alive
+    and reused across requests and threads instead of repeating TLS
+    handshakes. Responses are gzip-compressed when servers support it.
+
+    Use it without instantiating:
+
+        data=HTTPClient.get(url, params=dict(formato='json')).json()
+        table=HTTPClient.readJSON(url)
+
+    Timeouts and pool size can be changed with HTTPClient.configure(), which
+    Investor calls with the 'http' section of the YAML config file.
+
+    Successful responses can be kept on disk for a while, so refreshing
+    sources many times a day doesn’t download the same data again. See
+    HTTPCache and HTTPClient.configureCache().
+    """
+
+    # Seconds to connect and to wait for data between bytes received
+    timeout       = (10, 120)
+
+    # Maximum connections kept alive per host
+    poolSize      = 16
+
+    headers       = {
+        'Accept-Encoding': 'gzip, deflate',
+        'User-Agent':      'investorzilla',
+    }
+
+    session       = None
+    sessionLock   = threading.Lock()
+
+    # An HTTPCache, if configured
+    cache         = None
+
+
+
+    def getLogger():
+        return logging.getLogger(__name__ + '.HTTPClient')
+
+
+
+    def configure(timeout=None, connect_timeout=None, pool_size=None):
+        """
+        Change read timeout, connect timeout (both in seconds) and maximum
+        connections per host. If pool size changes, a new session is made on
+        next request, so call it before loading.
+        """
+        with HTTPClient.sessionLock:
+            HTTPClient.timeout=(
+                connect_timeout if connect_timeout is not None else HTTPClient.timeout[0],
+                timeout if timeout is not None else HTTPClient.timeout[1],
+            )
+
+            if pool_size is not None and pool_size!=HTTPClient.poolSize:
+                HTTPClient.poolSize=pool_size
+
+                if HTTPClient.session is not None:
+                    HTTPClient.session.close()
+                    HTTPClient.session=None
+
+
+
+    def configureCache(path=None, max_size=256, ttl=dict()):
+        """
+        Keep responses in an HTTPCache at path, with at most max_size
+        megabytes, for ttl seconds per provider. Without path, responses
+        aren’t cached.
+        """
+        if path is None:
+            HTTPClient.cache=None
+        else:
+            HTTPClient.cache=HTTPCache(path=path, max_size=max_size, ttl=ttl)
+
+
+
+    def getSession():
+        """
+        Return the shared requests.Session, making it on first use.
+        """
+        with HTTPClient.sessionLock:
+            if HTTPClient.session is None:
+                session=requests.Session()
+
+                adapter=requests.adapters.HTTPAdapter(
+                    pool_connections = HTTPClient.poolSize,
+                    pool_maxsize     = HTTPClient.poolSize,
+                    pool_block       = False,
+                )
+
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update(HTTPClient.headers)
+
+                HTTPClient.session=session
+
+            return HTTPClient.session
+
+
+
+    def get(url, params=None, timeout=None, **kwargs):
+        """
+        GET url through the shared session and return the requests.Response.
+        Raises requests.HTTPError on 4xx and 5xx responses.
+        """
+        cache=HTTPClient.cache
+        if cache is not None:
+            # Full URL with params identifies the response
+            url=requests.Request('GET', url, params=params).prepare().url
+            params=None
+
+            response=cache.get(url)
+            if response is not None:
+                HTTPClient.getLogger().debug(f'GET {url} from cache')
+                return response
+
+        HTTPClient.getLogger().debug(f'GET {url} {params or ""}')
+
+        response=HTTPClient.getSession().get(
+            url,
+            params  = params,
+            timeout = timeout or HTTPClient.timeout,
+            **kwargs
+        )
+
+        response.raise_for_status()
+
+        if cache is not None:
+            cache.put(url, response)
+
+        return response
+
+
+
+    def readJSON(url, params=None, **kwargs):
+        """
+        Like pandas.read_json(url), but through the shared session. kwargs
+        go to pandas.read_json().
+        """
+        return pandas.read_json(
+            io.StringIO(HTTPClient.get(url, params=params).text),
+            **kwargs
+        )
+
+
+
+    def readCSV(url, params=None, **kwargs):
+        """
+        Like pandas.read_csv(url), but through the shared session. kwargs go
+        to pandas.read_csv().
+        """
+        return pandas.read_csv(
+            io.BytesIO(HTTPClient.get(url, params=params).content),
+            **kwargs
+        )
+
+
+
+
+class HTTPCache(object):
+    """
+    On-disk cache of raw HTTP responses, beneath all data sources.
+
+    Responses are kept as files in path, named after a hash of their full
+    URL, and served again while they are younger than the TTL of their
+    provider. ttl is either a number of seconds for all URLs or a dict that
+    maps hosts or URL prefixes to seconds, with an optional 'default':
+
+        {
+            'default':                                        0,
+            'api.bcb.gov.br':                                 6*3600,
+            'https://api.bcb.gov.br/dados/serie/bcdata.sgs.11/': 6*3600,
+            'min-api.cryptocompare.com':                      3600,
+        }
+
+    The longest key found in the URL wins. A TTL of 0 means not cached.
+
+    When files add up to more than max_size megabytes, the least recently used
+    ones are deleted.
+    """
+
+    def __init__(self, path, max_size=256, ttl=dict()):
+        self.logger   = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.path     = pathlib.Path(path).expanduser()
+        self.maxSize  = max_size*1024*1024
+        self.ttls     = ttl
+        self.lock     = threading.Lock()
+
+        self.path.mkdir(parents=True, exist_ok=True)
+
+
+
+    def __repr__(self):
+        return '{klass}(path={path},max_size={size}MB)'.format(
+            klass = type(self).__name__,
+            path  = self.path,
+            size  = self.maxSize//(1024*1024),
+        )
+
+
+
+    def ttl(self, url):
+        """
+        Seconds that responses of url are kept.
+        """
+        if not isinstance(self.ttls, dict):
+            return self.ttls or 0
+
+        matches=[k for k in self.ttls if k!='default' and k in url]
+
+        if matches:
+            return self.ttls[max(matches, key=len)]
+
+        return self.ttls.get('default',0)
+
+
+
+    def file(self, url):
+        return self.path / (hashlib.sha256(url.encode()).hexdigest() + '.pickle')
+
+
+
+    def get(self, url):
+        """
+        Return a requests.Response for url rebuilt from cache, or None if
+        not cached or expired.
+        """
+        ttl=self.ttl(url)
+        if not ttl:
+            return None
+
+        file=self.file(url)
+
+        try:
+            with open(file, 'rb') as f:
+                entry=pickle.load(f)
+        except Exception:
+            # Not cached or unreadable
+            return None
+
+        if time.time()-entry['time'] > ttl:
+            return None
+
+        try:
+            # Mark as recently used, for eviction
+            os.utime(file)
+        except OSError:
+            pass
+
+        response=requests.Response()
+        response.status_code = entry['status']
+        response.headers     = requests.structures.CaseInsensitiveDict(entry['headers'])
+        response.encoding    = entry['encoding']
+        response.url         = url
+        response._content    = entry['content']
+        response.fromCache   = True
+
+        return response
+
+
+
+    def put(self, url, response):
+        """
+        Save a successful response of url, if its provider has a TTL, and
+        evict old ones if cache became too big.
+        """
+        if not self.ttl(url) or response.status_code!=200:
+            return
+
+        entry=dict(
+            time     = time.time(),
+            status   = response.status_code,
+            headers  = dict(response.headers),
+            encoding = response.encoding,
+            content  = response.content,
+        )
+
+        try:
+            # Write whole file and then rename, so readers never see partial
+            # content
+            with tempfile.NamedTemporaryFile(dir=self.path, suffix='.tmp', delete=False) as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+            os.replace(f.name, self.file(url))
+        except OSError as e:
+            self.logger.warning(f'Failed to cache response of {url}: {e}')
+            return
+
+        self.evict()
+
+
+
+    def evict(self):
+        """
+        Delete least recently used responses until cache fits in maxSize.
+        """
+        with self.lock:
+            entries=[]
+            for entry in os.scandir(self.path):
+                if entry.name.endswith('.pickle'):
+                    try:
+                        stat=entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    except OSError:
+                        pass
+
+            total=sum(e[1] for e in entries)
+
+            for (mtime,size,path) in sorted(entries):
+                if total<=self.maxSize:
+                    break
+
+                try:
+                    os.remove(path)
+                    total-=size
+                except OSError:
+                    pass
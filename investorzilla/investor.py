@@ -1,9 +1,15 @@
+import copy
+import time
 import logging
-import concurrent.futures
+import functools
+import threading
 import pandas
 import yaml
 
-from .             import DataCache, MarketIndex, CurrencyExchange, PortfolioAggregator
+from .             import DataCache, Fund, MarketIndex, CurrencyExchange, PortfolioAggregator
+from .scheduler    import TaskGraph, SourceRunner
+from .httpclient   import HTTPClient
+from .fetch        import FetchEngine
 from .currency     import brasil_banco_central     as currency_bcb
 from .currency     import cryptocompare            as currency_cryptocompare
 from .marketindex  import brasil_banco_central     as mktidx_bcb
@@ -43,12 +49,17 @@ class Investor(object):
                 file,
                 wealth_mask_factor=None,
                 refreshMap=dict(zip(domains,len(domains)*[False])),
-                load=True
+                load=True,
+                internalFund=True
             ):
         """
         Reads the YAML file which contains domains 'portfolio',
         'currency_converters' and 'benchmarks', and then load their data from
         cache or their original sources.
+
+        With internalFund=True (the default), the portfolio’s internal fund
+        (see Portfolio.makeInternalFund()) is made as part of loading, as soon
+        as portfolio and currency exchange are ready.
         """
         # Setup logging
         self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
@@ -63,12 +74,34 @@ class Investor(object):
 
         self.currency=self.config['currency']
 
+        if 'http' in self.config:
+            # Timeouts and connection pool of the HTTP client shared by all
+            # data sources
+            HTTPClient.configure(**self.config['http'])
+
+        if 'http_cache' in self.config:
+            # On-disk cache of raw responses of data sources
+            HTTPClient.configureCache(**self.config['http_cache'])
+
+        if 'fetch' in self.config:
+            # Global and per-host limits of requests in flight
+            FetchEngine.configure(**self.config['fetch'])
+
         self._cache               = None
         self.portfolio            = None
         self.currency_converters  = None
         self.benchmarks           = None
         self.exchange             = CurrencyExchange(self.currency)
         self.wealth_mask_factor   = wealth_mask_factor
+        self.internalFund         = internalFund
+        self.timings              = dict()
+        self.metrics              = dict()
+        self.file                 = file
+        self.revalidation         = None
+        self.revalidationError    = None
+        self.revalidationLock     = threading.Lock()
+        self.domainsLock          = threading.RLock()
+        self.sourceVersions       = (None, dict())
 
         if load:
             # Load all time series data from cache or web and compute derived
@@ -90,6 +123,11 @@ class Investor(object):
             benchmarks          = False,
             currency_converters = False,
         )
+
+        Each source is loaded under its provider’s policy from the
+        source_policies config entry (see SourceRunner): concurrency limit,
+        timeout and retries. A source that fails to refresh is loaded from
+        cache instead. Outcome and time of each source go to self.metrics.
         """
 
         refresh=dict(zip(self.domains,len(self.domains)*[False]))
@@ -110,91 +148,321 @@ class Investor(object):
                 getattr(self,dom)
             )
 
-        with concurrent.futures.ThreadPoolExecutor(thread_name_prefix='load_domains') as executor:
-            tasks={}
-
-            for domain in self.domains:
-                if refresh[domain] or getattr(self,domain) is None:
-                    # Load if a refresh was requested or domain has nothing yet
-                    setattr(self,domain,[])
-                    for part in self.config[domain]:
-                        archived = 'archived' in part and part['archived']
-                        if 'type' in part:
-                            # If it contains a class that needs activation or loading
-
-                            # Prepare parameters
-                            theparams=part['params'].copy()
-                            theparams.update(
-                                dict(
-                                    cache   = self.cache,
-
-                                    # Reload data from original source only if
-                                    # an explicit refresh was requested by the
-                                    # UI button AND if asset not marked as
-                                    # archived AND (decided later) asset has no
-                                    # entries in cache.
-                                    refresh = refresh[domain] and not archived
-                                )
+        # Loading is organized as a graph of tasks, each one started as soon
+        # as what it depends on is ready:
+        #
+        #   currency_converters:N ──► exchange:N ──► exchange:N+1 ──► ...
+        #            │                                       │
+        #            └──► derived:N ──► benchmarks           ▼
+        #   benchmarks:N ──────────────────┘       internal_fund
+        #   portfolio:N ──► portfolio ────────────────────┘
+        #
+        # So portfolio processing overlaps with market data fetching and the
+        # CurrencyExchange is built while slower converters are still being
+        # fetched.
+        graph=TaskGraph(
+            workers = self.config.get('domain_workers'),
+            prefix  = 'load_domains'
+        )
+
+        sources=SourceRunner(self.config.get('source_policies'))
+
+        loaded={domain: [] for domain in self.domains}
+
+        for domain in self.domains:
+            if refresh[domain] or getattr(self,domain) is None:
+                # Load if a refresh was requested or domain has nothing yet
+                for i,part in enumerate(self.config[domain]):
+                    archived = 'archived' in part and part['archived']
+                    if 'type' in part:
+                        # If it contains a class that needs activation or loading
+
+                        # Prepare parameters
+                        theparams=part['params'].copy()
+                        theparams.update(
+                            dict(
+                                cache   = self.cache,
+
+                                # Reload data from original source only if
+                                # an explicit refresh was requested by the
+                                # UI button AND if asset not marked as
+                                # archived AND (decided later) asset has no
+                                # entries in cache.
+                                refresh = refresh[domain] and not archived
+                            )
+                        )
+
+                        fallback=None
+                        if theparams['refresh']:
+                            # If source fails, use whatever it has in cache
+                            fallback=functools.partial(
+                                part['type'],
+                                **dict(theparams, refresh=False)
                             )
 
+                        loaded[domain].append(
+                            graph.add(
+                                f'{domain}:{i}',
+
+                                # Load under provider’s concurrency, timeout
+                                # and retry policy
+                                sources.run,
+                                part['type'].__name__,
+                                f'{domain}:{i}',
 
-                            task=executor.submit(
                                 # The class
                                 part['type'],
 
                                 # The parameters for class’ __init__()
+                                fallback=fallback,
                                 **theparams
                             )
-                            tasks[task]=(domain,part)
+                        )
 
-            for task in concurrent.futures.as_completed(tasks):
-                # Unpack what we’ve set previously
-                (domain,part)=tasks[task]
+        if updateCurrencyExchange:
+            # Setup a multiple currency exchange machine, fed converter by
+            # converter as they arrive, in config order
+            exchange=CurrencyExchange(self.currency)
+            previous=[]
+            for task in loaded['currency_converters']:
+                previous=[
+                    graph.add(
+                        task.replace('currency_converters','exchange'),
+                        lambda task: exchange.addCurrencies(
+                            Investor.split(graph.results[task])
+                        ),
+                        task,
+                        after=[task] + previous
+                    )
+                ]
 
-                # Put resulting object under its config
-                part['obj']=task.result()
+            graph.add(
+                'exchange',
+                lambda: setattr(self,'exchange',exchange),
+                after=previous
+            )
 
-                # Add to internal inventory
-                getattr(self,domain).append(part)
+        if loaded['currency_converters']:
+            graph.add(
+                'currency_converters',
+                lambda: setattr(
+                    self,
+                    'currency_converters',
+                    self.collectDomain(graph, loaded, 'currency_converters')
+                ),
+                after=loaded['currency_converters']
+            )
 
-        # Add more benchmarks as per config file
         if augmentDomains:
-            self.augmentDomains()
+            # Add more benchmarks as per config file
+            graph.add(
+                'benchmarks',
+                self.augmentDomains,
+                graph,
+                loaded,
+                after=self.deriveBenchmarks(graph, loaded)
+            )
+        elif loaded['benchmarks']:
+            graph.add(
+                'benchmarks',
+                lambda: setattr(
+                    self,
+                    'benchmarks',
+                    self.collectDomain(graph, loaded, 'benchmarks')
+                ),
+                after=loaded['benchmarks']
+            )
+
+        if loaded['portfolio']:
+            graph.add(
+                'portfolio',
+                self.arrangePortfolio,
+                self.collectDomain(graph, loaded, 'portfolio', lazy=True),
+                after=loaded['portfolio']
+            )
+
+        if self.internalFund and (loaded['portfolio'] or updateCurrencyExchange):
+            # Make an internal fund with all portfolio data for overall
+            # operations, as soon as both portfolio and exchange are ready
+            graph.add(
+                'internal_fund',
+                lambda: self.portfolio.makeInternalFund(
+                    currencyExchange=self.exchange
+                ),
+                after=[t for t in ['portfolio','exchange'] if t in graph.tasks]
+            )
+
+        try:
+            graph.run()
+        finally:
+            self.timings=graph.timings
+            self.metrics=sources.metrics
+
+
+
+    def revalidate(self, refreshMap=dict(zip(domains,len(domains)*[True]))):
+        """
+        Stale-while-revalidate loading: keep serving current data while a
+        shadow Investor loads the same config file in a background thread,
+        refreshing domains as per refreshMap (see loadDomains()). Once it is
+        completely loaded, its portfolio, benchmarks, currency_converters and
+        exchange are swapped into self while holding self.domainsLock. Readers
+        that hold it too, as viewReports() and the UI do, never see a mix of
+        old and new domains.
+
+        If loading fails, current data is kept and the error is stored in
+        self.revalidationError.
+
+        Only one revalidation runs at a time; calling it again while one is
+        running just returns the running thread.
+        """
+        with self.revalidationLock:
+            if self.revalidating:
+                return self.revalidation
+
+            def work():
+                try:
+                    shadow=Investor(
+                        file                 = self.file,
+                        wealth_mask_factor   = self.wealth_mask_factor,
+                        internalFund         = self.internalFund,
+                        load                 = False,
+                    )
+
+                    # Share DataCache and its connections
+                    shadow._cache=self._cache
+
+                    shadow.currency=self.currency
+                    shadow.loadDomains(refreshMap)
+
+                    # Swap only after current readers are done
+                    with self.domainsLock:
+                        for k in [
+                                    'config',
+                                    'portfolio',
+                                    'benchmarks',
+                                    'currency_converters',
+                                    'exchange',
+                                    'timings',
+                                    'metrics',
+                                ]:
+                            setattr(self, k, getattr(shadow, k))
+
+                    self.revalidationError=None
+                    self.logger.info('Revalidated all domains in background')
+                except Exception as e:
+                    self.logger.exception('Background revalidation failed; keeping current data')
+                    self.revalidationError=e
+
+            self.revalidation=threading.Thread(
+                target = work,
+                name   = 'investor_revalidate',
+                daemon = True
+            )
+            self.revalidation.start()
+
+            return self.revalidation
+
+
 
-        # Rearrange Portfolio
-        if len(self.portfolio)>1:
-            agg=PortfolioAggregator()
-            agg.append([p['obj'] for p in self.portfolio])
-            self.portfolio=agg
+    @property
+    def revalidating(self):
+        """
+        True while a revalidate() is loading in background.
+        """
+        return self.revalidation is not None and self.revalidation.is_alive()
+
+
+
+    def collectDomain(self, graph, loaded, domain, lazy=False):
+        """
+        Put objects loaded by graph under their config parts, in config order,
+        and return the list of parts. With lazy=True, return a function that
+        does that when called.
+        """
+        def collect():
+            parts=[]
+            for task in loaded[domain]:
+                part=self.config[domain][int(task.split(':')[1])]
+
+                # Put resulting objects under their config; groups of
+                # currency converters become one part per converter
+                for obj in Investor.split(graph.results[task]):
+                    if obj is graph.results[task]:
+                        part['obj']=obj
+                        parts.append(part)
+                    else:
+                        parts.append(dict(part, obj=obj))
+
+            return parts
+
+        if lazy:
+            return collect
+
+        return collect()
+
+
+
+    def split(obj):
+        """
+        Return the list of objects that a loaded source stands for: the
+        converters of a group of currency converters (as
+        CryptoCompareCurrencyConverterGroup) or just obj itself.
+        """
+        return getattr(obj, 'converters', [obj])
+
+
+
+    def arrangePortfolio(self, collect):
+        """
+        Wrap loaded portfolio parts in a PortfolioAggregator, if more than one,
+        and set its wealth mask.
+        """
+        parts=collect()
+
+        if len(parts)>1:
+            portfolio=PortfolioAggregator(workers=self.config.get('portfolio_workers'))
+            portfolio.append([p['obj'] for p in parts])
         else:
-            self.portfolio=self.portfolio[0]['obj']
+            portfolio=parts[0]['obj']
 
-        self.portfolio.wealth_mask_factor=1
+        portfolio.wealth_mask_factor=1
         if self.wealth_mask_factor is not None:
-            self.portfolio.wealth_mask_factor=self.wealth_mask_factor
+            portfolio.wealth_mask_factor=self.wealth_mask_factor
         elif 'wealth_mask_factor' in self.config:
-            self.portfolio.wealth_mask_factor=self.config['wealth_mask_factor']
+            portfolio.wealth_mask_factor=self.config['wealth_mask_factor']
 
-        if updateCurrencyExchange:
-            # Setup a multiple currency exchange machine
-            self.exchange=CurrencyExchange(self.currency)
-
-            # Put all CurrencyConverters in a single useful CurrencyExchange machine
-            self.exchange.addCurrencies(
-                [
-                    curr['obj']
-                    for curr in self.currency_converters
-                ]
-            )
+        self.portfolio=portfolio
 
 
 
-    def augmentDomains(self):
+    def deriveBenchmarks(self, graph, loaded):
         """
-        Fabricate more benchmarks from currency converters, as specified by
-        YAML config file.
+        Add to graph one task per benchmark that is fabricated from a currency
+        converter, to run as soon as converters are loaded. Returns the list of
+        tasks that benchmarks depend on.
+        """
+        tasks=list(loaded['benchmarks'])
+
+        for i,item in enumerate(self.config['benchmarks']):
+            if 'kind' in item and item['kind'] == 'from_currency_converter':
+                tasks.append(
+                    graph.add(
+                        f'derived:{i}',
+                        self.deriveBenchmark,
+                        item,
+                        after=[t for t in ['currency_converters'] if t in graph.tasks]
+                    )
+                )
+
+        return tasks
 
-        Entries such as the following from the YAML file will be handled:
+
+
+    def deriveBenchmark(self, item):
+        """
+        Fabricate a benchmark from a currency converter, as specified by an
+        item of the YAML config file such as:
 
         benchmarks:
             - kind: from_currency_converter
@@ -208,45 +476,288 @@ class Investor(object):
         my USD into assets of the S&P500 set, the fabricated “[BRL] USDBRL”
         benchmark shows what would happen if I converted my BRL in USD.
         """
+        curFrom = item['from_to'][:3]
+        curTo   = item['from_to'][3:]
+
+        # Scan all currency converters we have to find a match
+        for cc in [c['obj'] for c in self.currency_converters]:
+            if curFrom == cc.currencyFrom and curTo == cc.currencyTo:
+                item['obj']=MarketIndex().fromCurrencyConverter(cc)
+                break
+            elif curTo == cc.currencyFrom and curFrom == cc.currencyTo:
+                item['obj']=MarketIndex().fromCurrencyConverter(cc.invert())
+                break
+
+        if 'obj' not in item:
+            raise Exception(f'Can’t find "{item["from_to"]}" CurrencyConverter to make a MarketIndex from.')
+
+        return item
 
-        for item in self.config['benchmarks']:
-            if 'kind' in item and item['kind'] == 'from_currency_converter':
-                curFrom = item['from_to'][:3]
-                curTo   = item['from_to'][3:]
 
-                benchmark_signature = '[{currency}] {name}'.format(
-                    name=item['from_to'],
-                    currency=curTo
-                )
 
-                # Delete old MarketIndex previously created by a CurrencyConverter
-                self.benchmarks = [b for b in self.benchmarks if b['obj'].id!=curFrom+curTo]
+    def augmentDomains(self, graph, loaded):
+        """
+        Put together loaded benchmarks and the ones fabricated from currency
+        converters by deriveBenchmark(), as specified by YAML config file, and
+        sort them.
+        """
+        if loaded['benchmarks']:
+            benchmarks=self.collectDomain(graph, loaded, 'benchmarks')
+        else:
+            benchmarks=self.benchmarks or []
 
-                # Scan all currency converters we have to find a match
-                for cc in self.currency_converters:
-                    current_cc=cc['obj']
-                    if curFrom == current_cc.currencyFrom and curTo == current_cc.currencyTo:
-                        item['obj']=MarketIndex().fromCurrencyConverter(current_cc)
-                        break
-                    elif curTo == current_cc.currencyFrom and curFrom == current_cc.currencyTo:
-                        item['obj']=MarketIndex().fromCurrencyConverter(current_cc.invert())
-                        break
+        derived=[
+            graph.results[task]
+            for task in graph.tasks
+            if task.startswith('derived:')
+        ]
 
-                if 'obj' in item:
-                    self.benchmarks.append(item)
-                else:
-                    raise Exception(f'Can’t find "{item.kind}" CurrencyConverter to make a MarketIndex from.')
+        # Delete old MarketIndex previously created by a CurrencyConverter
+        ids={b['obj'].id for b in derived}
+        benchmarks=[b for b in benchmarks if b['obj'].id not in ids] + derived
 
         # Sort benchmarks
-        benchs={str(b['obj']): b for b in self.benchmarks}
+        benchs={str(b['obj']): b for b in benchmarks}
         self.benchmarks=[benchs[k] for k in sorted(benchs)]
 
 
 
+    ############################################################################
+    ##
+    ## Precomputed reports
+    ##
+    ############################################################################
+
+    def dataVersions(self):
+        """
+        Return a dict with the cached version of each loaded source, as
+        {'kind•id': version}, or None if any source has no cached version, in
+        which case data can’t be told apart and reports can’t be reused.
+        Computed once per loaded portfolio.
+        """
+        with self.domainsLock:
+            if self.sourceVersions[0] is self.portfolio:
+                return self.sourceVersions[1]
+
+            if isinstance(self.portfolio, PortfolioAggregator):
+                members=self.portfolio.members
+            else:
+                members=[self.portfolio]
+
+            sources=[]
+            for member in members:
+                for prop in ['ledger','balance']:
+                    if getattr(member,f'has_{prop}'):
+                        sources.append((f'{member.kind}__{prop}',member.id))
+
+            for domain in ['currency_converters','benchmarks']:
+                for part in getattr(self,domain):
+                    if 'type' in part:
+                        # Derived benchmarks are covered by their converters
+                        sources.append((part['obj'].kind,part['obj'].id))
+
+            versions=dict()
+            for (kind,id) in sources:
+                version=self.cache.current(kind=kind, id=id)
+
+                if version is None:
+                    versions=None
+                    break
+
+                versions[f'{kind}•{id}']=DataCache.versionKey(version)
+
+            self.sourceVersions=(self.portfolio, versions)
+
+            return versions
+
+
+
+    def viewReports(self,
+                assets=None,
+                exclude_assets=[],
+                currency=None,
+                benchmark=None,
+                periods='month & year',
+                start=None,
+                end=None,
+                save=False,
+                withFund=True,
+            ):
+        """
+        Make the fund and reports of a view, as the UI does for its current
+        selection of assets, currency, benchmark, periods and time range, which
+        default to the same as the UI’s. Parameters are the same as the keys of
+        a view in the 'views' section of the YAML config file.
+
+        Returns a dict with:
+        - fund: the Fund of selected assets, or None if withFund=False
+        - ragged, periodic, macroPeriodic: its periodicReport()s
+        - report: its report()
+
+        Reports are taken from DataCache if they were saved with save=True for
+        exactly the same view, source data versions and code. Only the reports
+        are saved, not the fund, and saving deletes reports of all views made
+        from older data.
+        """
+        # Same domains all along, even if revalidate() finishes meanwhile
+        with self.domainsLock:
+            portfolio=self.portfolio
+
+            # Resolve defaults as the UI does
+            if isinstance(assets, str):
+                assets=[assets]
+            assets=[a for a in (assets or []) if a!='ALL']
+            if len(assets)==0:
+                assets=[a[0] for a in portfolio.assets()]
+            assets=sorted(set(assets)-set(exclude_assets or []))
+
+            currency=currency or self.config['currency']
+
+            # Benchmark is a MarketIndex or its name, as str() shows it, which is
+            # unique. Its bare id, as in the 'views' section of the YAML config
+            # file, might be shared by many, so it is the last resort.
+            bench=self.benchmarks[0]['obj']
+            for match in [
+                        lambda b: b is benchmark,
+                        lambda b: str(b)==benchmark,
+                        lambda b: b.id==benchmark,
+                    ]:
+                found=[b['obj'] for b in self.benchmarks if match(b['obj'])]
+                if found:
+                    bench=found[0]
+                    break
+
+            relevant=self.config.get('relevant period',dict())
+            start=pandas.Timestamp(
+                start or relevant.get('start') or portfolio.fund.start
+            ).date()
+            end=pandas.Timestamp(
+                end or relevant.get('end') or portfolio.fund.end
+            ).date()
+
+            p=Fund.periodPairs[periods]
+
+            # Identify this view, its data and code
+            versions=self.dataVersions()
+            view=dict(
+                assets             = assets,
+                currency           = currency,
+                benchmark          = str(bench),
+                periods            = periods,
+                start              = start.isoformat(),
+                end                = end.isoformat(),
+                wealth_mask_factor = portfolio.wealth_mask_factor,
+            )
+            kind='investor_view'
+            id=DataCache.fingerprint([], view)
+            version=None
+            fingerprint=None
+
+            if versions is not None:
+                version=max(versions.values())
+                fingerprint=DataCache.fingerprint(
+                    [
+                        Investor.viewReports,
+                        Fund.__init__,
+                        Fund.periodicReport,
+                        Fund.report,
+                    ],
+                    sorted(versions.items())
+                )
+
+            def getFund():
+                # A shallow copy is enough because converting a
+                # CurrencyExchange to another currency replaces its data
+                exchange=copy.copy(self.exchange)
+                exchange.currency=currency
+
+                fund=portfolio.getFund(subset=assets, currencyExchange=exchange)
+                fund.setName(top=4)
+
+                return fund
+
+            if versions is not None:
+                reports=self.cache.getProcessed(kind, id, version, fingerprint)
+
+                if reports is not None:
+                    return dict(reports, fund=getFund() if withFund else None)
+
+            fund=getFund()
+
+            reports=dict()
+
+            reports['ragged']=fund.periodicReport(
+                benchmark  = bench,
+                start      = start,
+                end        = end,
+            )
+
+            reports['periodic']=fund.periodicReport(
+                period     = p['period'],
+                benchmark  = bench,
+                start      = start,
+                end        = end,
+            )
+
+            reports['macroPeriodic']=fund.periodicReport(
+                period     = p['macroPeriod'],
+                benchmark  = bench,
+                start      = start,
+                end        = end,
+            )
+
+            reports['report']=fund.report(
+                precomputedPeriodicReport      = reports['periodic'],
+                precomputedMacroPeriodicReport = reports['macroPeriodic'],
+                period     = periods,
+                benchmark  = bench,
+                start      = start,
+                end        = end,
+            )
+
+            if save and version is not None:
+                self.cache.setProcessed(kind, id, version, fingerprint, reports)
+                self.cache.cleanProcessed(kind, version)
+
+            return dict(reports, fund=fund)
+
+
+
+    def precompute(self):
+        """
+        Compute and save in DataCache the reports of the default view and of
+        each view in the 'views' section of the YAML config file, so UI users
+        find them ready. Returns a dict of {view name: seconds}.
+        """
+        views={None: dict()}
+        views.update(self.config.get('views',dict()))
+
+        timings=dict()
+        for name,view in views.items():
+            start=time.perf_counter()
+
+            self.viewReports(
+                save=True,
+                withFund=False,
+                **{k.replace(' ','_'): v for k,v in view.items()}
+            )
+
+            timings[name]=time.perf_counter()-start
+            self.logger.info(f'Precomputed reports of view {name} in {timings[name]:.3f}s')
+
+        return timings
+
+
+
     @property
     def cache(self):
         if self._cache is None:
-            self._cache=DataCache(self.config['cache_database'],recycle=2)
+            options=dict(recycle=2)
+            if 'cache_options' in self.config:
+                # Extra DataCache parameters as recycle, hotSize, delta
+                options.update(self.config['cache_options'])
+
+            self._cache=DataCache(self.config['cache_database'],**options)
             self.logger.debug(f"Using cache: {self._cache}")
 
         return self._cache
@@ -1,7 +1,8 @@
 import datetime
 import pandas
 
-from .. import MarketIndex
+from ..            import MarketIndex
+from ..fetch       import FetchEngine
 
 
 class AlphaVantageMarketIndex(MarketIndex):
@@ -44,10 +45,15 @@ class AlphaVantageMarketIndex(MarketIndex):
 
 
     def refreshData(self):
-        self.data=pandas.read_csv(
-            self.url.format(
-                ticker=self.id,
-                key=self.apiKey
+        self.data=FetchEngine.run(
+            FetchEngine.readCSV(
+                self.url.format(
+                    ticker=self.id,
+                    key=self.apiKey
+                ),
+
+                # Parse once, before caching, so DataCache keeps it typed
+                parse_dates=['timestamp']
             )
         )
 
@@ -1,8 +1,8 @@
-import urllib
-import concurrent.futures
+import requests
 import pandas
 
-from .. import MarketIndex
+from ..            import MarketIndex
+from ..fetch       import FetchEngine
 
 class BCBMarketIndex(MarketIndex):
     # Tabela (dita obsoleta) com o código dos índices:
@@ -65,70 +65,63 @@ class BCBMarketIndex(MarketIndex):
                 freq='-60ME'
             )
 
-            # Read URL content for multiple periods in parallel
-            with concurrent.futures.ThreadPoolExecutor(thread_name_prefix='load_domains') as executor:
-                tasks=dict()
-                self.data=None
-                for i in range(len(periods)):
-                    if i+1==len(periods):
-                        break
-                    end=periods[i]
-                    start=periods[i+1]
-                    # display(url.format(start=start,end=end))
-                    url=(
-                        (self.series[self.id]['url']+self.paged_period_params)
-                        .format(
-                            start=start,
-                            end=end
-                        )
+            pages=[]
+            for i in range(len(periods)):
+                if i+1==len(periods):
+                    break
+                end=periods[i]
+                start=periods[i+1]
+                # display(url.format(start=start,end=end))
+                url=(
+                    (self.series[self.id]['url']+self.paged_period_params)
+                    .format(
+                        start=start,
+                        end=end
                     )
+                )
 
-                    # Read URL in background
-                    task=executor.submit(
-                        # Method to execute in background
-                        pandas.read_json,
-
-                        # Parameters to the method: the index URL
-                        url
-                    )
+                pages.append((start,end,url))
 
-                    tasks[task]=(self.id,start,end)
+            # Read URL content for multiple periods concurrently, as
+            # coroutines of the shared fetch engine, within its global and
+            # per-host limits
+            results=FetchEngine.gather(
+                *[FetchEngine.readJSON(url) for (start,end,url) in pages]
+            )
 
-                for task in concurrent.futures.as_completed(tasks):
-                    try:
-                        if self.data is None:
-                            self.data=task.result()
-                        else:
-                            self.data=pandas.concat([self.data,task.result()])
-                    except urllib.error.HTTPError as e:
-                        self.logger.warning(f"Failed to retrieve {tasks[task][0]} for period {tasks[task][1]} → {tasks[task][2]}. Probably data series has no data for period.")
+            self.data=None
+            for (start,end,url),result in zip(pages,results):
+                if isinstance(result, requests.HTTPError):
+                    self.logger.warning(f"Failed to retrieve {self.id} for period {start} → {end}. Probably data series has no data for period.")
+                elif isinstance(result, Exception):
+                    raise result
+                elif self.data is None:
+                    self.data=result
+                else:
+                    self.data=pandas.concat([self.data,result])
 
             # Concatenate all results together and do minimum processing
             self.data=(
                 self.data
                 .assign(
-                    time=lambda table: (
-                        (
-                            # Convert to datetime
-                            pandas.to_datetime(table.data,dayfirst=True) +
-
-                            # This is date-only information but we know this is the
-                            # end of the day
-                            pandas.Timedelta(hours=22, minutes=59)
-                        )
-                    ),
+                    # Parse dates once, before caching, so DataCache keeps
+                    # them typed
+                    data=lambda table: pandas.to_datetime(table.data,dayfirst=True)
                 )
-                .sort_values('time')
-                .drop('time',axis=1)
+                .sort_values('data')
                 .drop_duplicates()
             )
         else:
             try:
-                self.data=pandas.read_json(self.series[self.id]['url'])
-            except urllib.error.URLError as err:
+                self.data=FetchEngine.run(
+                    FetchEngine.readJSON(self.series[self.id]['url'])
+                )
+            except requests.RequestException as err:
                 self.logger.warning(f"URL was: {self.series[self.id]['url']}")
                 raise
 
+            self.data['data']=pandas.to_datetime(self.data.data,dayfirst=True)
+
 
 
     def processData(self):
@@ -139,7 +132,8 @@ class BCBMarketIndex(MarketIndex):
             .assign(
                 time=lambda table: (
                     (
-                        # Convert to datetime
+                        # Convert to datetime; no-op if data came typed from
+                        # refreshData() or from DataCache
                         pandas.to_datetime(table.data,dayfirst=True) +
 
                         # This is date-only information but we know this is the
@@ -1,7 +1,7 @@
 import pandas
-import pandas_datareader
 
-from .. import MarketIndex
+from ..            import MarketIndex
+from ..httpclient  import HTTPClient
 
 
 class FREDMarketIndex(MarketIndex):
@@ -12,21 +12,24 @@ class FREDMarketIndex(MarketIndex):
     the `S&P 500` has URL https://fred.stlouisfed.org/series/SP500, so use name=SP500.
 
     """
-    def __init__(self, name, isRate=False, cache=None, refresh=False):
-        super().__init__(kind='DataReaderFRED', id=name, currency='USD', isRate=isRate, cache=cache, refresh=refresh)
 
+    api='https://fred.stlouisfed.org/graph/fredgraph.csv'
 
-    def refreshData(self):
-        self.data = pandas_datareader.data.DataReader([self.id], 'fred','1900-01-01')
 
-        # Put a standard column name
-        self.data.rename(columns={self.id: 'value'}, inplace=True)
+    def __init__(self, name, isRate=False, cache=None, refresh=False):
+        super().__init__(kind='DataReaderFRED', id=name, currency='USD', isRate=isRate, cache=cache, refresh=refresh)
 
-#         # Rename index to our standard
-#         self.data.index.name='time'
 
-        # Make the index a regular column for caching purposes
-        self.data.reset_index(inplace=True)
+    def refreshData(self):
+        # Through HTTPClient, so it is also kept by its cache
+        self.data = HTTPClient.readCSV(
+            FREDMarketIndex.api,
+            params     = dict(id=self.id),
+            header     = None,
+            skiprows   = 1,
+            names      = ['DATE','value'],
+            na_values  = '.'
+        )
 
 
 
@@ -39,7 +42,7 @@ class FREDMarketIndex(MarketIndex):
         self.data.sort_index(inplace=True)
 
         # Drop old column
-        self.data.drop('DATE', axis=1)
+        self.data.drop('DATE', axis=1, inplace=True)
 
         self.data.fillna(method='ffill', axis=0, inplace=True)
 
@@ -15,6 +15,11 @@ class MonetaryTimeSeries(object):
     from original source or the cache.
     """
 
+    # Attributes that shape what processData() makes of raw data, part of
+    # fingerprint(). Derived classes must set them before calling
+    # MonetaryTimeSeries.__init__(), which loads data.
+    processingParams=['kind','id']
+
     def __init__(self, kind, id, cache=None, refresh=False):
         # Setup logging
         self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
@@ -25,6 +30,9 @@ class MonetaryTimeSeries(object):
         self.nextRefresh = refresh
         self.cache       = cache
 
+        # Time of the cached raw version currently in self.data
+        self.cacheVersion = None
+
         self.getData()
 
 
@@ -49,7 +57,26 @@ class MonetaryTimeSeries(object):
 
     def tryCacheData(self, kind, id, cache=None):
         if cache is not None:
-            (self.data,age)=cache.get(kind=kind, id=id)
+            (self.data,self.cacheVersion)=cache.get(kind=kind, id=id)
+            if self.data is not None:
+                return True
+        return False
+
+
+
+    def tryProcessedCacheData(self, kind, id, cache=None):
+        """
+        Load into self.data the output of a previous processData() over the
+        current cached version, if it was made by the same code. Return True
+        if there is no need to process anything.
+        """
+        if cache is not None:
+            self.data=cache.getProcessed(
+                kind        = kind,
+                id          = id,
+                version     = cache.current(kind=kind, id=id),
+                fingerprint = self.fingerprint()
+            )
             if self.data is not None:
                 return True
         return False
@@ -58,13 +85,80 @@ class MonetaryTimeSeries(object):
 
     def cacheUpdate(self, kind, id, cache):
         if cache is not None and self.data is not None:
-            cache.set(kind=kind, id=id, data=self.data)
+            self.cacheVersion=cache.set(kind=kind, id=id, data=self.data)
+
+
+
+    def processedCacheUpdate(self, kind, id, cache):
+        if cache is not None and self.data is not None:
+            cache.setProcessed(
+                kind        = kind,
+                id          = id,
+                version     = self.cacheVersion,
+                fingerprint = self.fingerprint(),
+                data        = self.data
+            )
+
+
+
+    def processors(self):
+        """
+        Return processData() of this class and of its ancestors, along with
+        the methods they call by name, recursively.
+        """
+
+        def names(code):
+            yield from code.co_names
+            for const in code.co_consts:
+                if hasattr(const, 'co_code'):
+                    # Lambdas and nested functions
+                    yield from names(const)
+
+        functions=[]
+        pending=['processData']
+        seen=set()
+
+        while len(pending)>0:
+            name=pending.pop(0)
+            if name in seen:
+                continue
+            seen.add(name)
+
+            for klass in type(self).__mro__:
+                function=klass.__dict__.get(name)
+                if isinstance(function, (staticmethod, classmethod)):
+                    function=function.__func__
+                if hasattr(function, '__code__'):
+                    functions.append(function)
+                    pending+=list(names(function.__code__))
+
+        return functions
+
+
+
+    def fingerprint(self):
+        """
+        Identifies the code and the constructor parameters that shape
+        processed data, so processed snapshots made by other versions of
+        processData() or with other parameters are not used.
+        """
+        return DataCache.fingerprint(
+            self.processors(),
+            config=[
+                (param, getattr(self, param, None))
+                for param in self.processingParams
+            ]
+        )
 
 
 
     def getData(self):
         if self.data is None:
             if self.nextRefresh is False:
+                if self.tryProcessedCacheData(self.kind,self.id,self.cache):
+                    # Already processed, nothing else to do
+                    return self.data
+
                 # Don't want to get new data from the Internet, so try cache first.
                 self.tryCacheData(self.kind,self.id,self.cache)
 
@@ -82,6 +176,9 @@ class MonetaryTimeSeries(object):
             # Data cleanup and feature engineering
             self.processData()
 
+            # So next time we don't need to process it again
+            self.processedCacheUpdate(self.kind,self.id,self.cache)
+
             self.nextRefresh=False
 
         return self.data
@@ -124,6 +221,8 @@ class CurrencyConverter(MonetaryTimeSeries):
     Example of CurrencyConverter would be USDBRL, for BRL to USD conversion, or USDBTC,
     for BTC to USD conversion.
     """
+    processingParams=MonetaryTimeSeries.processingParams + ['currencyFrom','currencyTo']
+
     def __init__(self, currencyFrom, currencyTo, kind, id, cache=None, refresh=False):
         self.currencyFrom=currencyFrom
         self.currencyTo=currencyTo
@@ -194,12 +293,14 @@ class MarketIndex(MonetaryTimeSeries):
     Example of market indexes are IBOV, SP500 and NASDAQ.
     See implementations in marketindex folder.
     """
-    def __init__(self, kind='MarketIndex', id=None, currency=None, isRate=True, cache=None, refresh=False):
-        super().__init__(kind=kind, id=id, cache=cache, refresh=refresh)
+    processingParams=MonetaryTimeSeries.processingParams + ['currency','isRate']
 
+    def __init__(self, kind='MarketIndex', id=None, currency=None, isRate=True, cache=None, refresh=False):
         self.currency=currency
         self.isRate=isRate
 
+        super().__init__(kind=kind, id=id, cache=cache, refresh=refresh)
+
 
 
     def fromCurrencyConverter(self, cc: CurrencyConverter):
@@ -375,15 +476,19 @@ class CurrencyExchange(object):
         USD conversion). Use obj.currency='BRL' to then turn it into a to-BRL
         machine, converting internal data conveniently. So updated object is now
         capable of converting USD➔BRL, EUR➔BRL etc.
+
+        Internal data is replaced, not changed in place, so a shallow copy of
+        this object can be converted without touching the original.
         """
         if self.data is not None:
             if currency in self.data.columns:
-                for c in self.data.columns:
-                    if c!=currency:
-                        self.data[c]/=self.data[currency]
-
-                self.data[currency]=1/self.data[currency]
-                self.data.rename(columns={currency:self.target}, inplace=True)
+                rates=self.data[currency]
+                self.data=(
+                    self.data
+                    .div(rates, axis=0)
+                    .assign(**{currency: 1/rates})
+                    .rename(columns={currency:self.target})
+                )
             elif currency == self.target:
                 pass
             else:
@@ -1,7 +1,9 @@
 import os
+import time
 import datetime
 import pickle
 import logging
+import warnings
 import concurrent.futures
 import numpy
 import pandas
@@ -40,6 +42,9 @@ class Portfolio(object):
 
     # twoSecondsGen=None # to be redefined later
 
+    # Junk found around numbers in monetary columns of spreadsheets
+    currencySymbols='R$€ \t\u00a0'
+
 
 
 
@@ -69,6 +74,16 @@ class Portfolio(object):
         self.cache=cache
         self.nextRefresh=refresh
 
+        # Times of the cached raw versions of ledger and balance
+        self.cacheVersions=dict()
+
+        # Wealth-masked balance and ledger, as
+        # {prop: (source frame, factor, masked frame)}
+        self.masked=dict()
+
+        # Result of assets(), as (ledger, fund, assets)
+        self.assetsCache=None
+
         # self.twoSecondsGen=Portfolio.pseudoRandomUniqueMilliseconds()
 
         # Force data load
@@ -136,7 +151,20 @@ class Portfolio(object):
         If self has an internal fund (created with makeInternalFund()), assets
         will be orderd by current balance, with biggest balance as the first
         one. Otherwise they'll be ordered alphabetically -- less useful.
+
+        Currencies of an asset are the ones that have any value in its ledger
+        entries, in the order of ledger columns. Result is computed once and
+        reused while ledger and internal fund are the same objects.
         """
+        ledger=self.ledger
+
+        if (
+                self.assetsCache is not None and
+                self.assetsCache[0] is ledger and
+                self.assetsCache[1] is self.fund
+            ):
+            return list(self.assetsCache[2])
+
         order=None
         if self.fund is not None:
             order=(
@@ -175,57 +203,43 @@ class Portfolio(object):
 
         nonMonetary={'asset', 'time', 'comment'}
 
-        return list(
-            self.ledger[
-                ['asset'] +
-                # Get only currency names
-                list(set(self.ledger.columns) - nonMonetary)
-            ]
-
-            .set_index('asset')
-
-
-            # Get rid of completely empty rows
-            .dropna(how='all')
-
-
-            # replace by True where there is NaN
-            .isnull()
-
-
-            # Convert a False (has value) to currency name
-            .apply(
-                lambda x: x.index[x==False][0],
-                axis=1
-            )
-
-
-            # make asset name a regular column
-            .reset_index()
+        currencies=[c for c in ledger.columns if c not in nonMonetary]
 
+        assets=list(
+            ledger[currencies]
 
-            .drop_duplicates()
+            # True where there is a value
+            .notna()
 
+            # Which currencies each asset ever had values on
+            .groupby(ledger.asset, observed=True)
+            .any()
 
-            .set_index('asset')
-
+            # Long format, keeping only pairs of asset and currency with values
+            .rename_axis(columns='currency')
+            .stack()
+            .pipe(lambda pairs: pairs[pairs])
+            .reset_index(level='currency')
 
             # Group by asset and make list of currencies
-            .groupby(by='asset', observed=True).agg(list)
-
+            .groupby(level=0, observed=True)
+            .currency
+            .agg(list)
 
             # Order by bigger current balance
             .reindex(order)
 
-
             # make asset name a regular column
             .reset_index()
 
-
             # convert to tuples
             .itertuples(index=False, name=None)
         )
 
+        self.assetsCache=(ledger,self.fund,assets)
+
+        return list(assets)
+
 
 
     @property
@@ -276,55 +290,64 @@ class Portfolio(object):
 
         self.logger.debug(f"Requested data for {prop}")
 
-        metadata = "asset time comment".split()
-
         if self.nextRefresh:
-            self.callRefreshData()
             self.nextRefresh=False
+            if self.callRefreshData() is False:
+                # Source unchanged and cached data already processed
+                return self.getProperty(prop)
         elif getattr(self,f'_{prop}') is None:
+            if self.tryProcessedCacheData():
+                # Already processed, skip processData()
+                return self.getProperty(prop)
+
             if self.tryCacheData() is False:
-                self.callRefreshData()
+                if self.callRefreshData() is False:
+                    return self.getProperty(prop)
         else:
-            df = getattr(self,f'_{prop}')
-            if hasattr(self,'wealth_mask_factor') and self.wealth_mask_factor!=1:
-                # Obfuscate wealth by multiplying by wealth_mask_factor
-
-                self.logger.info("Wealth is being masked")
-
-                return pandas.concat(
-                    [
-                        df[df.columns.intersection(metadata)],
-                        (
-                            df.drop(df.columns.intersection(metadata), axis=1) *
-                            self.wealth_mask_factor
-                        )
-                    ],
-                    axis=1
-                )
-            else:
-                return df
+            return self.maskWealth(prop, getattr(self,f'_{prop}'))
 
         # At this point we have raw data from cache or original source (internet)
 
         # Data cleanup and feature engineering
         self.processData()
 
-        df = getattr(self,f'_{prop}')
-        if hasattr(self,'wealth_mask_factor') and self.wealth_mask_factor!=1:
-            # Obfuscate wealth by multiplying by wealth_mask_factor
-            return pandas.concat(
-                [
-                    df[df.columns.intersection(metadata)],
-                    (
-                        df.drop(df.columns.intersection(metadata), axis=1) *
-                        self.wealth_mask_factor
-                    )
-                ],
-                axis=1
-            )
-        else:
+        # So next time we don't need to process it again
+        self.processedCacheUpdate()
+
+        return self.maskWealth(prop, getattr(self,f'_{prop}'))
+
+
+
+    def maskWealth(self, prop, df):
+        """
+        Obfuscate wealth by multiplying monetary columns of df, the ‘balance’
+        or ‘ledger’ (prop), by self.wealth_mask_factor.
+
+        The masked frame is made once and reused while the factor and the
+        source frame stay the same. It shares its metadata columns (asset,
+        time, comment) with df, so only monetary columns take extra memory.
+        """
+        factor=getattr(self,'wealth_mask_factor',1)
+
+        if df is None or factor==1:
             return df
 
+        cached=self.masked.get(prop)
+        if cached is not None and cached[0] is df and cached[1]==factor:
+            return cached[2]
+
+        self.logger.info("Wealth is being masked")
+
+        metadata = "asset time comment".split()
+
+        masked=df.copy(deep=False)
+        for c in df.columns.difference(metadata):
+            masked[c]=df[c]*factor
+
+        self.masked[prop]=(df,factor,masked)
+
+        return masked
+
 
 
     def tryCacheData(self):
@@ -342,6 +365,11 @@ class Portfolio(object):
                 id=self.id
             )
 
+            self.cacheVersions=dict(
+                ledger  = ledger_age,
+                balance = balance_age
+            )
+
         if ledger_age or balance_age:
             return True
 
@@ -349,19 +377,90 @@ class Portfolio(object):
 
 
 
+    def tryProcessedCacheData(self):
+        """
+        Load into self._ledger and self._balance the output of a previous
+        processData() over their current cached versions, if made by the same
+        code and sheet structure. Return True only if all that this
+        portfolio has was found, so processData() can be skipped.
+        """
+        if self.cache is None:
+            return False
+
+        fingerprint=self.fingerprint()
+
+        found=dict()
+        for prop in ['ledger','balance']:
+            if getattr(self,f'has_{prop}'):
+                kind=f'{self.kind}__{prop}'
+                found[prop]=self.cache.getProcessed(
+                    kind        = kind,
+                    id          = self.id,
+                    version     = self.cache.current(kind=kind, id=self.id),
+                    fingerprint = fingerprint
+                )
+
+                if found[prop] is None:
+                    return False
+
+        for prop in found:
+            setattr(self,f'_{prop}',found[prop])
+
+        return len(found)>0
+
+
+
+    def processedCacheUpdate(self):
+        """
+        Save processed ledger and balance to DataCache, along with the
+        cached raw versions they came from.
+        """
+        if self.cache is None:
+            return
+
+        fingerprint=self.fingerprint()
+
+        for prop in ['ledger','balance']:
+            if self.cacheVersions.get(prop) is not None:
+                self.cache.setProcessed(
+                    kind        = f'{self.kind}__{prop}',
+                    id          = self.id,
+                    version     = self.cacheVersions[prop],
+                    fingerprint = fingerprint,
+                    data        = getattr(self,f'_{prop}')
+                )
+
+
+
+    def fingerprint(self):
+        """
+        Identifies the code and sheet structure that process raw cached data,
+        so processed snapshots made by other versions of them are not used.
+        """
+        return DataCache.fingerprint(
+            [
+                getattr(type(self),f)
+                for f in ['processData','processSheetData']
+                if hasattr(type(self),f)
+            ] + [Portfolio.normalizeTime],
+            getattr(self,'sheetStructure',None)
+        )
+
+
+
     def cacheUpdate(self):
         """
         Set new data to DataCache
         """
         if self.cache is not None:
             if self._ledger is not None:
-                self.cache.set(
+                self.cacheVersions['ledger']=self.cache.set(
                     kind=f'{self.kind}__ledger',
                     id=self.id,
                     data=self._ledger
                 )
             if self._balance is not None:
-                self.cache.set(
+                self.cacheVersions['balance']=self.cache.set(
                     kind=f'{self.kind}__balance',
                     id=self.id,
                     data=self._balance
@@ -370,11 +469,25 @@ class Portfolio(object):
 
 
     def callRefreshData(self):
+        """
+        Get fresh data from original source and cache it.
+
+        Derived classes’ refreshData() may return False to tell their source
+        was not modified since it was cached. Then nothing is written and
+        cached data is used. Returns False if that cached data was also
+        already processed, True if it still needs processData().
+        """
         self.logger.info("Start retrieving data from original source")
         # Calls derived class refreshData() method
-        self.refreshData()
+        if self.refreshData() is False:
+            self.logger.info("Original source not modified, using cached data")
+            if self.tryProcessedCacheData():
+                return False
+            self.tryCacheData()
+            return True
         self.logger.info("Finished retrieving data from original source and writting cache with almost-raw refreshed data")
         self.cacheUpdate()
+        return True
 
 
 
@@ -443,6 +556,76 @@ class Portfolio(object):
 
 
 
+    def parseMonetary(column, decimal='.') -> pandas.Series:
+        """
+        Convert a column of monetary text as ‘$1,234.56’, ‘R$ 1.234,56’ or
+        ‘€12’ into floats in a single pass: currency symbols, blanks and
+        thousands separators are dropped and the decimal separator, as
+        informed in ‘decimal’, is made a dot, all by one str.translate().
+        Empty cells become NaN.
+
+        Columns that are already numeric are returned untouched.
+        """
+        if pandas.api.types.is_numeric_dtype(column):
+            return column
+
+        thousands=',' if decimal=='.' else '.'
+
+        table=str.maketrans(
+            {
+                **dict.fromkeys(Portfolio.currencySymbols + thousands),
+                decimal: '.'
+            }
+        )
+
+        return pandas.to_numeric(column.str.translate(table)).astype(float)
+
+
+
+    def typeRawData(table, monetary=[], decimal='.') -> pandas.DataFrame:
+        """
+        Best-effort typing of raw balance or ledger data right after it was
+        fetched and before it gets cached, so DataCache records proper dtypes
+        and warm starts don't have to parse strings again.
+
+        Column ‘time’ is converted to datetime and columns listed in
+        ‘monetary’ to numbers with parseMonetary(), but only if the whole
+        column converts cleanly to a single datetime64 dtype. A column that
+        mixes tz-aware and naive times would become objects that
+        processData() can’t parse again, so it is kept as original strings.
+        Anything else is left untouched for processData() to handle.
+        """
+        table=table.copy()
+
+        if 'time' in table.columns:
+            try:
+                with warnings.catch_warnings():
+                    # Mixed time zones warn now and raise ValueError in future
+                    # pandas; both end up keeping the original strings
+                    warnings.simplefilter('ignore', FutureWarning)
+
+                    parsed=pandas.to_datetime(
+                        table.time,
+                        format='mixed',
+                        yearfirst=True
+                    )
+
+                if pandas.api.types.is_datetime64_any_dtype(parsed):
+                    table['time']=parsed
+            except (ValueError, TypeError):
+                pass
+
+        for c in monetary:
+            if c in table.columns:
+                try:
+                    table[c]=Portfolio.parseMonetary(table[c], decimal)
+                except (ValueError, TypeError):
+                    pass
+
+        return table
+
+
+
     def normalizeTime(time, naiveTimeShift=12*3600) -> pandas.DataFrame:
         """
         Get a pandas.Series in ‘time’ and normalize it:
@@ -453,44 +636,16 @@ class Portfolio(object):
         4. De-duplicate timestamps using Portfolio.twoSeconds for small
            adjustments
 
-        Return a normalized pandas.Series ordered and indexed identical to
-        input.
+        Return a normalized pandas.Series with non-duplicate entries first
+        and adjusted duplicates last, both keeping the index of input.
+
+        All steps operate on whole columns. A column of mixed time zones
+        (object dtype) is split in groups of same time zone, each handled at
+        once.
 
         Derived classes must use this method to homogenize time handling
         across the fremework.
         """
-        def randomTimedeltas(index):
-            """
-            Return a vector of random pandas.Timedelta indexed by `index`.
-            """
-            vec=(
-                pandas.to_timedelta(
-                    # Create a long random vector by concatenating
-                    # Portfolio.twoSeconds multiple times
-                    pandas.concat(
-                        # How many times we need to duplicate
-                        # Portfolio.twoSeconds?
-                        max(2,int(
-                            numpy.ceil(
-                                len(index) /
-                                len(Portfolio.twoSeconds)
-                            )
-                        )) *
-                        [Portfolio.twoSeconds]
-                    )
-
-                    # Get a vector with precise size
-                    .head(len(index)),
-
-                    # This is in milliseconds
-                    unit='ms'
-                )
-            )
-
-            # Overwrite index
-            vec.index=index
-
-            return vec
 
         # Convert naiveTimeShift into something more useful
         timeShift=pandas.to_timedelta(naiveTimeShift, unit='s')
@@ -502,47 +657,60 @@ class Portfolio(object):
             .tzinfo
         )
 
-        instrumented=(
-            time
+        def homogeneous(time):
+            """
+            Normalize a Series of datetimes that share the same time zone, or
+            have none.
+            """
+            time=pandas.to_datetime(time)
 
             # Shift dates that have no time (time part is 00:00:00) to the
-            # middle of the day (12:00:00) using naiveTimeShift parameter
-            .apply(
-                lambda cell:
-                    pandas.Timestamp(cell+timeShift)
-                    if cell.time()==datetime.time(0)
-                    else pandas.Timestamp(cell)
-            )
+            # middle of the day (12:00:00) using naiveTimeShift parameter.
+            # Midnight is checked on wall time, because local midnight might
+            # not exist on DST transition days.
+            wall=time.dt.tz_localize(None) if time.dt.tz is not None else time
+            time=time.where(wall!=wall.dt.normalize(), time+timeShift)
 
-            # Convert all to current time zone, or simply add current time
-            # zone to TZ-naive entries.
-            .apply(
-                lambda cell:
-                    cell.tz_localize(currtz) # Set TZ on undefined cells
-                    if cell.tzinfo is None
-                    else cell.tz_convert(currtz) # Convert existing TZ
-            )
+            # Add current time zone to TZ-naive entries
+            if time.dt.tz is None:
+                time=time.dt.tz_localize(currtz)
 
             # Keep it internally as UTC for more precise and compatible
             # joins.
-            .dt
-            .tz_convert('UTC')
-        )
+            return time.dt.tz_convert('UTC')
+
+        if pandas.api.types.is_datetime64_any_dtype(time):
+            instrumented=homogeneous(time)
+        else:
+            instrumented=(
+                pandas.concat(
+                    [
+                        homogeneous(group)
+                        for zone,group in time.groupby(
+                            time.map(lambda cell: str(getattr(cell,'tzinfo',None))),
+                            sort=False
+                        )
+                    ]
+                )
+                .reindex(time.index)
+            )
 
         # Cirurgically adjust time adding a few random milliseconds only
-        # on duplicate items
+        # on duplicate items, cycling over Portfolio.twoSeconds
         dups=instrumented.duplicated()
-        duplicated=instrumented[dups]
 
-        instrumented=pandas.concat(
+        jitter=pandas.to_timedelta(
+            numpy.resize(Portfolio.twoSeconds.to_numpy(), dups.sum()),
+            unit='ms'
+        )
+
+        return pandas.concat(
             [
                 instrumented[~dups],
-                instrumented[dups]+randomTimedeltas(instrumented[dups].index)
+                instrumented[dups]+jitter.to_numpy()
             ]
         )
 
-        return instrumented
-
 
 
 
@@ -553,9 +721,24 @@ class PortfolioAggregator(Portfolio):
     Same concept as Portfolio, but can keep multiple sources of data.
     When data needs to be refreshed, this class will submit refresh signals to
     all its members.
+
+    Members are handled in parallel, by up to `workers` threads (default is
+    Python’s ThreadPoolExecutor default). Time spent by each member on each
+    dispatched method is kept in self.timings as:
+
+        dict(
+            refreshData = {'member repr': seconds, ...},
+            processData = {...},
+        )
     """
-    def __init__(self, cache=None, refresh=False):
+    def __init__(self, cache=None, refresh=False, workers=None):
         self.members=[]
+        self.workers=workers
+        self.timings=dict()
+
+        # Concatenated balance and ledger of members, as
+        # {prop: (tuple of member frames, concatenation)}
+        self.aggregated=dict()
 
         super().__init__(
             kind       = 'aggregator',
@@ -615,24 +798,66 @@ class PortfolioAggregator(Portfolio):
 
     @property
     def _balance(self):
-        return (
-            pandas.concat(
-                [p._balance for p in self.members if p.has_balance]
-            )
-            .reset_index(drop=True)
-        )
+        return self.aggregate('balance')
 
 
 
     @property
     def _ledger(self):
-        return (
-            pandas.concat(
-                [p._ledger for p in self.members if p.has_ledger]
-            )
-            .reset_index(drop=True)
+        return self.aggregate('ledger')
+
+
+
+    def aggregate(self, prop):
+        """
+        Return the concatenation of the ‘balance’ or ‘ledger’ frames (prop) of
+        all members that have it.
+
+        The concatenation is computed once and reused for as long as members
+        hold the very same frames. A member that refreshes or reprocesses its
+        data replaces its frame, and that invalidates it.
+
+        Categories of the ‘asset’ column are unified across members before
+        concatenation, so the result keeps a compact categorical column.
+        """
+        frames=tuple(
+            getattr(p,f'_{prop}')
+            for p in self.members
+            if getattr(p,f'has_{prop}')
         )
 
+        cached=self.aggregated.get(prop)
+        if (
+                cached is not None and
+                len(cached[0])==len(frames) and
+                all(a is b for a,b in zip(cached[0],frames))
+            ):
+            return cached[1]
+
+        present=[f for f in frames if f is not None]
+
+        if len(present)==0:
+            return None
+
+        if all('asset' in f.columns for f in present):
+            categories=pandas.api.types.union_categoricals(
+                [f.asset.astype('category') for f in present],
+                ignore_order=True
+            ).categories
+
+            present=[
+                f.assign(
+                    asset=f.asset.astype('category').cat.set_categories(categories)
+                )
+                for f in present
+            ]
+
+        aggregated=pandas.concat(present).reset_index(drop=True)
+
+        self.aggregated[prop]=(frames,aggregated)
+
+        return aggregated
+
 
 
     @property
@@ -642,22 +867,72 @@ class PortfolioAggregator(Portfolio):
 
 
     def tryCacheData(self):
-        self.submitToMembers('tryCacheData')
+        # True only if all members got their data from cache
+        return all(self.submitToMembers('tryCacheData').values())
 
 
 
-    def submitToMembers(self, method: str):
-        with concurrent.futures.ThreadPoolExecutor() as executor:
+    def submitToMembers(self, method: str, *args):
+        """
+        Call method on all members in parallel and return a dict of
+        {member: whatever method returned}.
+
+        All members run to completion even if some fail. Then, if any failed,
+        an Exception listing all failures is raised, chained to the first
+        one.
+
+        Elapsed time of each member is logged and kept in
+        self.timings[method].
+        """
+        elapsed={}
+
+        def timed(member):
+            start=time.perf_counter()
+            try:
+                return getattr(member,method)(*args)
+            finally:
+                elapsed[member]=time.perf_counter()-start
+
+        results={}
+        errors={}
+
+        with concurrent.futures.ThreadPoolExecutor(
+                    max_workers        = self.workers,
+                    thread_name_prefix = 'aggregator'
+                ) as executor:
             tasks={}
             for p in self.members:
-                m = getattr(p,method)
-                task[executor.submit(m)] = p
+                tasks[executor.submit(timed, p)] = p
 
             for task in concurrent.futures.as_completed(tasks):
-                self.debug(f'Done {tasks[task]}')
+                member=tasks[task]
+
+                try:
+                    # The return of submited method (processData) or the raise of error
+                    results[member]=task.result()
+                except Exception as e:
+                    self.logger.error(f'{method}() failed on {member!r}: {e!r}')
+                    errors[member]=e
+                else:
+                    self.logger.debug(f'Done {method}() on {member!r} in {elapsed[member]:.3f}s')
+
+        self.timings[method]={
+            repr(member): elapsed[member]
+            for member in self.members
+            if member in elapsed
+        }
+
+        if len(errors)>0:
+            raise Exception(
+                '{method}() failed on {n} of {total} members: {which}'.format(
+                    method = method,
+                    n      = len(errors),
+                    total  = len(self.members),
+                    which  = '; '.join([f'{m!r}: {e!r}' for m,e in errors.items()])
+                )
+            ) from next(iter(errors.values()))
 
-                # The return of submited method (processData) or the raise of error
-                task.result()
+        return results
 
 
 
@@ -1,14 +1,16 @@
 import os
+import re
+import json
+import hashlib
 import importlib
 import datetime
 import pathlib
 import logging
-import concurrent.futures
+import threading
 import yaml
 import pandas
-import numpy
 
-# python3 -m pip install -U google-api-python-client google-auth-httplib2 google-auth-oauthlib pandas_datareader --user
+# python3 -m pip install -U google-api-python-client google-auth-httplib2 google-auth-oauthlib --user
 
 from googleapiclient.discovery import build
 from google_auth_oauthlib.flow import InstalledAppFlow
@@ -60,6 +62,10 @@ class GoogleSheetsBalanceAndLedger(Portfolio):
                             - currency:     USD
                               name:         Balance USD
 
+                # Rows are only ever appended to the end of sheets, so pull
+                # just the new ones on refresh
+                incremental: true
+
                 ledger:
                     # The sheet/tab with all your in and out movements (ledger)
                     sheetRange: Ledger!A:E
@@ -78,6 +84,15 @@ class GoogleSheetsBalanceAndLedger(Portfolio):
 
     SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly']
 
+    # Sheets API service objects are expensive to build, so they are shared
+    # by all objects of the process as {(sheetID, account): service}
+    services = dict()
+    servicesLock = threading.Lock()
+
+    # Number of last rows whose hash is kept in the watermark of incremental
+    # mode, and pulled again to check nothing changed before them
+    watermarkTail = 10
+
     def showme():
         return pathlib.Path(importlib.util.find_spec('investorzilla').submodule_search_locations[0]) / pathlib.Path('portfolios/app-credentials-for-google-sheets.json')
 
@@ -87,6 +102,13 @@ class GoogleSheetsBalanceAndLedger(Portfolio):
 
         self._balance = None
         self._ledger = None
+
+        # Watermarks of the data just pulled, saved to cache along with it
+        self.watermarks = dict()
+
+        # Number of rows appended to cached data by incremental refreshes
+        self.appended = dict()
+
         self.gAppCredentialsFile = (
             pathlib.Path(importlib.util.find_spec('investorzilla').submodule_search_locations[0]) /
             pathlib.Path('portfolios/app-credentials-for-google-sheets.json')
@@ -123,6 +145,25 @@ class GoogleSheetsBalanceAndLedger(Portfolio):
 
 
     def refreshData(self):
+        """
+        Pull ledger and balance from Google Sheets.
+
+        In incremental mode (sheetStructure has ‘incremental: true’), a
+        watermark with the number of rows, the header and a hash of the last
+        rows is kept in cache for each sheet. Next refreshes pull just the
+        header and the rows after the watermark, plus the last rows again,
+        to verify the hash. New rows are appended to the cached data. If
+        the header or those last rows changed, the whole sheet is pulled.
+        Edits to rows older than that go unnoticed, so use incremental mode
+        only on sheets that are really append-only.
+
+        Only the new rows are written to the database if DataCache is in
+        delta mode (cache_options: delta: true in the YAML config file). In
+        its default table storage every version is a full copy, so the
+        whole sheet is written again even if only its new rows were pulled.
+
+        Returns False if no sheet had new rows.
+        """
         gAccountCredFileName='google-account-credentials.yaml'
         self.creds = None
 
@@ -158,32 +199,76 @@ class GoogleSheetsBalanceAndLedger(Portfolio):
 
         self.logger.debug(self.creds)
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-            if 'ledger' in self.sheetStructure:
-                ledgerThread=executor.submit(
-                    self.getMonetarySheet,
-                    **dict(
-                        sheetID            = self.sheetStructure['sheet'],
-                        sheetRange         = self.sheetStructure['ledger']['sheetRange'],
-                        columnsProfile     = self.sheetStructure['ledger']['columns']
-                    )
+        props=[p for p in ['ledger','balance'] if p in self.sheetStructure]
+
+        self.watermarks=dict()
+        self.appended=dict()
+
+        if self.sheetStructure.get('incremental', False):
+            (props,modified)=self.refreshIncremental(props)
+
+            if len(props)==0 and modified is False:
+                self.logger.info('No new rows since last refresh')
+                return False
+
+        # Get all ranges in a single request
+        sheets=self.getGoogleSheetValues(
+            self.sheetStructure['sheet'],
+            [self.sheetStructure[p]['sheetRange'] for p in props]
+        )
+
+        for prop,values in zip(props,sheets):
+            setattr(
+                self,
+                f'_{prop}',
+                self.renameMonetarySheet(
+                    self.valuesToDataFrame(values),
+                    self.sheetStructure[prop]['columns']
                 )
+            )
 
-            if 'balance' in self.sheetStructure:
-                balanceThread=executor.submit(
-                    self.getMonetarySheet,
-                    **dict(
-                        sheetID            = self.sheetStructure['sheet'],
-                        sheetRange         = self.sheetStructure['balance']['sheetRange'],
-                        columnsProfile     = self.sheetStructure['balance']['columns']
-                    )
+            if values:
+                self.watermarks[prop]=dict(
+                    rows   = len(values)-1,
+                    header = values[0],
+                    tail   = self.hashRows(values[1:][-self.watermarkTail:])
                 )
 
-            if 'ledger' in self.sheetStructure:
-                self._ledger=ledgerThread.result()
 
-            if 'balance' in self.sheetStructure:
-                self._balance=balanceThread.result()
+
+    def cacheUpdate(self):
+        """
+        Set new data to DataCache along with watermarks of incremental mode.
+        Sheets that got rows appended by refreshIncremental() are written with
+        DataCache.append().
+        """
+        if self.cache is not None:
+            for prop in ['ledger','balance']:
+                data=getattr(self,f'_{prop}')
+
+                if data is None:
+                    continue
+
+                if prop in self.appended:
+                    self.cacheVersions[prop]=self.cache.append(
+                        kind     = f'{self.kind}__{prop}',
+                        id       = self.id,
+                        data     = data,
+                        appended = self.appended[prop]
+                    )
+                else:
+                    self.cacheVersions[prop]=self.cache.set(
+                        kind     = f'{self.kind}__{prop}',
+                        id       = self.id,
+                        data     = data
+                    )
+
+            for prop,watermark in self.watermarks.items():
+                self.cache.setAttributes(
+                    kind      = f'{self.kind}__{prop}',
+                    id        = self.id,
+                    watermark = watermark
+                )
 
 
 
@@ -251,20 +336,212 @@ class GoogleSheetsBalanceAndLedger(Portfolio):
         )
 
         # Handle monetary columns, remove currency symbols and make them numbers
-        remove=['R$ ','$','€',',']
         for c in columnsProfile['monetary']:
-            if sheet[c['currency']].dtype==numpy.dtype('O'):
-                ## Remove currency symbols and junk
-                for r in remove:
-                    sheet[c['currency']]=sheet[c['currency']].str.replace(r, '', regex=False)
+            sheet[c['currency']]=Portfolio.parseMonetary(
+                sheet[c['currency']],
+                self.sheetStructure.get('decimal','.')
+            )
 
-                ## Make NaNs of empty ('') cells
-                sheet[c['currency']]=sheet[c['currency']].str.replace(r'^\s*$','', regex=True)
+        setattr(self,f'_{prop}',sheet)
 
-                ## Convert to number
-                sheet[c['currency']]=pandas.to_numeric(sheet[c['currency']]) #.astype(float)
 
-        setattr(self,f'_{prop}',sheet)
+
+    def getService(self):
+        """
+        Return a Sheets API service object for the credentials of our sheet,
+        built once and shared.
+        """
+        sheetID=self.sheetStructure['sheet']
+        creds=self.creds[sheetID]
+
+        # Credentials are loaded again from file on every refresh, so tell
+        # accounts apart by what is stable in them, not by object identity
+        key=(
+            sheetID,
+            getattr(creds,'client_id',None),
+            getattr(creds,'refresh_token',None),
+        )
+
+        with GoogleSheetsBalanceAndLedger.servicesLock:
+            service=GoogleSheetsBalanceAndLedger.services.get(key)
+
+            if service is None:
+                self.logger.debug(f'Building Google Sheets service for {sheetID}')
+                service=build('sheets', 'v4', credentials=creds, cache_discovery=False)
+                GoogleSheetsBalanceAndLedger.services[key]=service
+
+        return service
+
+
+
+    def refreshIncremental(self, props):
+        """
+        Pull rows appended to the sheets of props after their watermarks, in a
+        single request, and set self._ledger or self._balance to their cached
+        data plus the new rows.
+
+        Returns a tuple with the list of props that need a full pull, because
+        they have no watermark or rows before it changed, and a bool telling
+        if any new rows were found.
+        """
+        if self.cache is None:
+            return (props,True)
+
+        plans=dict()
+        for prop in props:
+            kind=f'{self.kind}__{prop}'
+
+            watermark=self.cache.getAttributes(kind=kind, id=self.id).get('watermark')
+
+            if watermark is None or self.cache.current(kind=kind, id=self.id) is None:
+                continue
+
+            ranges=self.watermarkRanges(self.sheetStructure[prop]['sheetRange'], watermark)
+
+            if ranges is not None:
+                plans[prop]=(watermark,ranges)
+
+        full=[p for p in props if p not in plans]
+        modified=len(full)>0
+
+        if len(plans)==0:
+            return (full,modified)
+
+        values=self.getGoogleSheetValues(
+            self.sheetStructure['sheet'],
+            [r for prop in plans for r in plans[prop][1]]
+        )
+
+        for i,(prop,(watermark,ranges)) in enumerate(plans.items()):
+            header=values[2*i]
+            window=values[2*i+1]
+            overlap=min(self.watermarkTail,watermark['rows'])
+
+            if (
+                    header[:1]!=[watermark['header']] or
+                    self.hashRows(window[:overlap])!=watermark['tail']
+                ):
+                self.logger.info(f'Rows of {prop} before watermark changed, pulling it all')
+                full.append(prop)
+                continue
+
+            new=window[overlap:]
+
+            (cached,age)=self.cache.get(kind=f'{self.kind}__{prop}', id=self.id)
+
+            if cached is None:
+                full.append(prop)
+                continue
+
+            if len(new)>0:
+                self.logger.info(f'Appending {len(new)} new rows to {prop}')
+
+                try:
+                    rows=(
+                        self.renameMonetarySheet(
+                            self.valuesToDataFrame([watermark['header']] + new),
+                            self.sheetStructure[prop]['columns']
+                        )
+
+                        # Make new rows look like the cached ones
+                        [cached.columns]
+                        .astype(cached.dtypes.to_dict())
+                    )
+                except (KeyError, ValueError, TypeError) as e:
+                    self.logger.info(f'New rows of {prop} don’t match cached ones ({e}), pulling it all')
+                    full.append(prop)
+                    continue
+
+                cached=pandas.concat([cached,rows], ignore_index=True)
+                modified=True
+
+            setattr(self,f'_{prop}',cached)
+            self.appended[prop]=len(new)
+
+            self.watermarks[prop]=dict(
+                rows   = watermark['rows']+len(new),
+                header = watermark['header'],
+                tail   = self.hashRows((window[:overlap]+new)[-self.watermarkTail:])
+            )
+
+        return (full,modified)
+
+
+
+    def watermarkRanges(self, sheetRange, watermark):
+        """
+        Given a sheetRange as 'Ledger!A:E' or 'Ledger!A3:E', return the
+        ranges of its header row and of the rows from the watermark’s tail
+        on, or None for ranges that can’t be handled incrementally, as the
+        ones with an end row.
+        """
+        m=re.fullmatch(
+            r'(?:(?P<sheet>.+)!)?\$?(?P<first>[A-Za-z]+)\$?(?P<row>\d*):\$?(?P<last>[A-Za-z]+)',
+            sheetRange
+        )
+
+        if m is None:
+            return None
+
+        prefix=f"{m['sheet']}!" if m['sheet'] else ''
+        headerRow=int(m['row']) if m['row'] else 1
+        tailRow=headerRow + 1 + watermark['rows'] - min(self.watermarkTail,watermark['rows'])
+
+        return [
+            f"{prefix}{m['first']}{headerRow}:{m['last']}{headerRow}",
+            f"{prefix}{m['first']}{tailRow}:{m['last']}",
+        ]
+
+
+
+    def hashRows(self, rows):
+        """
+        Hash of a list of rows as returned by the Sheets API
+        """
+        return hashlib.sha256(json.dumps(rows).encode()).hexdigest()
+
+
+
+    def getGoogleSheetValues(self, SPREADSHEET_ID, ranges):
+        """
+        Pull raw values of multiple cell ranges from a Google Sheet in a single
+        batchGet request. Return a list with a list of rows for each range, in
+        the same order as ranges.
+        """
+        if len(ranges)==0:
+            return []
+
+        result = (
+            self.getService()
+            .spreadsheets()
+            .values()
+            .batchGet(
+                spreadsheetId=SPREADSHEET_ID,
+                ranges=ranges
+            )
+            .execute()
+        )
+
+        return [
+            valueRange.get('values', [])
+            for valueRange in result.get('valueRanges', [])
+        ]
+
+
+
+    def getGoogleSheetRanges(self, SPREADSHEET_ID, ranges):
+        """
+        Pull raw data of multiple cell ranges from a Google Sheet in a single
+        batchGet request. Return a list of DataFrames (or None for empty
+        ranges) in the same order as ranges.
+
+        SPREADSHEET_ID is something like '1iBlzY...wuY_b...so'
+        ranges is a list like ['Balances!A:D', 'Ledger!A:E']
+        """
+        return [
+            self.valuesToDataFrame(values)
+            for values in self.getGoogleSheetValues(SPREADSHEET_ID, ranges)
+        ]
 
 
 
@@ -275,23 +552,17 @@ class GoogleSheetsBalanceAndLedger(Portfolio):
         SPREADSHEET_ID is something like '1iBlzY...wuY_b...so'
         DATA_TO_PULL is like 'Balances!A:D'
         """
-        service = build('sheets', 'v4', credentials=self.creds[self.sheetStructure['sheet']])
-        sheet = service.spreadsheets()
-        result = sheet.values().get(
-            spreadsheetId=SPREADSHEET_ID,
-            range=DATA_TO_PULL
-        ).execute()
-        values = result.get('values', [])
-
-        if not values:
-            return None
+        return self.getGoogleSheetRanges(SPREADSHEET_ID, [DATA_TO_PULL])[0]
 
-        rows = sheet.values().get(
-            spreadsheetId=SPREADSHEET_ID,
-            range=DATA_TO_PULL
-        ).execute()
 
-        data = rows.get('values')
+
+    def valuesToDataFrame(self, data):
+        """
+        Make a DataFrame of the values of a range as returned by the Sheets
+        API, or None if it is empty.
+        """
+        if not data:
+            return None
 
         # The data is a list of lists, having column names in the first row.
         # Sometimes it has more column names than data, so each data row might be smaller
@@ -337,8 +608,18 @@ class GoogleSheetsBalanceAndLedger(Portfolio):
                 - currency:     USD
                   name:         Balance USD
         """
-        sheet=self.getGoogleSheetRange(sheetID,sheetRange)
+        return self.renameMonetarySheet(
+            self.getGoogleSheetRange(sheetID,sheetRange),
+            columnsProfile
+        )
 
+
+
+    def renameMonetarySheet(self, sheet, columnsProfile):
+        """
+        Rename columns of a sheet following spec on columnsProfile, as
+        described in getMonetarySheet(), and type its data.
+        """
         # Normalize all columns names
         renamer={m['name']: m['currency'] for m in columnsProfile['monetary']}
         renamer.update(
@@ -348,7 +629,13 @@ class GoogleSheetsBalanceAndLedger(Portfolio):
             }
         )
 
-        return sheet.rename(columns=renamer)
+        return Portfolio.typeRawData(
+            sheet.rename(columns=renamer),
+
+            # Parse times and numbers before caching
+            [m['currency'] for m in columnsProfile['monetary']],
+            self.sheetStructure.get('decimal','.')
+        )
 
 
 
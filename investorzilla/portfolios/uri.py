@@ -1,8 +1,12 @@
 import pathlib
-import numpy
+import tempfile
+import importlib.util
+import urllib.parse
+import urllib.request
 import pandas
 
 from .. import Portfolio
+from ..httpclient import HTTPClient
 
 
 class URIBalanceOrLedger(Portfolio):
@@ -26,6 +30,13 @@ class URIBalanceOrLedger(Portfolio):
             kind: traderbot_balance
             sheetStructure:
                 separator: "|"
+
+                # Read and cache huge files in chunks of this many rows
+                # chunksize: 1000000
+
+                # Decimal separator of monetary columns, if not a dot
+                # decimal: ","
+
                 # In here you describe how the BALANCE and LEDGER data is
                 # organized in sheets and columns
                 balance:
@@ -61,6 +72,13 @@ class URIBalanceOrLedger(Portfolio):
         self._balance = None
         self._ledger = None
 
+        # Validators of the last data read from URI, saved to cache along
+        # with it
+        self.validators = None
+
+        # Data was written to cache while read, in chunks
+        self.streamed = False
+
         super().__init__(
             kind       = f'uri•{kind}',
             id         = str(self.URI),   # extract just full name from Path object
@@ -91,6 +109,17 @@ class URIBalanceOrLedger(Portfolio):
 
 
 
+    @property
+    def prop(self):
+        if self.has_balance:
+            return 'balance'
+        elif self.has_ledger:
+            return 'ledger'
+        else:
+            raise NameError('Either balance or ledger sheet structure must be defined.')
+
+
+
     def refreshData(self):
         """
         Force data refresh from source URL and return a DataFrame which columns
@@ -98,13 +127,30 @@ class URIBalanceOrLedger(Portfolio):
         needs to be processed by self.processData().
 
         The internal variables _balance or _ledger will be updated.
+
+        Returns False, and reads nothing, if URI was not modified since its
+        data was cached, as told by ETag or Last-Modified HTTP headers, for
+        remote URLs, or by modification time and size, for local files.
+
+        If sheetStructure has a chunksize, URI is read in chunks of that many
+        rows by Pandas’ default engine, because PyArrow’s can’t read in
+        chunks. Each chunk is pruned and typed as soon as it is read, so raw
+        text of the whole file is never in memory. Memory is not bounded by
+        chunk size though: all typed data is still kept, joined one column at
+        a time into a single DataFrame, and processed as a whole by
+        processData(). Peak memory is about the size of the typed data plus
+        its largest column. DataCache.setChunks() stages chunks on local
+        disk and writes them to the database only if they changed.
         """
-        if self.has_balance:
-            prop='balance'
-        elif self.has_ledger:
-            prop='ledger'
-        else:
-            raise NameError('Either balance or ledger sheet structure must be defined.')
+        prop=self.prop
+
+        self.streamed=False
+
+        source=self.fetch()
+
+        if source is None:
+            self.logger.info(f'{self.URI} not modified since it was cached')
+            return False
 
         columnsProfile=self.sheetStructure[prop]['columns']
 
@@ -117,27 +163,85 @@ class URIBalanceOrLedger(Portfolio):
             }
         )
 
-        df=(
-            pandas.read_csv(
-                filepath_or_buffer = self.URI,
-                sep = (
-                    self.sheetStructure['separator']
-                    if 'separator' in self.sheetStructure
-                    else ','
+        order=(
+            [k for k in columnsProfile.keys() if k!='monetary'] +
+            [m['currency'] for m in columnsProfile['monetary']]
+        )
+
+        def clean(table):
+            return (
+                table
+                .rename(columns=renamer)
+
+                # Same column order whatever the CSV engine: metadata first,
+                # then monetary
+                .pipe(
+                    lambda table: table[
+                        [c for c in order if c in table.columns]
+                    ]
                 )
-            )
-            .rename(columns=renamer)
-            .pipe(
-                lambda table: table.drop(
-                    # Drop all columns that doesn't matter
-                    columns=list(
-                        set(table.columns) -
-                        set(list(renamer.values()))
-                    )
+
+                # Parse times and numbers before caching
+                .pipe(
+                    Portfolio.typeRawData,
+                    [m['currency'] for m in columnsProfile['monetary']],
+                    self.sheetStructure.get('decimal','.')
                 )
             )
+
+        data=self.readCSV(
+            source    = source,
+            columns   = list(renamer.keys()),
+
+            # Declare types up front, so nothing is inferred
+            dtype     = {
+                columnsProfile['asset']: 'category',
+                **{
+                    columnsProfile[c]: 'string'
+                    for c in ['comment'] if c in columnsProfile
+                },
+                **{m['name']: 'string' for m in columnsProfile['monetary']}
+            },
+
+            chunksize = self.sheetStructure.get('chunksize'),
+
+            # Fetched content has no name, so tell its compression from URI
+            compression = pandas.io.common.infer_compression(
+                urllib.parse.urlparse(str(self.URI)).path,
+                'infer'
+            )
         )
 
+        if isinstance(data, pandas.DataFrame):
+            df=clean(data)
+        else:
+            # Typed chunks are kept column by column, not as DataFrames, so
+            # each column can be joined and released before the next one
+            columns=dict()
+
+            def stream():
+                for chunk in data:
+                    chunk=clean(chunk)
+                    for c in chunk.columns:
+                        columns.setdefault(c,[]).append(chunk[c].copy())
+                    yield chunk
+
+            if self.cache is not None:
+                self.cacheVersions[prop]=self.cache.set(
+                    kind = f'{self.kind}__{prop}',
+                    id   = self.id,
+                    data = stream()
+                )
+                self.streamed=True
+            else:
+                for chunk in stream():
+                    pass
+
+            df=pandas.DataFrame(
+                {c: URIBalanceOrLedger.join(columns.pop(c)) for c in list(columns)},
+                copy=False
+            )
+
         setattr(self,f'_{prop}',df)
 
         return getattr(self,f'_{prop}')
@@ -158,6 +262,158 @@ class URIBalanceOrLedger(Portfolio):
     ##
     ############################################################################
 
+    def cacheUpdate(self):
+        """
+        Set new data to DataCache along with the validators of its source
+        """
+        if self.streamed is False:
+            super().cacheUpdate()
+
+        if self.cache is not None and self.validators:
+            self.cache.setAttributes(
+                kind       = f'{self.kind}__{self.prop}',
+                id         = self.id,
+                validators = self.validators
+            )
+
+
+
+    def fetch(self):
+        """
+        Return something that pandas.read_csv() can read with content of URI,
+        or None if URI was not modified since its data was cached.
+
+        Local files are compared by modification time and size. HTTP(S) URLs
+        are requested through HTTPClient, with its timeouts, with
+        If-None-Match and If-Modified-Since headers, and their content is
+        returned in a temporary file, kept in memory only if small. Other
+        URIs are returned as is and always read.
+        """
+        self.validators=None
+
+        previous=dict()
+        if (
+                self.cache is not None and
+                self.cache.current(kind=f'{self.kind}__{self.prop}', id=self.id) is not None
+            ):
+            previous=self.cache.getAttributes(
+                kind = f'{self.kind}__{self.prop}',
+                id   = self.id
+            ).get('validators', dict())
+
+        uri=urllib.parse.urlparse(str(self.URI))
+
+        if uri.scheme in ('','file'):
+            path=(
+                pathlib.Path(urllib.request.url2pathname(uri.path))
+                if uri.scheme=='file'
+                else pathlib.Path(self.URI)
+            )
+
+            stat=path.stat()
+
+            self.validators=dict(
+                mtime = stat.st_mtime_ns,
+                size  = stat.st_size
+            )
+
+            if previous==self.validators:
+                return None
+
+            return path
+
+        if uri.scheme in ('http','https'):
+            headers=dict()
+            if 'etag' in previous:
+                headers['If-None-Match']=previous['etag']
+            if 'last_modified' in previous:
+                headers['If-Modified-Since']=previous['last_modified']
+
+            response=HTTPClient.get(str(self.URI), headers=headers, stream=True)
+
+            with response:
+                if response.status_code==304:
+                    return None
+
+                self.validators={
+                    key: response.headers[header]
+                    for key,header in [('etag','ETag'),('last_modified','Last-Modified')]
+                    if response.headers.get(header)
+                }
+
+                content=tempfile.SpooledTemporaryFile(max_size=64*1024*1024)
+                for block in response.iter_content(1024*1024):
+                    content.write(block)
+                content.seek(0)
+
+                return content
+
+        return self.URI
+
+
+
+    def join(parts):
+        """
+        Concatenate parts, the Series of one column read in chunks. Chunks
+        might have different categories, so categorical ones are united.
+        """
+        if all(isinstance(p.dtype, pandas.CategoricalDtype) for p in parts):
+            return pandas.Series(
+                pandas.api.types.union_categoricals(parts, sort_categories=True),
+                name=parts[0].name
+            )
+
+        return pandas.concat(parts, ignore_index=True)
+
+
+
+    def readCSV(self, source, columns, dtype, chunksize=None, compression='infer'):
+        """
+        Read source, but only the columns we need and with the types
+        declared in dtype.
+
+        Uses the multithreaded PyArrow CSV engine if pyarrow is installed.
+        Falls back to Pandas’ default engine if it isn’t, or if PyArrow can’t
+        handle the file, as when some column in sheetStructure is missing.
+
+        With a chunksize, returns an iterator of DataFrames of that many rows,
+        read by Pandas’ default engine because PyArrow’s can’t do it.
+        """
+        options=dict(
+            filepath_or_buffer = source,
+            sep                = self.sheetStructure.get('separator', ','),
+            dtype              = dtype,
+            compression        = compression,
+        )
+
+        if chunksize:
+            return pandas.read_csv(
+                usecols   = lambda column: column in columns,
+                chunksize = chunksize,
+                **options
+            )
+
+        if importlib.util.find_spec('pyarrow') is not None:
+            try:
+                return pandas.read_csv(
+                    engine  = 'pyarrow',
+                    usecols = columns,
+                    **options
+                )
+            except Exception as e:
+                self.logger.debug(f'PyArrow engine can’t read {self.URI}: {e}')
+
+                if hasattr(source, 'seek'):
+                    source.seek(0)
+
+        return pandas.read_csv(
+            # Silently skip columns of sheetStructure missing from file
+            usecols = lambda column: column in columns,
+            **options
+        )
+
+
+
     def processSheetData(self, prop):
         def ddebug(table):
             self.logger.debug(table)
@@ -205,18 +461,11 @@ class URIBalanceOrLedger(Portfolio):
         )
 
         # Handle monetary columns, remove currency symbols and make them numbers
-        remove=['R$ ','R$','$','€',',']
         for c in columnsProfile['monetary']:
-            if sheet[c['currency']].dtype==numpy.dtype('O'):
-                ## Remove currency symbols and junk
-                for r in remove:
-                    sheet[c['currency']]=sheet[c['currency']].str.replace(r, '', regex=False)
-
-                ## Make NaNs of empty ('') cells
-                sheet[c['currency']]=sheet[c['currency']].str.replace(r'^\s*$','', regex=True)
-
-                ## Convert to number
-                sheet[c['currency']]=pandas.to_numeric(sheet[c['currency']]) #.astype(float)
+            sheet[c['currency']]=Portfolio.parseMonetary(
+                sheet[c['currency']],
+                self.sheetStructure.get('decimal','.')
+            )
 
         setattr(self,f'_{prop}',sheet)
 
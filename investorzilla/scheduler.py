@@ -0,0 +1,299 @@
+import time
+import logging
+import threading
+import concurrent.futures
+
+
+
+class TaskGraph(object):
+    """
+    A tiny dependency-aware task runner on top of a ThreadPoolExecutor.
+
+    Tasks are named and declare which other tasks they must run after. Each
+    task is started as soon as all its dependencies finished, so independent
+    chains of work overlap and the total time is bound by the slowest chain,
+    not by the sum of stages.
+
+        graph=TaskGraph(prefix='load')
+        graph.add('usd', BCBCurrencyConverter, currencyFrom='USD', currencyTo='BRL')
+        graph.add('eur', BCBCurrencyConverter, currencyFrom='EUR', currencyTo='BRL')
+        graph.add('exchange', buildExchange, after=['usd','eur'])
+        results=graph.run()
+
+    A task that fails makes all tasks that depend on it, directly or not, to be
+    skipped. Everything else still runs and, at the end, run() raises the
+    first error. Elapsed time of each task is kept in self.timings.
+    """
+
+    def __init__(self, workers=None, prefix='taskgraph'):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.workers = workers
+        self.prefix  = prefix
+
+        # {name: (function, args, kwargs, set of dependencies)}
+        self.tasks   = dict()
+
+        self.results = dict()
+        self.errors  = dict()
+        self.skipped = set()
+        self.timings = dict()
+
+
+
+    def add(self, name, function, /, *args, after=[], **kwargs):
+        """
+        Add task name that will call function(*args, **kwargs) after all tasks
+        in ‘after’ finished. Returns name, so it can be used in other tasks’
+        ‘after’.
+        """
+        if name in self.tasks:
+            raise NameError(f'Task {name} already defined')
+
+        self.tasks[name]=(function, args, kwargs, set(after))
+
+        return name
+
+
+
+    def run(self):
+        """
+        Run all tasks respecting their dependencies and return a dict of
+        {name: whatever its function returned}.
+        """
+        for name,(function, args, kwargs, after) in self.tasks.items():
+            unknown=after-set(self.tasks)
+            if unknown:
+                raise NameError(f'Task {name} depends on undefined tasks {unknown}')
+
+        pending=set(self.tasks)-set(self.results)
+        running=dict()
+
+        def timed(name):
+            (function, args, kwargs, after)=self.tasks[name]
+            start=time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.timings[name]=time.perf_counter()-start
+
+        with concurrent.futures.ThreadPoolExecutor(
+                    max_workers        = self.workers,
+                    thread_name_prefix = self.prefix
+                ) as executor:
+            while pending or running:
+                # Skip tasks that depend on failed or skipped ones
+                for name in sorted(pending):
+                    if self.tasks[name][3] & (set(self.errors) | self.skipped):
+                        self.logger.warning(f'Skipping {name} because a task it depends on failed')
+                        self.skipped.add(name)
+                        pending.discard(name)
+
+                # Start tasks whose dependencies are all done
+                for name in sorted(pending):
+                    if self.tasks[name][3] <= set(self.results):
+                        running[executor.submit(timed, name)]=name
+                        pending.discard(name)
+
+                if not running:
+                    # Nothing can run anymore
+                    break
+
+                done,_=concurrent.futures.wait(
+                    running,
+                    return_when=concurrent.futures.FIRST_COMPLETED
+                )
+
+                for future in done:
+                    name=running.pop(future)
+
+                    try:
+                        self.results[name]=future.result()
+                        self.logger.debug(f'Done {name} in {self.timings[name]:.3f}s')
+                    except Exception as e:
+                        self.logger.error(f'Task {name} failed after {self.timings.get(name,0):.3f}s: {e!r}')
+                        self.errors[name]=e
+
+        if self.errors:
+            raise next(iter(self.errors.values()))
+
+        return self.results
+
+
+
+class SourceRunner(object):
+    """
+    Runs loaders of data sources (portfolio parts, currency converters,
+    benchmarks) under per-provider policies, so one slow or flaky provider
+    can’t hold the whole startup nor get hammered with parallel requests.
+
+    A provider is usually the name of the class that implements the source, as
+    BCBMarketIndex or AlphaVantageMarketIndex. Its policy is a dict with:
+
+    - concurrency: maximum number of its sources loading at the same time
+    - timeout: seconds to wait for one attempt to finish, or None to wait
+      forever
+    - retries: how many times to try again after an attempt that raised
+    - backoff: seconds to wait before first retry, doubled on each retry
+
+    Policies not set for a provider are taken from the 'default' one, which in
+    turn defaults to self.defaultPolicy.
+
+    An attempt that times out is not retried. Its thread can’t be stopped and
+    keeps running, so it also keeps its provider slot until it finishes,
+    and concurrency is never exceeded.
+
+    A loader that still fails after all retries can have a fallback, which
+    is usually the same source loaded from cache, without refresh. It is
+    bound by the same timeout. Outcome
+    and timing of each source is kept in self.metrics.
+    """
+
+    defaultPolicy = dict(
+        concurrency = 4,
+        timeout     = None,
+        retries     = 2,
+        backoff     = 1,
+    )
+
+
+
+    def __init__(self, policies=dict()):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.policies   = policies or dict()
+        self.semaphores = dict()
+        self.lock       = threading.Lock()
+        self.metrics    = dict()
+
+
+
+    def policy(self, provider):
+        """
+        Effective policy for provider.
+        """
+        policy=self.defaultPolicy.copy()
+        policy.update(self.policies.get('default',dict()))
+        policy.update(self.policies.get(provider,dict()))
+
+        return policy
+
+
+
+    def semaphore(self, provider):
+        with self.lock:
+            if provider not in self.semaphores:
+                self.semaphores[provider]=threading.BoundedSemaphore(
+                    self.policy(provider)['concurrency']
+                )
+
+            return self.semaphores[provider]
+
+
+
+    def attempt(self, function, args, kwargs, timeout, abandoned=None):
+        """
+        Run function in its own daemon thread and wait up to timeout seconds
+        for it. A thread that times out can’t be killed, so it is abandoned and
+        its result, if any, discarded. abandoned(), if given, is called when
+        such thread finally finishes.
+        """
+        future=concurrent.futures.Future()
+
+        def target():
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(function(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+
+        threading.Thread(target=target, name=f'source_{id(future)}', daemon=True).start()
+
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            if abandoned is not None:
+                future.add_done_callback(lambda future: abandoned())
+            raise
+
+
+
+    def run(self, provider, label, function, /, *args, fallback=None, **kwargs):
+        """
+        Call function(*args, **kwargs) under provider’s policy and return its
+        result. If all attempts fail and a fallback is given, return
+        fallback() instead. label identifies this source in self.metrics and
+        logs.
+        """
+        policy=self.policy(provider)
+
+        metric=dict(
+            provider = provider,
+            attempts = 0,
+            outcome  = None,
+            error    = None,
+            elapsed  = None,
+        )
+        self.metrics[label]=metric
+
+        start=time.perf_counter()
+
+        semaphore=self.semaphore(provider)
+        semaphore.acquire()
+
+        # Whether we still hold the provider slot or passed it to an abandoned
+        # attempt
+        holding=True
+
+        try:
+            try:
+                for attempt in range(policy['retries']+1):
+                    if attempt>0:
+                        delay=policy['backoff'] * 2**(attempt-1)
+                        self.logger.warning(
+                            f'Retrying {label} in {delay}s after attempt {attempt} failed: {metric["error"]}'
+                        )
+                        time.sleep(delay)
+
+                    metric['attempts']=attempt+1
+
+                    try:
+                        result=self.attempt(
+                            function, args, kwargs, policy['timeout'],
+                            abandoned=semaphore.release
+                        )
+                        metric['outcome']='ok' if attempt==0 else 'retried'
+                        return result
+                    except concurrent.futures.TimeoutError:
+                        # The attempt still runs and will release the slot
+                        holding=False
+                        metric['error']=f'timed out after {policy["timeout"]}s'
+                        break
+                    except Exception as e:
+                        metric['error']=repr(e)
+                        error=e
+            finally:
+                if holding:
+                    semaphore.release()
+
+            metric['outcome']='failed'
+
+            if fallback is not None:
+                self.logger.warning(f'Using cached data for {label} because it failed: {metric["error"]}')
+                result=self.attempt(fallback, (), dict(), policy['timeout'])
+                metric['outcome']='stale'
+                return result
+
+            if metric['error'].startswith('timed out'):
+                raise TimeoutError(f'{label} {metric["error"]}')
+
+            raise error
+        finally:
+            metric['elapsed']=time.perf_counter()-start
+
+            self.logger.info(
+                '{label}: {outcome} in {elapsed:.3f}s after {attempts} attempt(s)'.format(
+                    label   = label,
+                    **metric
+                )
+            )
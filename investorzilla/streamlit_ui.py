@@ -12,7 +12,7 @@ import textwrap
 import pandas
 
 # Dependencies available via OS packages:
-# dnf install pandas pyyaml sqlalchemy pandas_datareader
+# dnf install pandas pyyaml sqlalchemy requests
 
 # Other dependencies:
 # pip3 install streamlit[authlib] google-api-python-client
@@ -93,13 +93,14 @@ class InvestorzillaStreamlitApp:
             self.refreshMap=self.interact_refresh()
 
         # investor    refresh
-        #   None         X.     => load
-        #     X          True.  => load
+        #   None         X.     => load from cache
+        #     X          True.  => reuse and revalidate in background
         #     X.         False. => reuse
-        #     None.      False. => load
 
         if True in self.refreshMap.values():
-            streamlit.cache_resource.clear()
+            # Keep serving current data while sources are refreshed in
+            # background and swapped in when completely loaded
+            self.investor().revalidate(self.refreshMap)
 
         # Load domains from Investor internal cache, the Internet or reuse
         # Streamlit memory-cached object
@@ -109,64 +110,72 @@ class InvestorzillaStreamlitApp:
             self.investor.clear()
             self.investor()
 
-        with streamlit.sidebar:
-            if self.authorized() is False and not hasattr(streamlit.user,'name'):
-                self.logger.debug(f"User not authorized, main.")
-                # User not authorized...
-                streamlit.stop()
-
-            # Put controls in the sidebar
-            self.interact_assets()
-            self.interact_exclude_assets()
-            self.interact_start_end()
-            self.interact_currencies()
-            self.interact_benchmarks()
-            self.interact_periods()
-
-            # Bookmark
+        # Render all of this run from the same domains, even if a background
+        # revalidation finishes meanwhile
+        with self.investor().domainsLock:
+            with streamlit.sidebar:
+                if self.investor().revalidating:
+                    streamlit.caption('Refreshing data in background; new data will show up in your next interaction after it finishes.')
+                elif self.investor().revalidationError is not None:
+                    streamlit.warning(f'Last refresh failed, showing previous data: {self.investor().revalidationError}')
+
+                if self.authorized() is False and not hasattr(streamlit.user,'name'):
+                    self.logger.debug(f"User not authorized, main.")
+                    # User not authorized...
+                    streamlit.stop()
+
+                # Put controls in the sidebar
+                self.interact_assets()
+                self.interact_exclude_assets()
+                self.interact_start_end()
+                self.interact_currencies()
+                self.interact_benchmarks()
+                self.interact_periods()
+
+                # Bookmark
+                streamlit.divider()
+                self.current_view()
+
+                # Views
+                streamlit.divider()
+                self.views_links()
+
+                # Logout button
+                if hasattr(streamlit.user,'is_logged_in'):
+                    if streamlit.user.is_logged_in:
+                        streamlit.divider()
+                        streamlit.button("Log out", on_click=streamlit.logout)
+
+
+            # Render main content with plots and tables
+            self.update_content()
+
+            # Page footer stats and signature
             streamlit.divider()
-            self.current_view()
-
-            # Views
-            streamlit.divider()
-            self.views_links()
-
-            # Logout button
-            if hasattr(streamlit.user,'is_logged_in'):
-                if streamlit.user.is_logged_in:
-                    streamlit.divider()
-                    streamlit.button("Log out", on_click=streamlit.logout)
-
-
-        # Render main content with plots and tables
-        self.update_content()
 
-        # Page footer stats and signature
-        streamlit.divider()
-
-        streamlit.caption(
-            'Most recent porfolio data is **{}**'.format(
-                self.investor().portfolio.asof
+            streamlit.caption(
+                'Most recent porfolio data is **{}**'.format(
+                    self.investor().portfolio.asof
+                )
             )
-        )
 
-        if self.investor().wealth_mask_factor is not None:
-            streamlit.caption("Wealth is being masked; balance values and gains are proportional but unreal, rates are real")
+            if self.investor().wealth_mask_factor is not None:
+                streamlit.caption("Wealth is being masked; balance values and gains are proportional but unreal, rates are real")
 
-        now_local = datetime.datetime.now(
-            zoneinfo.ZoneInfo(tzlocal.get_localzone_name())
-        )
+            now_local = datetime.datetime.now(
+                zoneinfo.ZoneInfo(tzlocal.get_localzone_name())
+            )
 
-        streamlit.caption(
-            textwrap.dedent(f"""\
-                Reported on {now_local:%Y-%m-%d %H:%M:%S%Z} 
-                by **[Investorzilla]
-                (https://github.com/avibrazil/investorzilla) 
-                {investorzilla.__version__}**.
-            """)
-            # Make it a one line string
-            .replace('\n','')
-        )
+            streamlit.caption(
+                textwrap.dedent(f"""\
+                    Reported on {now_local:%Y-%m-%d %H:%M:%S%Z} 
+                    by **[Investorzilla]
+                    (https://github.com/avibrazil/investorzilla) 
+                    {investorzilla.__version__}**.
+                """)
+                # Make it a one line string
+                .replace('\n','')
+            )
 
 
 
@@ -178,7 +187,7 @@ class InvestorzillaStreamlitApp:
             assets         = streamlit.session_state.interact_assets,
             exclude_assets = streamlit.session_state.interact_no_assets,
             currency       = streamlit.session_state.interact_currencies,
-            benchmark      = streamlit.session_state.interact_benchmarks['obj'].id,
+            benchmark      = streamlit.session_state.interact_benchmarks['obj'],
             periods        = streamlit.session_state.interact_periods,
             start          = (
                 streamlit.session_state.interact_start_end[0]
@@ -340,18 +349,12 @@ class InvestorzillaStreamlitApp:
     def investor(_self):
         """
         Read config file investorzilla.yaml and load its described portfolio
-        resources from cache or from the Internet. Investor's internal cache
-        is controled by self.refreshMap, which is a dict that looks like:
-
-        dict(
-            portfolio=False,
-            currency_converters=False,
-            benchmarks=False
-        )
+        resources from cache. If cache is empty or doesn't exist, content is
+        loaded from its original source (the Internet).
 
-        Each entry (called domain) defines if content should be reloaded from
-        its (slow) source (the Internet) (True) or from cache (False). If cache
-        is empty or doesn't exist, content is loaded from its original source.
+        Refreshes requested in self.refreshMap don’t go through here. They
+        are made by Investor.revalidate() in background, while this object
+        keeps serving current data.
 
         The Investor object returned by this method is cached by Streamlit and
         will be used as a singleton across all sessions. If one session updates
@@ -368,16 +371,14 @@ class InvestorzillaStreamlitApp:
 
         _self.logger.debug("Loading portfolio from investorzilla.yaml...")
 
+        # Investor also makes the internal fund with all portfolio data for
+        # overall operations, as soon as portfolio and exchange are loaded
         investor = investorzilla.Investor(
             file                 = 'investorzilla.yaml',
-            wealth_mask_factor   = _self.wealth_mask_factor,
-            refreshMap           = _self.refreshMap
+            wealth_mask_factor   = _self.wealth_mask_factor
         )
 
-        _self.logger.debug("Making an internal fund with all portfolio data for overall operations...")
-        investor.portfolio.makeInternalFund(
-            currencyExchange=investor.exchange
-        )
+        _self.logger.debug(f"Loading timings: {investor.timings}")
 
         return investor
 
@@ -389,7 +390,6 @@ class InvestorzillaStreamlitApp:
         items (assets) selected in sidebar.
         """
 
-        fundset=None
         assets=None
         if 'interact_assets' in streamlit.session_state:
             assets=streamlit.session_state.interact_assets
@@ -397,26 +397,6 @@ class InvestorzillaStreamlitApp:
             if 'ALL' in assets:
                 assets.remove('ALL')
 
-        if assets is None or len(assets)==0:
-            assets=self.investor().portfolio.assets()
-            assets=[f[0] for f in assets]
-
-        if 'interact_no_assets' in streamlit.session_state:
-            assets=list(
-                set(assets) -
-                set(streamlit.session_state.interact_no_assets)
-            )
-
-        self.logger.debug("Make a virtual fund (shares and share value) from selected assets...")
-        streamlit.session_state.fund=self.investor().portfolio.getFund(
-            subset           = assets,
-            currencyExchange = streamlit.session_state.exchange
-        )
-
-        streamlit.session_state.fund.setName(top=4)
-
-        p=investorzilla.Fund.periodPairs[streamlit.session_state.interact_periods]
-
         self.start = (
             streamlit.session_state.interact_start_end[0]
             if len(streamlit.session_state.interact_start_end)>0
@@ -428,35 +408,26 @@ class InvestorzillaStreamlitApp:
             else self.investor().portfolio.fund.end
         )
 
-        self.logger.debug(f"Creating reports: ragged, period ({p['period']}), macro period ({p['macroPeriod']}) and integrated to use all over the UI")
-        self.reportRagged=streamlit.session_state.fund.periodicReport(
-            benchmark  = streamlit.session_state.interact_benchmarks['obj'],
-            start      = self.start,
-            end        = self.end,
-        )
-
-        self.reportPeriodic=streamlit.session_state.fund.periodicReport(
-            period     = p['period'],
-            benchmark  = streamlit.session_state.interact_benchmarks['obj'],
-            start      = self.start,
-            end        = self.end,
-        )
-
-        self.reportMacroPeriodic=streamlit.session_state.fund.periodicReport(
-            period     = p['macroPeriod'],
-            benchmark  = streamlit.session_state.interact_benchmarks['obj'],
-            start      = self.start,
-            end        = self.end,
+        # Make a virtual fund (shares and share value) from selected assets,
+        # and its reports: ragged, period, macro period and integrated to use
+        # all over the UI. Reports precomputed by “investorzilla warm” for
+        # this same view are reused.
+        self.logger.debug("Make a virtual fund and its reports from selected assets...")
+        view=self.investor().viewReports(
+            assets         = assets,
+            exclude_assets = streamlit.session_state.get('interact_no_assets',[]),
+            currency       = streamlit.session_state.interact_currencies,
+            benchmark      = streamlit.session_state.interact_benchmarks['obj'],
+            periods        = streamlit.session_state.interact_periods,
+            start          = self.start,
+            end            = self.end,
         )
 
-        self.report=streamlit.session_state.fund.report(
-            precomputedPeriodicReport      = self.reportPeriodic,
-            precomputedMacroPeriodicReport = self.reportMacroPeriodic,
-            period     = streamlit.session_state.interact_periods,
-            benchmark  = streamlit.session_state.interact_benchmarks['obj'],
-            start      = self.start,
-            end        = self.end,
-        )
+        streamlit.session_state.fund = view['fund']
+        self.reportRagged            = view['ragged']
+        self.reportPeriodic          = view['periodic']
+        self.reportMacroPeriodic     = view['macroPeriodic']
+        self.report                  = view['report']
 
 
 
@@ -465,8 +436,9 @@ class InvestorzillaStreamlitApp:
         Render the report
         """
 
-        # Sessions use a copy of the global currency exchange machine
-        streamlit.session_state.exchange=copy.deepcopy(self.investor().exchange)
+        # Sessions use a shallow copy of the global currency exchange machine,
+        # enough because converting it to another currency replaces its data
+        streamlit.session_state.exchange=copy.copy(self.investor().exchange)
         streamlit.session_state.exchange.currency=streamlit.session_state.interact_currencies
 
         self.prepare_fund()
@@ -563,7 +535,7 @@ class InvestorzillaStreamlitApp:
             if len(selected_assets)<1:
                 continue
 
-            exg=copy.deepcopy(self.investor().exchange)
+            exg=copy.copy(self.investor().exchange)
             exg.currency=currency
             fund=self.investor().portfolio.getFund(
                 subset           = selected_assets,
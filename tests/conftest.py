@@ -0,0 +1,44 @@
+import threading
+import http.server
+
+import pytest
+
+from investorzilla.fetch import FetchEngine
+
+
+
+@pytest.fixture
+def serve():
+    """
+    Start local stub HTTP servers for a test. Call with a request handler
+    class and get the base URL of a server running it in a background
+    thread. Servers are shut down when the test ends.
+    """
+    servers=[]
+
+    def start(handler):
+        server=http.server.ThreadingHTTPServer(('127.0.0.1',0), handler)
+        server.daemon_threads=True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+
+        return f'http://127.0.0.1:{server.server_port}'
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+
+@pytest.fixture
+def engine():
+    """
+    The FetchEngine, with its limits restored after the test.
+    """
+    (concurrency, perHost)=(FetchEngine.concurrency, FetchEngine.perHost)
+
+    yield FetchEngine
+
+    FetchEngine.configure(concurrency=concurrency, per_host=perHost)
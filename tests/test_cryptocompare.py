@@ -0,0 +1,169 @@
+import json
+import collections
+import time
+import threading
+import urllib.parse
+import http.server
+
+import pytest
+import requests
+
+import investorzilla
+from investorzilla.httpclient import HTTPClient, HTTPCache
+from investorzilla.scheduler import SourceRunner
+from investorzilla.currency.cryptocompare import (
+    CryptoCompareCurrencyConverter,
+    CryptoCompareCurrencyConverterGroup
+)
+
+
+
+kind='CryptoCompareCurrencyConverter'
+
+
+
+@pytest.fixture
+def fakeCryptoCompare(serve, monkeypatch):
+    """
+    A local fake of CryptoCompare’s daily history API, with 50 days of prices
+    for every coin but BAD, which always fails, and FLAKY, which fails on
+    first request. Returns a dict with number of requests, per coin too,
+    and the highest number of them served at the same time.
+    """
+    stats=dict(requests=0, running=0, peak=0, coins=collections.Counter())
+    lock=threading.Lock()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            query=urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+
+            with lock:
+                stats['requests']+=1
+                stats['coins'][query['fsym'][0]]+=1
+                stats['running']+=1
+                stats['peak']=max(stats['peak'],stats['running'])
+
+            try:
+                time.sleep(0.2)
+            finally:
+                with lock:
+                    stats['running']-=1
+
+            if (
+                    query['fsym'][0]=='BAD' or
+                    (query['fsym'][0]=='FLAKY' and stats['coins']['FLAKY']==1)
+                ):
+                self.send_response(500)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            to=int(query['toTs'][0])//86400*86400
+            since=to-2000*86400
+
+            body=json.dumps(dict(Data=dict(
+                TimeFrom=since,
+                TimeTo=to,
+                Data=[
+                    dict(
+                        time=t, close=(1 if t>to-50*86400 else 0),
+                        high=0, low=0, open=0, volumefrom=0, volumeto=0,
+                        conversionType='', conversionSymbol=''
+                    )
+                    for t in range(since, to+1, 86400)
+                ]
+            ))).encode()
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    monkeypatch.setattr(
+        CryptoCompareCurrencyConverter,
+        'api',
+        serve(Handler) + '/data/v2/histoday?fsym={cfrom}&tsym={cto}&limit=2000&toTs={maxTime}&api_key={key}'
+    )
+
+    return stats
+
+
+
+def test_group_backfills_coins_concurrently(fakeCryptoCompare, engine, tmp_path):
+    engine.configure(per_host=8)
+
+    coins=['AAA', 'BBB', 'CCC', 'DDD', 'EEE']
+    cache=investorzilla.DataCache(f'sqlite:///{tmp_path}/cache.db')
+
+    group=CryptoCompareCurrencyConverterGroup(coins, cache=cache, refresh=True)
+
+    assert fakeCryptoCompare['requests']==len(coins)
+    assert fakeCryptoCompare['peak']==len(coins)
+
+    assert [c.currencyFrom for c in group.converters]==coins
+    assert all(len(c.data)==50 for c in group.converters)
+
+    # One cache entry per coin
+    assert all(len(cache.versions(kind=kind, id=c))==1 for c in coins)
+
+    # Nothing is fetched again from cache
+    CryptoCompareCurrencyConverterGroup(coins, cache=cache)
+    assert fakeCryptoCompare['requests']==len(coins)
+
+
+
+def test_group_caches_coins_that_succeeded(fakeCryptoCompare, tmp_path):
+    cache=investorzilla.DataCache(f'sqlite:///{tmp_path}/cache.db')
+
+    with pytest.raises(requests.HTTPError):
+        CryptoCompareCurrencyConverterGroup(['AAA', 'BAD', 'CCC'], cache=cache)
+
+    assert cache.current(kind=kind, id='AAA') is not None
+    assert cache.current(kind=kind, id='CCC') is not None
+    assert cache.current(kind=kind, id='BAD') is None
+
+
+
+def test_backfill_is_served_by_http_cache(fakeCryptoCompare, monkeypatch, tmp_path):
+    monkeypatch.setattr(
+        HTTPClient,
+        'cache',
+        HTTPCache(tmp_path / 'http', ttl={'127.0.0.1': 3600})
+    )
+
+    first=CryptoCompareCurrencyConverter('AAA', refresh=True)
+
+    # URLs used to change every second
+    time.sleep(1.1)
+
+    second=CryptoCompareCurrencyConverter('AAA', refresh=True)
+
+    assert fakeCryptoCompare['requests']==1
+    assert second.data.equals(first.data)
+
+
+
+def test_group_retry_fetches_only_failed_coins(fakeCryptoCompare, tmp_path):
+    cache=investorzilla.DataCache(f'sqlite:///{tmp_path}/cache.db')
+    runner=SourceRunner(dict(default=dict(retries=2, backoff=0)))
+
+    group=runner.run(
+        'CryptoCompareCurrencyConverterGroup',
+        'coins',
+        CryptoCompareCurrencyConverterGroup,
+        ['AAA', 'FLAKY', 'CCC'],
+        cache   = cache,
+        refresh = True
+    )
+
+    assert runner.metrics['coins']['attempts']==2
+    assert dict(fakeCryptoCompare['coins'])==dict(AAA=1, FLAKY=2, CCC=1)
+    assert [len(c.data) for c in group.converters]==[50, 50, 50]
+
+    # Next refresh fetches everything again
+    CryptoCompareCurrencyConverterGroup(['AAA', 'FLAKY', 'CCC'], cache=cache, refresh=True)
+    assert dict(fakeCryptoCompare['coins'])==dict(AAA=2, FLAKY=3, CCC=2)
@@ -0,0 +1,278 @@
+import pandas
+import pytest
+import sqlalchemy
+
+from investorzilla import DataCache
+
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DataCache(f'sqlite:///{tmp_path}/cache.db', maintenance=None)
+
+
+
+def frame(n=5, offset=0):
+    return pandas.DataFrame(
+        dict(
+            time  = pandas.date_range('2021-01-01', periods=n, freq='D', tz='America/Sao_Paulo'),
+            asset = pandas.Categorical([f'A{i%2}' for i in range(n)]),
+            note  = pandas.array([None if i%3==0 else f'note {i}' for i in range(n)], dtype='string'),
+            value = [float(i+offset) for i in range(n)],
+        )
+    )
+
+
+
+def test_hot_tier_hit_miss_and_invalidation(cache):
+    cache.set('test', 'x', frame())
+
+    before=cache.hotStats()
+
+    (first,age)=cache.get('test', 'x')
+    after=cache.hotStats()
+    assert after['misses']==before['misses']+1
+    assert after['hits']==before['hits']
+
+    (second,age)=cache.get('test', 'x')
+    assert cache.hotStats()['hits']==after['hits']+1
+    assert second.equals(first)
+
+    # Copies are served, so callers can’t change what is kept
+    second.loc[0,'value']=-1
+    assert cache.get('test', 'x')[0].loc[0,'value']==0
+
+    # set() forgets hot versions, so new data is read
+    cache.set('test', 'x', frame(offset=10))
+    misses=cache.hotStats()['misses']
+    (third,age)=cache.get('test', 'x')
+    assert cache.hotStats()['misses']==misses+1
+    assert third.value.tolist()==frame(offset=10).value.tolist()
+
+
+
+def test_get_by_version_and_time_travel(cache):
+    t1=cache.set('test', 'x', frame())
+    t2=cache.set('test', 'x', frame(offset=10))
+
+    assert DataCache.versionKey(cache.current('test', 'x'))==DataCache.versionKey(t2)
+
+    (old,age)=cache.get('test', 'x', time=t1)
+    assert DataCache.versionKey(age)==DataCache.versionKey(t1)
+    assert old.value.tolist()==frame().value.tolist()
+
+    (new,age)=cache.get('test', 'x')
+    assert new.value.tolist()==frame(offset=10).value.tolist()
+
+    # Nothing before the first version
+    assert cache.get('test', 'x', time=t1-pandas.Timedelta(seconds=1))==(None,None)
+
+    # Other ids are independent
+    assert cache.get('test', 'y')==(None,None)
+
+
+
+def test_schema_round_trip(cache):
+    data=frame()
+
+    cache.set('test', 'x', data)
+
+    # Bypass hot tier to read what the database returns
+    DataCache.hot.clear()
+
+    (restored,age)=cache.get('test', 'x')
+
+    assert restored.dtypes.to_dict()==data.dtypes.to_dict()
+    pandas.testing.assert_frame_equal(restored, data)
+
+
+
+def test_unchanged_data_is_not_written_again(cache):
+    t1=cache.set('test', 'x', frame())
+    t2=cache.set('test', 'x', frame())
+
+    registry=cache.versions('test', 'x')
+    assert len(registry)==1
+    assert DataCache.versionKey(registry[DataCache.timeCol].iloc[0])==DataCache.versionKey(t2)
+
+    with cache.getDB().connect() as db:
+        rows=pandas.read_sql('SELECT count(*) AS n FROM datacache__test', con=db).n[0]
+    assert rows==5
+
+    cache.set('test', 'x', frame(offset=1))
+    assert len(cache.versions('test', 'x'))==2
+
+
+
+def chunks():
+    # Chunks with different categories and with ints and floats
+    data=frame(10)
+    first=data.iloc[:4].assign(asset=lambda t: t.asset.astype(str).astype('category'))
+    second=data.iloc[4:].assign(value=lambda t: t.value.astype(int))
+    return [first,second]
+
+
+
+def test_chunks_have_same_digest_as_whole(cache):
+    whole=pandas.concat(chunks())
+
+    cache.setChunks('test', 'chunked', iter(chunks()))
+    cache.set('test', 'whole', whole)
+
+    assert (
+        cache.lastVersion('test', 'chunked')[DataCache.hashCol]==
+        cache.lastVersion('test', 'whole')[DataCache.hashCol]
+    )
+
+    DataCache.hot.clear()
+    (restored,age)=cache.get('test', 'chunked')
+    pandas.testing.assert_frame_equal(restored, whole.reset_index(drop=True))
+
+
+
+def test_unchanged_chunks_are_not_written_again(cache, monkeypatch):
+    cache.setChunks('test', 'x', iter(chunks()))
+
+    writes=[]
+    to_sql=pandas.DataFrame.to_sql
+    def counted(self, *args, **kwargs):
+        writes.append(args[0] if args else kwargs['name'])
+        return to_sql(self, *args, **kwargs)
+    monkeypatch.setattr(pandas.DataFrame, 'to_sql', counted)
+
+    t2=cache.setChunks('test', 'x', iter(chunks()))
+
+    assert writes==[]
+    registry=cache.versions('test', 'x')
+    assert len(registry)==1
+    assert DataCache.versionKey(registry[DataCache.timeCol].iloc[0])==DataCache.versionKey(t2)
+
+
+
+def evolve(versions, rows=20):
+    """
+    Versions of an append-mostly dataset: each one appends a row and changes
+    the value of another.
+    """
+    data=frame(rows)
+    for i in range(versions):
+        yield data.copy()
+        data=pandas.concat([data, frame(rows+i+1).iloc[-1:]], ignore_index=True)
+        data.loc[i,'value']=-100-i
+
+
+
+def test_delta_chain_reconstruct_and_time_travel(tmp_path):
+    cache=DataCache(f'sqlite:///{tmp_path}/cache.db', delta=True, maxChain=10, recycle=20, maintenance=None)
+
+    versions=list(evolve(5))
+    times=[cache.set('test', 'x', v) for v in versions]
+
+    registry=cache.versions('test', 'x')
+    assert registry[DataCache.storageCol].tolist()==['snapshot'] + ['delta']*4
+
+    # Deltas hold just the changed rows
+    with cache.getDB().connect() as db:
+        rows=pandas.read_sql('SELECT count(*) AS n FROM datacache_delta__test', con=db).n[0]
+    assert rows==20 + 4*2
+
+    DataCache.hot.clear()
+
+    (last,age)=cache.get('test', 'x')
+    pandas.testing.assert_frame_equal(last, versions[-1])
+
+    # A version in the middle of the chain
+    DataCache.hot.clear()
+    (middle,age)=cache.get('test', 'x', time=times[2])
+    pandas.testing.assert_frame_equal(middle, versions[2])
+
+
+
+def test_delta_chain_is_compacted(tmp_path):
+    cache=DataCache(f'sqlite:///{tmp_path}/cache.db', delta=True, maxChain=3, recycle=20, maintenance=None)
+
+    versions=list(evolve(5))
+    times=[cache.set('test', 'x', v) for v in versions]
+
+    # A chain that reached maxChain versions starts again from a snapshot
+    registry=cache.versions('test', 'x')
+    assert registry[DataCache.storageCol].tolist()==['snapshot', 'delta', 'delta', 'snapshot', 'delta']
+
+    cache.compact('test', 'x')
+
+    registry=cache.versions('test', 'x')
+    assert registry[DataCache.storageCol].tolist()[-1]=='snapshot'
+
+    for time,version in zip(times,versions):
+        DataCache.hot.clear()
+        pandas.testing.assert_frame_equal(cache.get('test', 'x', time=time)[0], version)
+
+
+
+def statements(cache):
+    """
+    Record SQL statements run on cache’s database.
+    """
+    executed=[]
+
+    sqlalchemy.event.listen(
+        cache.getDB(),
+        'before_cursor_execute',
+        lambda conn, cursor, statement, *args: executed.append(statement.strip())
+    )
+
+    return executed
+
+
+
+def test_background_maintenance_cleans_in_batches(tmp_path):
+    cache=DataCache(f'sqlite:///{tmp_path}/cache.db', recycle=2, maintenance=3600)
+
+    for offset in range(4):
+        for id in ['x','y']:
+            cache.set('test', id, frame(offset=offset+(id=='y')*10))
+
+    # Cleanups are queued, not done inside set()
+    assert {('test','x'),('test','y')} <= {
+        (kind,id) for (url,kind,id) in DataCache.pending if url==cache.url
+    }
+    assert len(cache.versions('test', 'x'))==4
+
+    executed=statements(cache)
+    cache.maintain()
+
+    assert not any(k[0]==cache.url for k in DataCache.pending)
+
+    for id,offset in [('x',0),('y',10)]:
+        assert len(cache.versions('test', id))==2
+        DataCache.hot.clear()
+        assert cache.get('test', id)[0].value.tolist()==frame(offset=offset+3).value.tolist()
+
+    # One DELETE for all ids of the data table, and no VACUUM by default
+    assert len([s for s in executed if s.startswith('DELETE') and 'datacache__test' in s])==1
+    assert any(s.startswith('ANALYZE') for s in executed)
+    assert 'VACUUM' not in executed
+
+
+
+def test_vacuum_is_opt_in(tmp_path):
+    cache=DataCache(f'sqlite:///{tmp_path}/cache.db', recycle=1, maintenance=3600, vacuum=1)
+
+    for offset in range(3):
+        cache.set('test', 'x', frame(offset=offset))
+
+    executed=statements(cache)
+    cache.maintain()
+
+    assert 'VACUUM' in executed
+
+
+
+def test_clean_synchronously_without_maintenance(tmp_path):
+    cache=DataCache(f'sqlite:///{tmp_path}/cache.db', recycle=2, maintenance=None)
+
+    for offset in range(4):
+        cache.set('test', 'x', frame(offset=offset))
+
+    assert len(cache.versions('test', 'x'))==2
+    assert not any(k[0]==cache.url for k in DataCache.pending)
@@ -0,0 +1,97 @@
+import time
+import threading
+import http.server
+
+
+
+
+class InFlight(object):
+    """
+    Counts requests being served, all together and per Host header, and
+    keeps the highest counts seen.
+    """
+    def __init__(self):
+        self.lock    = threading.Lock()
+        self.running = dict()
+        self.peak    = dict()
+
+    def enter(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.running[key]=self.running.get(key,0)+1
+                self.peak[key]=max(self.peak.get(key,0),self.running[key])
+
+    def leave(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.running[key]-=1
+
+
+
+def test_global_and_per_host_limits(serve, engine):
+    inFlight=InFlight()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            keys=('all', self.headers['Host'])
+            inFlight.enter(*keys)
+            try:
+                time.sleep(0.1)
+            finally:
+                inFlight.leave(*keys)
+
+            body=b'{"value": [1]}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    port=serve(Handler).rsplit(':',1)[1]
+
+    # Same server through two host names, each with its own per-host limit
+    hosts=[f'127.0.0.1:{port}', f'localhost:{port}']
+
+    engine.configure(concurrency=3, per_host=2)
+
+    results=engine.gather(*[
+        engine.readJSON(f'http://{host}/data?page={i}')
+        for host in hosts
+        for i in range(6)
+    ])
+
+    assert all(r.value.tolist()==[1] for r in results)
+    assert inFlight.peak['all']==3
+    assert all(inFlight.peak[host]<=2 for host in hosts)
+
+    engine.configure(concurrency=8, per_host=2)
+    inFlight.peak=dict()
+
+    engine.gather(*[
+        engine.get(f'http://{hosts[0]}/data?page={i}')
+        for i in range(6)
+    ])
+
+    assert inFlight.peak[hosts[0]]==2
+
+
+
+def test_gather_returns_exceptions_in_place(serve, engine):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(404 if 'missing' in self.path else 200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    url=serve(Handler)
+
+    results=engine.gather(engine.get(url + '/ok'), engine.get(url + '/missing'))
+
+    assert results[0].status_code==200
+    assert isinstance(results[1], Exception)
@@ -0,0 +1,198 @@
+import re
+import json
+import urllib.parse
+import http.server
+
+import yaml
+import pandas
+import pytest
+
+google=pytest.importorskip('googleapiclient')
+
+from google.oauth2.credentials import Credentials
+
+import investorzilla
+from investorzilla.portfolios import google_sheets
+from investorzilla.portfolios.google_sheets import GoogleSheetsBalanceAndLedger
+
+
+
+sheetID='fake_sheet'
+
+sheets={
+    'Ledger!A:D': [
+        ['Date and time', 'Compound asset', 'Mov BRL', 'Comment'],
+        ['2021-01-02', 'A', '100', ''],
+        ['2022-01-02', 'A', '20', 'more'],
+    ],
+    'Balances!A:C': [
+        ['Date and time', 'Compound asset', 'Balance BRL'],
+        ['2022-06-01', 'A', '130'],
+    ],
+}
+
+sheetStructure=dict(
+    sheet=sheetID,
+    ledger=dict(
+        sheetRange='Ledger!A:D',
+        columns=dict(
+            time     = 'Date and time',
+            asset    = 'Compound asset',
+            comment  = 'Comment',
+            monetary = [dict(currency='BRL', name='Mov BRL')]
+        )
+    ),
+    balance=dict(
+        sheetRange='Balances!A:C',
+        columns=dict(
+            time     = 'Date and time',
+            asset    = 'Compound asset',
+            monetary = [dict(currency='BRL', name='Balance BRL')]
+        )
+    ),
+)
+
+
+
+def values(sheetRange):
+    """
+    Rows of sheets in a range as 'Ledger!A:D', 'Ledger!A1:D1' or 'Ledger!A3:D'
+    """
+    m=re.fullmatch(r'(?P<sheet>.+)!A(?P<first>\d*):[A-Z](?P<last>\d*)', sheetRange)
+    rows=[v for r,v in sheets.items() if r.startswith(m['sheet'] + '!')][0]
+
+    return rows[int(m['first'] or 1)-1 : int(m['last']) if m['last'] else None]
+
+
+
+@pytest.fixture
+def fakeSheetsAPI(serve, monkeypatch, tmp_path):
+    """
+    A local fake of the Sheets API values:batchGet endpoint, a service
+    builder that points to it and saved credentials for our sheet. Returns
+    the list of requested paths and the list of services built.
+    """
+    requests=[]
+    built=[]
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            url=urllib.parse.urlsplit(self.path)
+            requests.append(url.path)
+
+            ranges=urllib.parse.parse_qs(url.query)['ranges']
+
+            body=json.dumps(dict(
+                spreadsheetId=sheetID,
+                valueRanges=[dict(range=r, values=values(r)) for r in ranges]
+            )).encode()
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    endpoint=serve(Handler)
+
+    build=google_sheets.build
+
+    def fakeBuild(*args, **kwargs):
+        built.append(kwargs['credentials'])
+        return build(*args, client_options=dict(api_endpoint=endpoint), **kwargs)
+
+    monkeypatch.setattr(google_sheets, 'build', fakeBuild)
+    monkeypatch.setattr(GoogleSheetsBalanceAndLedger, 'services', dict())
+
+    monkeypatch.chdir(tmp_path)
+    with open('google-account-credentials.yaml', 'w') as f:
+        yaml.dump(
+            {
+                sheetID: Credentials(
+                    token         = 'token',
+                    refresh_token = 'refresh',
+                    client_id     = 'client',
+                    client_secret = 'secret',
+                    token_uri     = endpoint + '/token',
+                )
+            },
+            f
+        )
+
+    return (requests, built)
+
+
+
+def test_ledger_and_balance_in_one_request(fakeSheetsAPI):
+    (requests, built)=fakeSheetsAPI
+
+    portfolio=GoogleSheetsBalanceAndLedger(kind='test', sheetStructure=sheetStructure)
+
+    assert requests==[f'/v4/spreadsheets/{sheetID}/values:batchGet']
+    assert list(portfolio.ledger.BRL)==[100, 20]
+    assert list(portfolio.balance.BRL)==[130]
+
+
+
+def test_service_is_reused_across_refreshes(fakeSheetsAPI):
+    (requests, built)=fakeSheetsAPI
+
+    first=GoogleSheetsBalanceAndLedger(kind='test', sheetStructure=sheetStructure)
+    second=GoogleSheetsBalanceAndLedger(kind='test', sheetStructure=sheetStructure)
+
+    # Each refresh loads credentials again from file, as other objects
+    assert first.creds[sheetID] is not second.creds[sheetID]
+
+    assert len(requests)==2
+    assert len(built)==1
+
+
+
+def test_incremental_refresh_writes_only_new_rows(fakeSheetsAPI, monkeypatch, tmp_path):
+    cache=investorzilla.DataCache(f'sqlite:///{tmp_path}/cache.db', delta=True, maintenance=None)
+    structure=dict(sheetStructure, incremental=True)
+
+    def load():
+        return GoogleSheetsBalanceAndLedger(
+            kind           = 'test',
+            sheetStructure = structure,
+            cache          = cache,
+            refresh        = True
+        )
+
+    load()
+
+    monkeypatch.setitem(
+        sheets,
+        'Ledger!A:D',
+        sheets['Ledger!A:D'] + [['2023-01-02', 'A', '7', '']]
+    )
+
+    # New rows are written without comparing data with its parent version
+    def changedRows(parent, data):
+        raise AssertionError('parent version was compared')
+
+    monkeypatch.setattr(cache, 'changedRows', changedRows)
+
+    portfolio=load()
+    assert list(portfolio.ledger.BRL)==[100, 20, 7]
+
+    [parent,last]=cache.versions('gsheet•test__ledger', sheetID).to_dict('records')
+    assert last[cache.storageCol]=='delta'
+    assert last[cache.parentCol]==parent[cache.timeCol]
+
+    with cache.getDB().connect() as db:
+        written=pandas.read_sql(
+            f'SELECT * FROM "datacache_delta__gsheet•test__ledger"',
+            db
+        )
+
+    assert (written[cache.timeCol]==last[cache.timeCol]).sum()==1
+
+    # Reconstructed from the delta chain
+    investorzilla.DataCache.hot.clear()
+    (ledger,age)=cache.get('gsheet•test__ledger', sheetID)
+    assert list(ledger.BRL)==[100, 20, 7]
@@ -0,0 +1,81 @@
+import http.server
+
+import pytest
+
+from investorzilla.httpclient import HTTPClient, HTTPCache
+from investorzilla.marketindex.federal_reserve import FREDMarketIndex
+
+
+
+@pytest.fixture
+def fakeFRED(serve, monkeypatch):
+    """
+    A local fake of FRED’s CSV download. Returns the list of requested
+    paths.
+    """
+    requests=[]
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append(self.path)
+
+            body=b'observation_date,SP500\n2020-01-01,100\n2020-01-02,.\n2020-01-03,110\n'
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/csv')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    monkeypatch.setattr(FREDMarketIndex, 'api', serve(Handler) + '/graph/fredgraph.csv')
+
+    return requests
+
+
+
+def test_cache_serves_same_url_within_ttl(fakeFRED, monkeypatch, tmp_path):
+    monkeypatch.setattr(
+        HTTPClient,
+        'cache',
+        HTTPCache(tmp_path / 'http', ttl={'127.0.0.1': 3600})
+    )
+
+    first=FREDMarketIndex('SP500', refresh=True)
+    second=FREDMarketIndex('SP500', refresh=True)
+
+    assert fakeFRED==['/graph/fredgraph.csv?id=SP500']
+    assert first.data.value.tolist()==[100, 100, 110]
+    assert 'DATE' not in first.data.columns
+    assert second.data.equals(first.data)
+
+
+
+def test_no_cache_without_ttl(fakeFRED, monkeypatch, tmp_path):
+    monkeypatch.setattr(HTTPClient, 'cache', HTTPCache(tmp_path / 'http', ttl=0))
+
+    FREDMarketIndex('SP500', refresh=True)
+    FREDMarketIndex('SP500', refresh=True)
+
+    assert len(fakeFRED)==2
+
+
+
+def test_configure_keeps_session_unless_pool_changes(monkeypatch):
+    monkeypatch.setattr(HTTPClient, 'timeout', HTTPClient.timeout)
+    monkeypatch.setattr(HTTPClient, 'poolSize', HTTPClient.poolSize)
+
+    session=HTTPClient.getSession()
+
+    # As every Investor does when built
+    HTTPClient.configure(timeout=60)
+    HTTPClient.configure(pool_size=HTTPClient.poolSize)
+
+    assert HTTPClient.getSession() is session
+    assert HTTPClient.timeout[1]==60
+
+    HTTPClient.configure(pool_size=HTTPClient.poolSize+1)
+
+    assert HTTPClient.getSession() is not session
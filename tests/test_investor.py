@@ -0,0 +1,236 @@
+import pickle
+
+import yaml
+import pandas
+import pytest
+
+import investorzilla
+from investorzilla.portfolios.uri import URIBalanceOrLedger
+
+
+
+def series(value):
+    return pandas.DataFrame(
+        dict(value=float(value)),
+        index=pandas.Index(
+            pandas.date_range('2021-01-01', '2022-03-01', freq='D', tz='UTC'),
+            name='time'
+        )
+    )
+
+
+
+class FakeConverter(investorzilla.CurrencyConverter):
+    """
+    USD to BRL at a rate that grows on each refresh from source.
+    """
+    refreshes=0
+
+    def __init__(self, currencyFrom, cache=None, refresh=False):
+        super().__init__(
+            currencyFrom = currencyFrom,
+            currencyTo   = 'BRL',
+            kind         = 'FakeConverter',
+            id           = currencyFrom,
+            cache        = cache,
+            refresh      = refresh
+        )
+
+
+
+    def refreshData(self):
+        FakeConverter.refreshes+=1
+        self.data=series(4+FakeConverter.refreshes)
+
+
+
+class FakeBenchmark(investorzilla.MarketIndex):
+    """
+    A benchmark whose source fails while failing is set.
+    """
+    failing=False
+
+    def __init__(self, name, cache=None, refresh=False):
+        super().__init__(kind='FakeBenchmark', id=name, currency='BRL', cache=cache, refresh=refresh)
+
+
+
+    def refreshData(self):
+        if FakeBenchmark.failing:
+            raise ConnectionError('source is down')
+
+        self.data=series(100)
+        self.data['rate']=0.01
+
+
+
+@pytest.fixture
+def config(tmp_path):
+    """
+    Write an investorzilla.yaml with a local portfolio and fake converter and
+    benchmark, and return its path.
+    """
+    FakeConverter.refreshes=0
+    FakeBenchmark.failing=False
+
+    (tmp_path / 'ledger.csv').write_text(
+        'Date,Fund,Mov BRL,Mov USD,Note\n2021-01-02,A,100,,\n2021-03-02,B,,50,\n2022-01-02,A,20,,\n'
+    )
+    (tmp_path / 'balance.csv').write_text(
+        'Date,Fund,Balance BRL,Balance USD\n2021-02-02,A,105,\n2021-04-02,B,,52\n2022-02-02,A,130,\n'
+    )
+
+    def part(kind, columns):
+        return dict(
+            type   = URIBalanceOrLedger,
+            params = dict(
+                URI            = str(tmp_path / f'{kind}.csv'),
+                kind           = f'portfolio_{kind}',
+                sheetStructure = {kind: dict(columns=columns)}
+            )
+        )
+
+    file=tmp_path / 'investorzilla.yaml'
+    file.write_text(
+        yaml.dump(
+            dict(
+                currency            = 'BRL',
+                cache_database      = f'sqlite:///{tmp_path}/cache.db',
+                source_policies     = dict(default=dict(retries=0)),
+                portfolio           = [
+                    part('ledger', dict(
+                        time     = 'Date',
+                        asset    = 'Fund',
+                        comment  = 'Note',
+                        monetary = [
+                            dict(currency='BRL', name='Mov BRL'),
+                            dict(currency='USD', name='Mov USD'),
+                        ]
+                    )),
+                    part('balance', dict(
+                        time     = 'Date',
+                        asset    = 'Fund',
+                        monetary = [
+                            dict(currency='BRL', name='Balance BRL'),
+                            dict(currency='USD', name='Balance USD'),
+                        ]
+                    )),
+                ],
+                currency_converters = [
+                    dict(type=FakeConverter, params=dict(currencyFrom='USD')),
+                ],
+                benchmarks          = [
+                    dict(kind='from_currency_converter', from_to='USDBRL'),
+                    dict(type=FakeBenchmark, params=dict(name='CDI')),
+                ],
+            )
+        )
+    )
+
+    return str(file)
+
+
+
+def test_revalidate_waits_for_readers(config):
+    investor=investorzilla.Investor(config)
+    portfolio=investor.portfolio
+    assert investor.exchange.data['USD'].iloc[-1]==5
+
+    with investor.domainsLock:
+        revalidation=investor.revalidate()
+
+        # Loading is done long before this, but swap waits for the reader
+        revalidation.join(timeout=3)
+        assert revalidation.is_alive()
+        assert investor.portfolio is portfolio
+        assert investor.exchange.data['USD'].iloc[-1]==5
+
+    revalidation.join()
+
+    assert investor.revalidationError is None
+    assert investor.portfolio is not portfolio
+    assert investor.exchange.data['USD'].iloc[-1]==6
+    assert investor.viewReports()['report'] is not None
+
+
+
+def test_load_domains(config):
+    investor=investorzilla.Investor(config)
+
+    benchmarks={str(b['obj']): b['obj'] for b in investor.benchmarks}
+    assert sorted(benchmarks)==['[BRL] CDI', '[BRL] USDBRL']
+
+    # Derived from the converter, so only after it was loaded
+    assert benchmarks['[BRL] USDBRL'].getData()['value'].iloc[-1]==5
+    assert benchmarks['[BRL] USDBRL'].currencyConverter is investor.currency_converters[0]['obj']
+
+    assert investor.portfolio.fund is not None
+    assert {m['outcome'] for m in investor.metrics.values()}=={'ok'}
+
+    # A failing source is loaded from cache while others are refreshed
+    FakeBenchmark.failing=True
+    refreshed=investorzilla.Investor(
+        config,
+        refreshMap=dict(currency_converters=True, benchmarks=True)
+    )
+
+    assert refreshed.metrics['benchmarks:1']['outcome']=='stale'
+    assert refreshed.metrics['currency_converters:0']['outcome']=='ok'
+
+    benchmarks={str(b['obj']): b['obj'] for b in refreshed.benchmarks}
+    assert benchmarks['[BRL] CDI'].getData()['value'].iloc[-1]==100
+    assert benchmarks['[BRL] USDBRL'].getData()['value'].iloc[-1]==6
+
+
+
+def test_view_reports(config, monkeypatch):
+    investor=investorzilla.Investor(config)
+    cache=investor.cache
+
+    def saved():
+        with cache.getDB().connect() as db:
+            rows=pandas.read_sql(
+                f'SELECT * FROM {cache.processedTable} WHERE "{cache.kindCol}"=\'investor_view\'',
+                db
+            )
+
+        return [
+            (row[cache.timeCol], pickle.loads(bytes(row[cache.dataCol])))
+            for _,row in rows.iterrows()
+        ]
+
+    hits=[]
+    getProcessed=cache.getProcessed
+
+    def spy(kind, *args, **kwargs):
+        found=getProcessed(kind, *args, **kwargs)
+        if kind=='investor_view':
+            hits.append(found is not None)
+        return found
+
+    monkeypatch.setattr(cache, 'getProcessed', spy)
+
+    # Shared exchange is not converted along with the view
+    made=investor.viewReports(assets='A', currency='USD', save=True)
+    assert made['fund'].currency=='USD'
+    assert investor.exchange.currency=='BRL'
+    assert investor.exchange.data['USD'].iloc[-1]==5
+
+    # Only report frames are saved
+    [(version, reports)]=saved()
+    assert sorted(reports)==['macroPeriodic', 'periodic', 'ragged', 'report']
+
+    investorzilla.DataCache.hot.clear()
+    again=investor.viewReports(assets='A', currency='USD')
+    assert hits==[False, True]
+    assert again['fund'].currency=='USD'
+    pandas.testing.assert_frame_equal(again['report'], made['report'])
+
+    assert investor.viewReports(assets='A', currency='USD', withFund=False)['fund'] is None
+
+    # Views made from older data are deleted when new ones are saved
+    investor.revalidate(dict(currency_converters=True)).join()
+    investor.viewReports(assets='B', save=True)
+
+    [(newer, reports)]=saved()
+    assert newer>version
@@ -0,0 +1,65 @@
+import pandas
+
+import investorzilla
+from investorzilla import MarketIndex
+
+
+
+class FakeIndex(MarketIndex):
+    """
+    Counts how many times raw data was processed, and processes it according
+    to isRate, through a helper.
+    """
+    processed=0
+
+    def __init__(self, isRate, cache):
+        super().__init__(kind='FakeIndex', id='FAKE', currency='USD', isRate=isRate, cache=cache)
+
+
+
+    def refreshData(self):
+        self.data=pandas.DataFrame(
+            dict(value=[1.0, 2.0, 4.0]),
+            index=pandas.date_range('2021-01-01', periods=3, tz='UTC')
+        )
+
+
+
+    def scale(self):
+        return 100 if self.isRate else 1
+
+
+
+    def processData(self):
+        FakeIndex.processed+=1
+        self.data=self.data.assign(value=self.data.value * self.scale())
+
+
+
+def test_params_invalidate_processed_snapshot(tmp_path):
+    cache=investorzilla.DataCache(f'sqlite:///{tmp_path}/cache.db', maintenance=None)
+    FakeIndex.processed=0
+
+    first=FakeIndex(isRate=False, cache=cache)
+    assert FakeIndex.processed==1
+
+    # Same parameters reuse the snapshot
+    again=FakeIndex(isRate=False, cache=cache)
+    assert FakeIndex.processed==1
+    pandas.testing.assert_frame_equal(again.data, first.data)
+
+    # A parameter that shapes processed data doesn't get a stale snapshot
+    rate=FakeIndex(isRate=True, cache=cache)
+    assert FakeIndex.processed==2
+    assert rate.data.value.tolist()==[100.0, 200.0, 400.0]
+
+
+
+def test_helpers_are_part_of_fingerprint(monkeypatch, tmp_path):
+    index=FakeIndex(isRate=False, cache=None)
+    before=index.fingerprint()
+
+    assert FakeIndex.scale in index.processors()
+
+    monkeypatch.setattr(FakeIndex, 'scale', lambda self: 10)
+    assert index.fingerprint()!=before
@@ -0,0 +1,56 @@
+import pandas
+
+import investorzilla
+from investorzilla import Portfolio
+from investorzilla.portfolios.uri import URIBalanceOrLedger
+
+
+
+def test_typeRawData_parses_homogeneous_times():
+    table=pandas.DataFrame({'time': ['2021-01-02', '2022-01-02 10:00']})
+
+    typed=Portfolio.typeRawData(table)
+
+    assert pandas.api.types.is_datetime64_any_dtype(typed.time)
+
+
+
+def test_typeRawData_keeps_mixed_tz_as_strings():
+    table=pandas.DataFrame(
+        {'time': ['2021-01-02', '2021-03-02T10:00:00-03:00', '2022-01-02 12:00']}
+    )
+
+    typed=Portfolio.typeRawData(table)
+
+    assert typed.time.tolist()==table.time.tolist()
+
+
+
+def test_ledger_with_mixed_tz_loads(tmp_path):
+    csv=tmp_path / 'ledger.csv'
+    csv.write_text(
+        'Date,Fund,Mov BRL,Note\n'
+        '2021-01-02,A,100,\n'
+        '2021-03-02T10:00:00-03:00,B,50,\n'
+        '2022-01-02 12:00,A,20,\n'
+    )
+
+    portfolio=URIBalanceOrLedger(
+        URI            = str(csv),
+        kind           = 'portfolio_ledger',
+        sheetStructure = dict(
+            ledger=dict(
+                columns=dict(
+                    time     = 'Date',
+                    asset    = 'Fund',
+                    comment  = 'Note',
+                    monetary = [dict(currency='BRL', name='Mov BRL')]
+                )
+            )
+        ),
+        cache          = investorzilla.DataCache(f'sqlite:///{tmp_path}/cache.db'),
+        refresh        = True
+    )
+
+    assert portfolio.ledger.shape[0]==3
+    assert str(portfolio.ledger.time.dt.tz)=='UTC'
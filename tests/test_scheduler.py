@@ -0,0 +1,93 @@
+import time
+import threading
+
+import pytest
+
+from investorzilla.scheduler import SourceRunner, TaskGraph
+
+
+
+class Tracker(object):
+    """
+    A loader that counts calls and how many of them run at the same time.
+    """
+    def __init__(self, duration=0, failures=0):
+        self.duration = duration
+        self.failures = failures
+        self.calls    = 0
+        self.running  = 0
+        self.peak     = 0
+        self.lock     = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.calls+=1
+            call=self.calls
+            self.running+=1
+            self.peak=max(self.peak,self.running)
+
+        try:
+            time.sleep(self.duration)
+            if call<=self.failures:
+                raise ValueError(f'failure {call}')
+            return call
+        finally:
+            with self.lock:
+                self.running-=1
+
+
+
+def test_retries_after_exceptions():
+    runner=SourceRunner(dict(default=dict(retries=2, backoff=0)))
+    loader=Tracker(failures=2)
+
+    assert runner.run('provider', 'source', loader)==3
+    assert runner.metrics['source']['outcome']=='retried'
+    assert runner.metrics['source']['attempts']==3
+
+
+
+def test_timeout_is_not_retried_and_keeps_slot():
+    runner=SourceRunner(dict(default=dict(concurrency=1, timeout=0.2, retries=2, backoff=0)))
+    loader=Tracker(duration=0.6)
+
+    with pytest.raises(TimeoutError):
+        runner.run('provider', 'slow', loader)
+
+    assert loader.calls==1
+    assert runner.metrics['slow']['attempts']==1
+
+    # The abandoned attempt still runs, so the next source of the same
+    # provider waits for it
+    start=time.perf_counter()
+    runner.run('provider', 'next', Tracker())
+    assert time.perf_counter()-start > 0.2
+    assert loader.running==0
+
+
+
+def test_timeout_uses_fallback():
+    runner=SourceRunner(dict(default=dict(timeout=0.1, retries=2, backoff=0)))
+
+    result=runner.run('provider', 'slow', Tracker(duration=0.5), fallback=lambda: 'cached')
+
+    assert result=='cached'
+    assert runner.metrics['slow']['outcome']=='stale'
+
+
+
+def test_graph_skips_dependents_of_failed_tasks():
+    def fail():
+        raise ValueError('failed')
+
+    graph=TaskGraph()
+    graph.add('a', lambda: 1)
+    graph.add('b', fail)
+    graph.add('c', lambda: 3, after=['a'])
+    graph.add('d', lambda: 4, after=['b'])
+
+    with pytest.raises(ValueError):
+        graph.run()
+
+    assert graph.results=={'a': 1, 'c': 3}
+    assert graph.skipped=={'d'}
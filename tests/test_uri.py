@@ -0,0 +1,147 @@
+import os
+import gzip
+import time
+import functools
+import http.server
+
+import pandas
+import pytest
+import requests
+
+import investorzilla
+from investorzilla.httpclient import HTTPClient
+from investorzilla.portfolios.uri import URIBalanceOrLedger
+
+
+
+sheetStructure=dict(
+    ledger=dict(
+        columns=dict(
+            time     = 'Date',
+            asset    = 'Fund',
+            comment  = 'Note',
+            monetary = [dict(currency='BRL', name='Mov BRL')]
+        )
+    )
+)
+
+
+
+def stubFileServer(serve, directory, statuses):
+    """
+    Serve files of directory with Python’s own HTTP server, which answers
+    If-Modified-Since with 304, recording status of each response.
+    """
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def log_request(self, code='-', size='-'):
+            statuses.append(int(code))
+
+    return serve(functools.partial(Handler, directory=str(directory)))
+
+
+
+def load(url, cache):
+    return URIBalanceOrLedger(
+        URI            = url,
+        kind           = 'portfolio_ledger',
+        sheetStructure = sheetStructure,
+        cache          = cache,
+        refresh        = True
+    )
+
+
+
+def test_conditional_get(serve, tmp_path):
+    csv=tmp_path / 'ledger.csv'
+    csv.write_text('Date,Fund,Mov BRL,Note\n2021-01-02,A,100,\n2022-01-02,A,20,\n')
+
+    statuses=[]
+    url=stubFileServer(serve, tmp_path, statuses) + '/ledger.csv'
+    cache=investorzilla.DataCache(f'sqlite:///{tmp_path}/cache.db')
+
+    # First fetch gets content and caches it along with its validators
+    first=load(url, cache)
+    assert statuses==[200]
+    version=cache.current(kind='uri•portfolio_ledger__ledger', id=url)
+    assert version is not None
+
+    # Second fetch is answered with 304 and reuses cached data
+    second=load(url, cache)
+    assert statuses==[200, 304]
+    assert second.ledger.equals(first.ledger)
+    assert cache.current(kind='uri•portfolio_ledger__ledger', id=url)==version
+
+    # A changed file is fetched again
+    csv.write_text('Date,Fund,Mov BRL,Note\n2021-01-02,A,100,\n2022-01-02,A,20,\n2023-01-02,B,7,\n')
+    later=os.stat(csv).st_mtime+10
+    os.utime(csv, (later, later))
+
+    third=load(url, cache)
+    assert statuses==[200, 304, 200]
+    assert third.ledger.shape[0]==3
+
+
+
+def test_chunked_read_matches_whole(tmp_path):
+    csv=tmp_path / 'ledger.csv'
+    csv.write_text(
+        'Date,Fund,Mov BRL,Note\n' +
+        ''.join(f'2021-01-{1+i%28:02d},F{(i*7)%5},{i},{"x" if i%4 else ""}\n' for i in range(50))
+    )
+
+    cache=investorzilla.DataCache(f'sqlite:///{tmp_path}/cache.db', maintenance=None)
+
+    def load(kind, structure):
+        return URIBalanceOrLedger(
+            URI            = str(csv),
+            kind           = kind,
+            sheetStructure = structure,
+            cache          = cache,
+            refresh        = True
+        )
+
+    whole=load('whole', sheetStructure)
+    chunked=load('chunked', dict(chunksize=7, **sheetStructure))
+
+    pandas.testing.assert_frame_equal(chunked.ledger, whole.ledger)
+
+    # File touched but unchanged is read again, and no new version is made
+    later=os.stat(csv).st_mtime+10
+    os.utime(csv, (later, later))
+
+    for kind,structure,first in [
+                ('whole',   sheetStructure,                     whole),
+                ('chunked', dict(chunksize=7, **sheetStructure), chunked),
+            ]:
+        again=load(kind, structure)
+        assert len(cache.versions(f'uri•{kind}__ledger', str(again.URI)))==1
+        pandas.testing.assert_frame_equal(again.ledger, first.ledger)
+
+
+
+def test_compressed_remote_file(serve, tmp_path):
+    with gzip.open(tmp_path / 'ledger.csv.gz', 'wt') as f:
+        f.write('Date,Fund,Mov BRL,Note\n2021-01-02,A,100,\n2022-01-02,A,20,\n')
+
+    url=stubFileServer(serve, tmp_path, []) + '/ledger.csv.gz'
+
+    portfolio=load(url, investorzilla.DataCache(f'sqlite:///{tmp_path}/cache.db'))
+
+    assert portfolio.ledger.BRL.tolist()==[100, 20]
+
+
+
+def test_hung_remote_file_times_out(serve, monkeypatch, tmp_path):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(3)
+
+        def log_message(self, *args):
+            pass
+
+    monkeypatch.setattr(HTTPClient, 'timeout', (1, 0.5))
+
+    start=time.perf_counter()
+    with pytest.raises(requests.exceptions.Timeout):
+        load(serve(Handler) + '/ledger.csv', None)
+    assert time.perf_counter()-start < 2